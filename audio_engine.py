@@ -0,0 +1,767 @@
+# -*- coding: utf-8 -*-
+"""
+播放引擎
+伴奏和人声解码后交给同一个混音器，只打开一个音频输出设备；
+当前平台无法解码某个音轨时，退回到两个QMediaPlayer分别播放。
+声卡输出在单独的音频线程里拉取数据，混音和变速变调不受界面线程卡顿影响。
+QtMultimedia只在真正打开声卡或用到系统播放器时才导入，
+配合NullAudioOutput可以在没有声卡的环境里运行
+"""
+
+import os
+import time
+
+import numpy as np
+from PyQt5.QtCore import Qt, QObject, QThread, QTimer, QUrl, pyqtSignal
+
+from audio_io import (SAMPLE_RATE, BYTES_PER_FRAME, DecodeError,
+                      frames_to_ms, ms_to_frames)
+from audio_sink import (create_output, ThreadedOutput, ACTIVE_STATE, SUSPENDED_STATE,
+                        STOPPED_STATE, IDLE_STATE)
+from mixer import StemMixer
+from dsp import MIN_TEMPO, MAX_TEMPO
+from pcm_cache import PcmCache, variant_key, source_descriptor
+from drift_monitor import DriftMonitor, ACTION_RATE, ACTION_SEEK
+from settings_store import file_fingerprint
+
+# 输出缓冲约90ms，既不容易断音，拖动进度时也不会有明显延迟
+OUTPUT_BUFFER_FRAMES = 4096
+
+# 播放中位置通知的间隔，由声卡回调驱动，暂停和停止时不会触发
+POSITION_NOTIFY_MS = 100
+# 回退模式下系统播放器的音量最多每隔这么久更新一次（约一个音频块）
+GAIN_UPDATE_MS = 20
+# 回退模式下系统播放器最多每隔这么久跳转一次，期间的跳转请求只保留最后一个
+SEEK_INTERVAL_MS = 50
+# 电平表刷新间隔，最多每秒25帧
+METER_INTERVAL_MS = 40
+
+# 预加载下一首时预读开头几秒，切歌时这部分已经在内存里
+PRELOAD_SECONDS = 5
+
+MODE_MIX = "mix"
+MODE_MEDIA = "media"
+
+# 播放状态，取值与QMediaPlayer.State一致
+STOPPED = 0
+PLAYING = 1
+PAUSED = 2
+
+
+def describe_stem(cache, path, fingerprints):
+    """音轨的内容指纹、缓存用的文件信息和波形文件路径，读不了时返回None
+
+    要读文件，放在后台线程里调用；指纹按 (路径, 修改时间, 大小) 记在fingerprints里，
+    同一个文件不重复读
+    """
+    try:
+        stat = os.stat(path)
+        stamp = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        fingerprint = fingerprints.get(stamp)
+        if fingerprint is None:
+            fingerprint = fingerprints[stamp] = file_fingerprint(path)
+        cache_stamp = cache.stamp(path)
+    except OSError as e:
+        print(f"无法读取 {path}: {e}")
+        return None
+    return {'fingerprint': fingerprint, 'stamp': cache_stamp,
+            'peaks_path': cache.peaks_path(path, cache_stamp)}
+
+
+class StemPreloader(QThread):
+    """后台打开两个音轨（必要时解码进缓存），并预读开头几秒
+
+    检查文件是否存在、计算内容指纹也放在这里：休眠的U盘和网络盘唤醒要好几秒，
+    不能卡住界面线程
+    """
+
+    loaded = pyqtSignal(object, object, object)   # 文件路径列表, 音轨数据列表, 音轨信息列表
+
+    def __init__(self, cache, files, parent=None, opened=None, skip_missing=False,
+                 fingerprints=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.files = files
+        # 已经打开的音轨 {路径: 音轨数据}，直接沿用
+        self.opened = opened or {}
+        # 不存在的文件当作未选择（恢复上次的音轨时用）
+        self.skip_missing = skip_missing
+        self.fingerprints = {} if fingerprints is None else fingerprints
+
+    def run(self):
+        sources = []
+        infos = []
+        files = list(self.files)
+        for index, path in enumerate(files):
+            stem = None
+            if path and self.skip_missing and not os.path.exists(path):
+                print(f"文件不存在: {path}")
+                files[index] = ""
+            elif path in self.opened:
+                stem = self.opened[path]
+            elif path:
+                try:
+                    stem = self.cache.load(path)
+                    # 触发内存映射的页面读取
+                    np.asarray(stem[:PRELOAD_SECONDS * SAMPLE_RATE]).max(initial=0)
+                except (DecodeError, OSError) as e:
+                    print(f"预加载 {path} 出错: {e}")
+                    stem = None
+            sources.append(stem)
+            infos.append(describe_stem(self.cache, files[index], self.fingerprints)
+                         if files[index] else None)
+        self.loaded.emit(files, sources, infos)
+
+
+class MixEngine(QObject):
+    """单时钟播放引擎，接口和QMediaPlayer保持一致（状态取值与QMediaPlayer.State相同）
+
+    output为None时在音频线程里打开系统声卡，也可以传入NullAudioOutput
+    （直接在当前线程里拉取数据，测试时结果可以复现）或ThreadedOutput
+    """
+
+    stateChanged = pyqtSignal(int)
+    positionChanged = pyqtSignal(int)
+    durationChanged = pyqtSignal(int)
+    trackChanged = pyqtSignal()
+    levelsChanged = pyqtSignal(object)   # [(伴奏RMS, 峰值), (人声RMS, 峰值)]
+    pairLoaded = pyqtSignal()
+    finished = pyqtSignal()
+
+    def __init__(self, parent=None, output=None):
+        super().__init__(parent)
+        self.files = ["", ""]
+        self.mode = MODE_MIX
+        self._state = STOPPED
+
+        self.mixer = StemMixer(self)
+        # 不经过QIODevice自己的预读缓冲：否则跳转后还会先播出缓冲里约90ms的旧数据
+        self.mixer.open(StemMixer.ReadOnly | StemMixer.Unbuffered)
+        # 切歌发生在声卡取数据的回调里，排队处理避免在回调中重入
+        self.mixer.trackChanged.connect(self._on_track_changed, Qt.QueuedConnection)
+
+        # 播放列表的下一首：(文件路径列表, 音轨数据列表, 音轨信息列表)
+        self._next = None
+        self._preloader = None
+        self._pair_loader = None
+        self.last_switch_ms = 0.0
+
+        # 系统声卡（连同QtMultimedia）到第一次播放或调用open_output时才打开，不拖慢启动
+        self._output = None
+        if output is not None:
+            self._attach_output(output)
+        self._last_position = -1
+        self._last_duration = -1
+
+        # 解码结果缓存，重复打开同一个音轨时直接内存映射
+        self.cache = PcmCache()
+
+        # 变速/变调设置；有预渲染好的版本时直接播放它，混音器不再实时处理，
+        # 这时混音器里的1帧对应原曲的time_scale帧
+        self.sources = [None, None]
+        # 每个音轨的内容指纹和波形文件路径，由加载线程算好；指纹缓存也在这里
+        self.stem_info = [None, None]
+        self._fingerprints = {}
+        self._tempo = 1.0
+        self._semitones = [0, 0]
+        self.time_scale = 1.0
+        self.rendered = False
+
+        # 回退模式用的两个播放器，用到时才创建
+        self._players = None
+        self.drift = DriftMonitor()
+        self._media_loop = None
+        self._rate_trimmed = False
+        self._gain_timer = QTimer(self)
+        self._gain_timer.setSingleShot(True)
+        self._gain_timer.setInterval(GAIN_UPDATE_MS)
+        self._gain_timer.timeout.connect(self._apply_player_gains)
+        self._media_seek_target = None
+        self._seek_timer = QTimer(self)
+        self._seek_timer.setSingleShot(True)
+        self._seek_timer.setInterval(SEEK_INTERVAL_MS)
+        self._seek_timer.timeout.connect(self._apply_media_seek)
+
+        # 跳转请求数和实际让声卡/系统播放器跳转的次数
+        self.seek_requests = 0
+        self.backend_seeks = 0
+
+        # 电平由混音器在混音时顺带算出，这里只按固定帧率取走并通知界面
+        self._meter_timer = QTimer(self)
+        self._meter_timer.setInterval(METER_INTERVAL_MS)
+        self._meter_timer.timeout.connect(self._emit_levels)
+
+    # ---- 输出设备 ----
+
+    @property
+    def output(self):
+        """输出设备，还没打开时现在打开"""
+        if self._output is None:
+            self._attach_output(ThreadedOutput(create_output))
+        return self._output
+
+    def open_output(self):
+        """提前打开系统声卡，第一次播放时不用等"""
+        return self.output
+
+    def _attach_output(self, output):
+        output.setParent(self)
+        output.setBufferSize(OUTPUT_BUFFER_FRAMES * BYTES_PER_FRAME)
+        output.stateChanged.connect(self._on_output_state_changed)
+        output.setNotifyInterval(POSITION_NOTIFY_MS)
+        output.notify.connect(self._on_tick)
+        self._output = output
+
+    # ---- 加载 ----
+
+    def set_stem(self, index, path):
+        """加载音轨，index 0 为伴奏，1 为人声"""
+        self._pair_loader = None
+        self.stop()
+        self.clear_loop()
+        self.files[index] = path
+        self.drift.reset(self.files)
+        try:
+            self.sources[index] = self.cache.load(path) if path else None
+        except DecodeError as e:
+            print(f"无法解码 {path}，改用系统播放器: {e}")
+            self.sources[index] = None
+        self.stem_info[index] = describe_stem(self.cache, path, self._fingerprints) if path else None
+        self._update_mode()
+
+    def set_pair(self, files, sources, infos):
+        """一次换上伴奏和人声两个已经打开的音轨"""
+        self._pair_loader = None
+        self.stop()
+        self.clear_loop()
+        self.files = list(files)
+        self.sources = list(sources)
+        self.stem_info = list(infos)
+        self.drift.reset(self.files)
+        self._update_mode()
+
+    def load_pair_async(self, files):
+        """在后台检查并打开两个音轨（必要时解码），完成后换上并发出pairLoaded，界面不用等待
+
+        只换其中一个时另一个传原来的路径，已经打开的音轨不会重新打开；不存在的文件当作未选择
+        """
+        opened = {path: source for path, source in zip(self.files, self.sources)
+                  if path and source is not None}
+        loader = StemPreloader(self.cache, list(files), self, opened, skip_missing=True,
+                               fingerprints=self._fingerprints)
+        loader.loaded.connect(self._on_pair_loaded)
+        loader.finished.connect(loader.deleteLater)
+        self._pair_loader = loader
+        loader.start()
+
+    def loading(self):
+        """是否有音轨正在后台打开"""
+        return self._pair_loader is not None
+
+    def _on_pair_loaded(self, files, sources, infos):
+        # 等待期间用户又换了音轨的话，旧结果直接丢掉
+        if self.sender() is self._pair_loader:
+            self.set_pair(files, sources, infos)
+            self.pairLoaded.emit()
+
+    def fingerprint(self, index):
+        """音轨的内容指纹，没有加载或读不了时为None（不读文件）"""
+        info = self.stem_info[index]
+        return info['fingerprint'] if info else None
+
+    def peaks_path(self, index):
+        """音轨的波形缓存文件（不读文件）"""
+        info = self.stem_info[index]
+        return info['peaks_path'] if info else None
+
+    def source_stamp(self, path):
+        """已加载音轨打开时记下的文件信息，查预渲染缓存时不用再访问源文件（可能在休眠的移动硬盘上）"""
+        for file, info in zip(self.files, self.stem_info):
+            if info and file == path:
+                return info['stamp']
+        return None
+
+    def _update_mode(self):
+        """所有已加载的音轨都能解码时用混音器，否则退回系统播放器"""
+        loaded = [i for i in range(2) if self.files[i]]
+        if all(self.sources[i] is not None for i in loaded):
+            self.mode = MODE_MIX
+            self.apply_processing(reload=True)
+        else:
+            for index in range(2):
+                self.mixer.set_stem(index, self.sources[index])
+            self._use_media_players()
+        self._queue_next()
+        self._emit_duration()
+        self._emit_position()
+
+    def _use_media_players(self):
+        """切换到两个QMediaPlayer分别播放的回退模式"""
+        self.mode = MODE_MEDIA
+        from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
+        if self._players is None:
+            self._players = [QMediaPlayer(self), QMediaPlayer(self)]
+            for player in self._players:
+                player.setNotifyInterval(POSITION_NOTIFY_MS)
+                player.positionChanged.connect(self._on_player_position)
+                player.durationChanged.connect(self._emit_duration)
+        for player, path, gain in zip(self._players, self.files, self.mixer.gains):
+            if path:
+                player.setMedia(QMediaContent(QUrl.fromLocalFile(path)))
+            player.setVolume(int(gain * 100))
+            player.setPlaybackRate(self._tempo)
+
+    def has_media(self):
+        return any(self.files)
+
+    # ---- 播放控制 ----
+
+    def play(self):
+        if not self.has_media():
+            return
+        if self.mode == MODE_MIX:
+            if self.mixer.at_end():
+                self.mixer.seek(0, measure=False)
+            if self.output.state() == SUSPENDED_STATE:
+                self.output.resume()
+            else:
+                self.output.start(self.mixer)
+        else:
+            for player, path in zip(self._players, self.files):
+                if path:
+                    player.play()
+        self._set_state(PLAYING)
+
+    def pause(self):
+        if self.mode == MODE_MIX:
+            if self._output is not None and self._output.state() in (ACTIVE_STATE, IDLE_STATE):
+                self.output.suspend()
+        elif self._players:
+            for player, path in zip(self._players, self.files):
+                if path:
+                    player.pause()
+        self._set_state(PAUSED)
+
+    def stop(self):
+        self._media_seek_target = None
+        if self._output is not None:
+            self._output.stop()
+        self.mixer.seek(0, measure=False)
+        if self._players:
+            for player in self._players:
+                player.stop()
+        self._set_state(STOPPED)
+        self._emit_position()
+
+    def state(self):
+        return self._state
+
+    def close(self):
+        """停止播放并结束音频线程，退出前调用"""
+        self.stop()
+        if isinstance(self._output, ThreadedOutput):
+            self._output.close()
+
+    def _set_state(self, state):
+        if state != self._state:
+            self._state = state
+            self.stateChanged.emit(state)
+        # 电平表只在混音模式下播放时工作，系统播放器拿不到音频数据
+        if state == PLAYING and self.mode == MODE_MIX:
+            if not self._meter_timer.isActive():
+                self.mixer.take_levels()
+                self._meter_timer.start()
+        elif self._meter_timer.isActive():
+            self._meter_timer.stop()
+            self.levelsChanged.emit([(0.0, 0.0), (0.0, 0.0)])
+
+    def _emit_levels(self):
+        self.levelsChanged.emit(self.mixer.take_levels())
+
+    # ---- 位置通知 ----
+
+    def _on_tick(self):
+        """播放中定期调用：检查循环和漂移，位置变了才发信号"""
+        self.check_drift()
+        self.check_loop()
+        self._emit_position()
+
+    def _on_player_position(self, position):
+        # 回退模式下两个播放器都会通知，只跟随第一个已加载的音轨
+        leader = next(p for p, f in zip(self._players, self.files) if f) if self.has_media() else None
+        if self.sender() is leader:
+            self._on_tick()
+
+    def _emit_position(self):
+        position = self.position() if self.has_media() else 0
+        if position != self._last_position:
+            self._last_position = position
+            self.positionChanged.emit(position)
+
+    def _emit_duration(self, *args):
+        duration = self.duration() if self.has_media() else 0
+        if duration != self._last_duration:
+            self._last_duration = duration
+            self.durationChanged.emit(duration)
+
+    def _on_output_state_changed(self, state):
+        # 混音器读到结尾时输出会进入空闲状态
+        if state == IDLE_STATE and self.mixer.at_end():
+            self.output.stop()
+            self._set_state(STOPPED)
+            self.finished.emit()
+
+    # ---- 位置和时长 ----
+
+    def _buffered_frames(self):
+        """已经交给声卡但还没播出来的帧数"""
+        if self._output is None or self._output.state() == STOPPED_STATE:
+            return 0
+        return max(0, self.output.bufferSize() - self.output.bytesFree()) // BYTES_PER_FRAME
+
+    def position(self):
+        """当前播放位置（毫秒），两个音轨共用"""
+        if self.mode == MODE_MIX:
+            return frames_to_ms(self.position_frames())
+        return max((p.position() for p, f in zip(self._players, self.files) if f), default=0)
+
+    def duration(self):
+        """总时长（毫秒），取较长的音轨"""
+        if self.mode == MODE_MIX:
+            return frames_to_ms(self.duration_frames())
+        return max((p.duration() for p, f in zip(self._players, self.files) if f), default=0)
+
+    def position_frames(self):
+        """当前播放位置（帧）"""
+        if self.mode != MODE_MIX:
+            return ms_to_frames(self.position())
+        # 声卡缓冲里可能还是B点之前或变速前的数据，由混音器换算
+        heard = self.mixer.heard_position(self._buffered_frames())
+        return max(0, int(heard * self.time_scale))
+
+    def duration_frames(self):
+        return int(round(self.mixer.total_frames() * self.time_scale))
+
+    def seek_frame(self, frame):
+        """按采样帧跳转，两个音轨同时跳到同一帧"""
+        if self.mode != MODE_MIX:
+            self.set_position(frames_to_ms(frame))
+            return
+        self.seek_requests += 1
+        with self.mixer.lock:
+            # 上一次跳转之后声卡还没取过数据的话，输出缓冲里没有旧数据，只改位置就够了
+            restart = not self.mixer.seek_pending
+            # 暂停中跳转不计延迟，否则会把暂停的时间也算进去
+            self.mixer.seek(round(frame / self.time_scale),
+                            measure=self._state == PLAYING)
+        # 丢掉输出缓冲里的旧数据，从新位置重新拉取
+        if restart and self._state == PLAYING:
+            self.output.stop()
+            self.output.start(self.mixer)
+            self.backend_seeks += 1
+        elif restart and self._state == PAUSED:
+            self.output.stop()
+        self._emit_position()
+
+    def seek_ratio(self, ratio):
+        """按总长度的比例跳转（进度条用），混音模式下精确到帧"""
+        ratio = max(0.0, min(1.0, ratio))
+        if self.mode == MODE_MIX:
+            self.seek_frame(int(round(ratio * self.duration_frames())))
+        else:
+            self.set_position(int(ratio * self.duration()))
+
+    def seek_latency_ms(self):
+        """最近一次跳转到新位置数据被声卡取走的耗时"""
+        return self.mixer.last_seek_latency * 1000
+
+    def set_position(self, milliseconds):
+        """两个音轨同时跳转到同一位置"""
+        if self.mode == MODE_MIX:
+            self.seek_frame(ms_to_frames(milliseconds))
+            return
+        self.seek_requests += 1
+        self._media_seek_target = milliseconds
+        if not self._seek_timer.isActive():
+            self._apply_media_seek()
+
+    def _apply_media_seek(self):
+        """让两个系统播放器跳到最近一次请求的位置，之后一段时间内的请求合并到下一次"""
+        milliseconds, self._media_seek_target = self._media_seek_target, None
+        if milliseconds is None or self.mode == MODE_MIX:
+            return
+        for player, path in zip(self._players, self.files):
+            if path:
+                player.setPosition(milliseconds)
+        self.backend_seeks += 1
+        self._seek_timer.start()
+        if self._rate_trimmed:
+            self._reset_rates()
+        self.drift.trimming = False
+        self._emit_position()
+
+    # ---- A-B循环 ----
+
+    def set_loop(self, a_frame, b_frame):
+        """设置A-B循环，混音模式下在混音器里无缝绕回"""
+        if self.mode == MODE_MIX:
+            scale = self.time_scale
+            self.mixer.set_loop(round(a_frame / scale), round(b_frame / scale))
+        else:
+            self._media_loop = (a_frame, b_frame) if b_frame > a_frame else None
+
+    def clear_loop(self):
+        self.mixer.clear_loop()
+        self._media_loop = None
+
+    def loop(self):
+        """当前循环区间（帧），没有循环时为None"""
+        if self.mode != MODE_MIX:
+            return self._media_loop
+        if self.mixer.loop is None:
+            return None
+        return tuple(int(round(f * self.time_scale)) for f in self.mixer.loop)
+
+    def check_loop(self):
+        """回退模式下没法在混音器里绕回，只能到B点后跳回A点"""
+        loop = self._media_loop
+        if self.mode == MODE_MIX or loop is None or self._state != PLAYING:
+            return
+        if self.position() >= frames_to_ms(loop[1]):
+            self.set_position(frames_to_ms(loop[0]))
+
+    # ---- 漂移校正 ----
+
+    def check_drift(self):
+        """采样两个音轨的位置差，必要时校正落后的播放器
+
+        混音模式下两个音轨读同一个帧计数器，偏差恒为0；
+        回退模式下两个QMediaPlayer各有时钟，需要定期校正
+        """
+        if self._state != PLAYING:
+            return
+        if self.mode == MODE_MIX or not all(self.files):
+            # 不记录恒为0的采样，免得把回退模式的统计冲淡
+            return
+
+        accompaniment, vocals = self._players
+        action, offset = self.drift.sample(accompaniment.position(), vocals.position())
+        leader, lagger = (vocals, accompaniment) if offset > 0 else (accompaniment, vocals)
+
+        if action == ACTION_SEEK:
+            lagger.setPosition(leader.position())
+            self._reset_rates()
+        elif action == ACTION_RATE:
+            leader.setPlaybackRate(self._tempo)
+            lagger.setPlaybackRate(self._tempo * (1.0 + self.drift.rate_trim))
+            self._rate_trimmed = True
+        elif self._rate_trimmed:
+            self._reset_rates()
+
+    def _reset_rates(self):
+        for player in self._players:
+            player.setPlaybackRate(self._tempo)
+        self._rate_trimmed = False
+
+    # ---- 变速 ----
+
+    def set_tempo(self, tempo):
+        """设置播放速度（1.0为原速），混音模式下变速不变调"""
+        self._tempo = max(MIN_TEMPO, min(MAX_TEMPO, round(float(tempo), 2)))
+        self.apply_processing()
+        if self._players:
+            # 回退模式只能交给系统播放器调速，是否保持音高取决于平台
+            for player in self._players:
+                player.setPlaybackRate(self._tempo)
+            self._rate_trimmed = False
+
+    def tempo(self):
+        return self._tempo
+
+    # ---- 变调 ----
+
+    def set_pitch(self, index, semitones):
+        """设置音轨变调（半音），只在混音模式下可用"""
+        self._semitones[index] = semitones
+        self.apply_processing()
+        return self.mode == MODE_MIX
+
+    def pitch(self, index):
+        return self._semitones[index]
+
+    # ---- 预渲染 ----
+
+    def variant(self, index):
+        """音轨在当前设置下的预渲染版本标记，原样播放时为空字符串"""
+        return variant_key(self._semitones[index], self._tempo)
+
+    def rendered_stems(self):
+        """当前设置下所有已加载音轨都有预渲染版本时返回它们，否则返回None"""
+        if all(not self.variant(i) for i in range(2)):
+            return None
+        stems = [None, None]
+        for index, path in enumerate(self.files):
+            if not path or self.sources[index] is None:
+                continue
+            variant = self.variant(index)
+            if not variant:
+                # 只有另一个音轨变调，这个音轨原样播放
+                stems[index] = self.sources[index]
+                continue
+            stems[index] = self.cache.get(path, variant, self.source_stamp(path))
+            if stems[index] is None:
+                return None
+        return stems
+
+    def prerender_job(self, index):
+        """当前设置下这个音轨需要预渲染时返回任务参数，不需要或无法渲染时返回None"""
+        path = self.files[index]
+        variant = self.variant(index)
+        if self.mode != MODE_MIX or not path or not variant:
+            return None
+        stamp = self.source_stamp(path)
+        if self.cache.get(path, variant, stamp) is not None:
+            return None
+        source = source_descriptor(self.sources[index])
+        if source is None:
+            return None
+        return {
+            'path': path,
+            'source': source,
+            'output_path': self.cache.reserve(path, variant, stamp),
+            'variant': variant,
+            'semitones': self._semitones[index],
+            'tempo': self._tempo,
+        }
+
+    def apply_processing(self, reload=False):
+        """按当前变速/变调设置选择播放来源：有预渲染版本就直接播放，否则实时处理
+
+        reload为True时重新设置混音器里的两个音轨（加载了新文件）
+        """
+        if self.mode != MODE_MIX:
+            return
+        rendered = self.rendered_stems()
+        if rendered is None and not self.rendered and not reload:
+            # 一直是实时处理，直接改混音器设置，播放中不会断音
+            self.mixer.set_tempo(self._tempo)
+            for index in range(2):
+                self.mixer.set_pitch(index, self._semitones[index])
+            return
+
+        # 在原始音轨和预渲染版本之间切换，保留播放位置和循环区间；
+        # 切换过程中音频线程不能取数据，否则会混出新旧设置各一半的一块
+        with self.mixer.lock:
+            position = self.position_frames()
+            loop = self.loop()
+            if rendered is not None:
+                stems, scale, tempo, pitches = rendered, self._tempo, 1.0, [0, 0]
+            else:
+                stems, scale, tempo, pitches = self.sources, 1.0, self._tempo, self._semitones
+            self.rendered = rendered is not None
+            self.time_scale = scale
+            for index in range(2):
+                self.mixer.set_stem(index, stems[index])
+                self.mixer.set_pitch(index, pitches[index])
+            self.mixer.set_tempo(tempo)
+            if loop:
+                self.set_loop(*loop)
+            else:
+                self.mixer.clear_loop()
+            self.seek_frame(position)
+        self._queue_next()
+        self._emit_duration()
+
+    def pitch_latency_ms(self):
+        """变调处理延迟（毫秒）"""
+        return frames_to_ms(self.mixer.pitch_latency())
+
+    # ---- 播放列表 ----
+
+    def preload_next(self, files):
+        """后台准备下一首，准备好后当前这首一放完就在同一个输出流里接上"""
+        self.cancel_next()
+        if not any(files):
+            return
+        preloader = StemPreloader(self.cache, list(files), self,
+                                  fingerprints=self._fingerprints)
+        preloader.loaded.connect(self._on_next_loaded)
+        preloader.finished.connect(preloader.deleteLater)
+        self._preloader = preloader
+        preloader.start()
+
+    def cancel_next(self):
+        self._next = None
+        self._preloader = None
+        self.mixer.queue_next(None)
+
+    def next_files(self):
+        """已经准备好的下一首，没有时返回None"""
+        return self._next[0] if self._next else None
+
+    def _on_next_loaded(self, files, sources, infos):
+        # 等待期间又换了下一首的话，旧结果直接丢掉
+        if self.sender() is self._preloader:
+            self._next = (files, sources, infos)
+            self._queue_next()
+
+    def _queue_next(self):
+        """只有混音模式、下一首都能解码、且没有在播放预渲染版本时，才交给混音器无缝衔接"""
+        ready = (self._next is not None and self.mode == MODE_MIX and not self.rendered
+                 and all(stem is not None for path, stem in zip(*self._next[:2]) if path))
+        self.mixer.queue_next(self._next[1] if ready else None)
+
+    def _on_track_changed(self):
+        """混音器已经无缝切到下一首，同步文件信息"""
+        if self._next is None:
+            return
+        files, sources, infos = self._next
+        self._next = None
+        self._preloader = None
+        self.files = list(files)
+        self.sources = list(sources)
+        self.stem_info = list(infos)
+        self.drift.reset(self.files)
+        self.last_switch_ms = self.mixer.last_switch_time * 1000
+        self._emit_duration()
+        self.trackChanged.emit()
+
+    def skip_to_next(self):
+        """立即切到已准备好的下一首，下一首还没准备好时返回False"""
+        if self._next is None:
+            return False
+        started = time.perf_counter()
+        with self.mixer.lock:
+            if self.mixer.next_stems is not None:
+                self.mixer.advance()
+                # 丢掉输出缓冲里上一首的尾巴
+                self.seek_frame(0)
+                return True
+
+        # 不能无缝衔接时按普通方式重新加载，已经预解码过所以只是打开缓存
+        resume = self._state == PLAYING
+        files, sources, infos = self._next
+        self.cancel_next()
+        self.set_pair(files, sources, infos)
+        if resume:
+            self.play()
+        self.last_switch_ms = (time.perf_counter() - started) * 1000
+        self.trackChanged.emit()
+        return True
+
+    def switch_stall_ms(self):
+        """最近一次切歌的停顿（毫秒），无缝衔接时只有切换音轨数据的耗时"""
+        return self.last_switch_ms
+
+    # ---- 音量 ----
+
+    def set_stem_gain(self, index, gain):
+        """设置单个音轨的增益（0.0 ~ 1.0），混音器在下一块里平滑过渡到新值"""
+        self.mixer.set_gain(index, gain)
+        if self._players and not self._gain_timer.isActive():
+            # 拖动滑块时的大量修改合并起来，不逐次调用系统播放器
+            self._gain_timer.start()
+
+    def _apply_player_gains(self):
+        for player, gain in zip(self._players or (), self.mixer.gains):
+            player.setVolume(int(round(gain * 100)))
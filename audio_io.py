@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+音频解码工具
+把各种格式的音轨统一解码成 44.1kHz 立体声 int16 数组，供混音引擎使用
+"""
+
+import os
+import wave
+
+import numpy as np
+
+# 混音输出格式：所有音轨都会被转换成这个格式
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_WIDTH = 2  # 16位
+BYTES_PER_FRAME = CHANNELS * SAMPLE_WIDTH
+
+# WAV以外的格式交给Qt解码
+WAV_EXTENSIONS = ('.wav', '.wave')
+
+
+class DecodeError(Exception):
+    """音频文件无法解码"""
+
+
+def _pcm_to_float(raw, sample_width):
+    """把PCM字节转换成 [-1, 1] 的float32数组"""
+    if sample_width == 1:
+        data = np.frombuffer(raw, dtype=np.uint8).astype(np.float32)
+        return (data - 128.0) / 128.0
+    if sample_width == 2:
+        return np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768.0
+    if sample_width == 3:
+        # 24位没有对应的numpy类型，补一个低字节拼成32位
+        data = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(data), 4), dtype=np.uint8)
+        padded[:, 1:] = data
+        return padded.view('<i4').reshape(-1).astype(np.float32) / 2147483648.0
+    if sample_width == 4:
+        return np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2147483648.0
+    raise DecodeError(f"不支持的采样位宽: {sample_width * 8}位")
+
+
+def conform(samples, sample_rate):
+    """把 (帧数, 声道) 的float数组转换成输出格式的int16数组"""
+    # 声道：单声道复制成立体声，多声道只取前两个
+    if samples.shape[1] == 1:
+        samples = np.repeat(samples, CHANNELS, axis=1)
+    elif samples.shape[1] > CHANNELS:
+        samples = samples[:, :CHANNELS]
+
+    # 采样率：线性插值重采样
+    if sample_rate != SAMPLE_RATE and len(samples) > 0:
+        frames = int(round(len(samples) * SAMPLE_RATE / sample_rate))
+        src_times = np.arange(len(samples), dtype=np.float64)
+        dst_times = np.arange(frames, dtype=np.float64) * (sample_rate / SAMPLE_RATE)
+        samples = np.stack([np.interp(dst_times, src_times, samples[:, ch])
+                            for ch in range(CHANNELS)], axis=1)
+
+    samples = np.clip(samples * 32768.0, -32768, 32767)
+    return np.ascontiguousarray(samples.astype(np.int16))
+
+
+def read_wav(path):
+    """用wave模块直接读取PCM WAV，不经过Qt解码器"""
+    try:
+        with wave.open(path, 'rb') as wf:
+            channels = wf.getnchannels()
+            sample_width = wf.getsampwidth()
+            sample_rate = wf.getframerate()
+            raw = wf.readframes(wf.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise DecodeError(f"无法读取WAV文件: {e}")
+
+    samples = _pcm_to_float(raw, sample_width)
+    samples = samples[:len(samples) - len(samples) % channels]
+    return conform(samples.reshape(-1, channels), sample_rate)
+
+
+def decode_with_qt(path):
+    """用QAudioDecoder解码压缩格式（MP3/FLAC/M4A/OGG）"""
+    from PyQt5.QtCore import QEventLoop
+    from PyQt5.QtMultimedia import QAudioDecoder, QAudioFormat
+
+    target = QAudioFormat()
+    target.setSampleRate(SAMPLE_RATE)
+    target.setChannelCount(CHANNELS)
+    target.setSampleSize(SAMPLE_WIDTH * 8)
+    target.setCodec("audio/pcm")
+    target.setByteOrder(QAudioFormat.LittleEndian)
+    target.setSampleType(QAudioFormat.SignedInt)
+
+    decoder = QAudioDecoder()
+    decoder.setAudioFormat(target)
+    decoder.setSourceFilename(path)
+
+    chunks = []
+    state = {'done': False, 'error': None}
+    loop = QEventLoop()
+
+    def on_buffer_ready():
+        buffer = decoder.read()
+        fmt = buffer.format()
+        raw = buffer.constData().asstring(buffer.byteCount())
+        samples = _pcm_to_float(raw, fmt.sampleSize() // 8)
+        channels = max(1, fmt.channelCount())
+        samples = samples[:len(samples) - len(samples) % channels]
+        chunks.append(conform(samples.reshape(-1, channels), fmt.sampleRate()))
+
+    def on_finished():
+        state['done'] = True
+        loop.quit()
+
+    def on_error(_error):
+        state['done'] = True
+        state['error'] = decoder.errorString() or "解码失败"
+        loop.quit()
+
+    decoder.bufferReady.connect(on_buffer_ready)
+    decoder.finished.connect(on_finished)
+    decoder.error.connect(on_error)
+    decoder.start()
+
+    # 没有解码后端时start()会同步报错，此时不能进入事件循环
+    if decoder.error() != QAudioDecoder.NoError:
+        raise DecodeError(decoder.errorString() or "当前平台不支持解码该格式")
+    if not state['done']:
+        loop.exec_()
+    if state['error']:
+        raise DecodeError(state['error'])
+    if not chunks:
+        raise DecodeError("解码结果为空")
+    return np.concatenate(chunks)
+
+
+def decode_audio(path):
+    """解码音轨，返回 (帧数, 2) 的int16数组"""
+    if not os.path.exists(path):
+        raise DecodeError(f"文件不存在: {path}")
+    if os.path.splitext(path)[1].lower() in WAV_EXTENSIONS:
+        try:
+            return read_wav(path)
+        except DecodeError:
+            # 浮点WAV等wave模块不支持的格式，交给Qt再试一次
+            pass
+    return decode_with_qt(path)
+
+
+def frames_to_ms(frames):
+    """帧数转换为毫秒"""
+    return int(frames * 1000 / SAMPLE_RATE)
+
+
+def ms_to_frames(milliseconds):
+    """毫秒转换为帧数"""
+    return int(milliseconds * SAMPLE_RATE / 1000)
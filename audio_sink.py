@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+音频输出设备
+真实输出用QAudioOutput（用到时才导入QtMultimedia）；
+NullAudioOutput 接口相同但不出声，用于测试和没有声卡的环境；
+ThreadedOutput 把输出设备放到单独的音频线程里，接口也相同
+"""
+
+import threading
+
+from PyQt5.QtCore import Qt, QObject, QThread, QTimer, pyqtSignal
+
+from audio_io import SAMPLE_RATE, CHANNELS, SAMPLE_WIDTH, BYTES_PER_FRAME
+
+# 输出设备状态，取值与QAudio.State一致
+ACTIVE_STATE = 0
+SUSPENDED_STATE = 1
+STOPPED_STATE = 2
+IDLE_STATE = 3
+
+
+def output_format():
+    """混音输出格式"""
+    from PyQt5.QtMultimedia import QAudioFormat
+    fmt = QAudioFormat()
+    fmt.setSampleRate(SAMPLE_RATE)
+    fmt.setChannelCount(CHANNELS)
+    fmt.setSampleSize(SAMPLE_WIDTH * 8)
+    fmt.setCodec("audio/pcm")
+    fmt.setByteOrder(QAudioFormat.LittleEndian)
+    fmt.setSampleType(QAudioFormat.SignedInt)
+    return fmt
+
+
+def create_output(parent=None):
+    """打开系统默认的音频输出"""
+    from PyQt5.QtMultimedia import QAudioOutput
+    return QAudioOutput(output_format(), parent)
+
+
+class NullAudioOutput(QObject):
+    """不出声的输出设备，按固定周期从数据源拉取数据
+
+    realtime为False时不等待，尽快把数据拉完（测试用）
+    """
+
+    stateChanged = pyqtSignal(int)
+    notify = pyqtSignal()
+
+    def __init__(self, parent=None, realtime=True, period_ms=20):
+        super().__init__(parent)
+        self.realtime = realtime
+        self.period_ms = period_ms
+        self.frames_played = 0
+        self._state = STOPPED_STATE
+        self._device = None
+        self._buffer_size = 4096 * BYTES_PER_FRAME
+        self._notify_ms = 1000
+        self._since_notify = 0.0
+
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._pull)
+
+    def setBufferSize(self, size):
+        self._buffer_size = size
+
+    def bufferSize(self):
+        return self._buffer_size
+
+    def bytesFree(self):
+        # 取走的数据立即算作播放完毕，缓冲里永远是空的
+        return self._buffer_size
+
+    def setNotifyInterval(self, ms):
+        self._notify_ms = ms
+
+    def state(self):
+        return self._state
+
+    def _set_state(self, state):
+        if state != self._state:
+            self._state = state
+            self.stateChanged.emit(state)
+
+    def start(self, device):
+        self._device = device
+        self._since_notify = 0.0
+        self._timer.start(self.period_ms if self.realtime else 0)
+        self._set_state(ACTIVE_STATE)
+
+    def stop(self):
+        self._timer.stop()
+        self._device = None
+        self._set_state(STOPPED_STATE)
+
+    def suspend(self):
+        self._timer.stop()
+        self._set_state(SUSPENDED_STATE)
+
+    def resume(self):
+        self._timer.start(self.period_ms if self.realtime else 0)
+        self._set_state(ACTIVE_STATE)
+
+    def consume(self, data):
+        """处理取到的一块数据（从第frames_played帧开始），默认直接丢掉；子类可以记录或分析"""
+
+    def _pull(self):
+        if self._device is None:
+            return
+        frames = SAMPLE_RATE * self.period_ms // 1000
+        data = self._device.read(frames * BYTES_PER_FRAME)
+        if not data:
+            # 数据源暂时没有数据，和QAudioOutput一样进入空闲状态，之后继续拉取
+            self._set_state(IDLE_STATE)
+            return
+        self._set_state(ACTIVE_STATE)
+        self.consume(data)
+        played = len(data) // BYTES_PER_FRAME
+        self.frames_played += played
+        self._since_notify += played * 1000.0 / SAMPLE_RATE
+        if self._since_notify >= self._notify_ms:
+            self._since_notify -= self._notify_ms
+            self.notify.emit()
+
+
+class _OutputWorker(QObject):
+    """在音频线程里执行界面线程发来的命令，并转发输出设备的状态变化"""
+
+    stateReported = pyqtSignal(int, int)   # 已执行到的命令序号, 状态
+
+    def __init__(self, output):
+        super().__init__()
+        self.output = output
+        self.done = 0
+        output.stateChanged.connect(self._report)
+
+    def execute(self, seq, name, args):
+        self.done = seq
+        getattr(self.output, name)(*args)
+
+    def release(self):
+        """在音频线程里停止并释放输出设备"""
+        self.output.stop()
+        self.output.stateChanged.disconnect(self._report)
+        self.output = None
+
+    def _report(self, state):
+        self.stateReported.emit(self.done, int(state))
+
+
+class _OutputThread(QThread):
+    """音频线程：输出设备在这里创建，拉取数据的定时器和回调也都在这里运行"""
+
+    _release = pyqtSignal()
+
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+        self.worker = None
+        self.error = None
+        self.ready = threading.Event()
+
+    def run(self):
+        try:
+            output = self.factory(None)
+        except Exception as e:
+            # 打不开声卡时交给创建者处理
+            self.error = e
+            self.ready.set()
+            return
+        self.worker = _OutputWorker(output)
+        self._release.connect(self.worker.release, Qt.BlockingQueuedConnection)
+        self.ready.set()
+        self.exec_()
+        self.worker = None
+
+
+class ThreadedOutput(QObject):
+    """在单独线程里运行的输出设备，接口和QAudioOutput一致
+
+    拉模式下声卡要数据时会在输出设备所在的线程里调用数据源的read，混音、变速和变调
+    都在这个回调里做；放在界面线程的话，界面卡顿超过输出缓冲（约90ms）就会断音。
+    控制命令按顺序排队发给音频线程；状态在这边立即更新，音频线程报上来的状态只在
+    它已经执行完最近一条命令时才采用，避免旧的状态覆盖新的
+    """
+
+    stateChanged = pyqtSignal(int)
+    notify = pyqtSignal()
+    _command = pyqtSignal(int, str, object)
+
+    def __init__(self, factory, parent=None):
+        super().__init__(parent)
+        self._thread = _OutputThread(factory)
+        self._thread.start()
+        self._thread.ready.wait()
+        if self._thread.error is not None:
+            self._thread.wait()
+            raise self._thread.error
+        worker = self._thread.worker
+        # 设备对象属于音频线程，这里只做只读查询
+        self.output = worker.output
+        self._command.connect(worker.execute)
+        worker.stateReported.connect(self._on_state_reported)
+        self.output.notify.connect(self.notify)
+        self._sent = 0
+        self._state = STOPPED_STATE
+        self._buffer_size = self.output.bufferSize()
+
+    def _send(self, name, *args):
+        self._sent += 1
+        self._command.emit(self._sent, name, args)
+
+    def _set_state(self, state):
+        if state != self._state:
+            self._state = state
+            self.stateChanged.emit(state)
+
+    def _on_state_reported(self, seq, state):
+        if seq == self._sent:
+            self._set_state(state)
+
+    def setBufferSize(self, size):
+        self._buffer_size = size
+        self._send('setBufferSize', size)
+
+    def bufferSize(self):
+        return self._buffer_size
+
+    def bytesFree(self):
+        if self._state == STOPPED_STATE or self.output is None:
+            return self._buffer_size
+        return self.output.bytesFree()
+
+    def setNotifyInterval(self, ms):
+        self._send('setNotifyInterval', ms)
+
+    def state(self):
+        return self._state
+
+    def start(self, device):
+        self._send('start', device)
+        self._set_state(ACTIVE_STATE)
+
+    def stop(self):
+        self._send('stop')
+        self._set_state(STOPPED_STATE)
+
+    def suspend(self):
+        self._send('suspend')
+        self._set_state(SUSPENDED_STATE)
+
+    def resume(self):
+        self._send('resume')
+        self._set_state(ACTIVE_STATE)
+
+    def close(self):
+        """停止输出并结束音频线程，退出前调用"""
+        if self._thread is None:
+            return
+        # 设备对象要在音频线程里释放，这边先放掉引用
+        self.output = None
+        self._thread._release.emit()
+        self._thread.quit()
+        self._thread.wait()
+        self._thread = None
+        self._set_state(STOPPED_STATE)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+播放性能基准测试
+生成不同长度和格式的合成音轨，用静音输出驱动播放核心，记录：
+首次出声时间（冷/热缓存）、跳转延迟、播放N分钟后两个音轨的偏差、
+每秒音频的CPU时间和峰值内存；结果写入JSON，可以和保存的基线对比
+
+用法:
+    python benchmark.py [--quick] [--minutes 5] [-o benchmark_results.json]
+    python benchmark.py --baseline bench_baseline.json     # 对比基线，变慢时返回1
+    python benchmark.py --save-baseline bench_baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import wave
+import random
+import platform
+import argparse
+import tempfile
+
+import numpy as np
+from PyQt5.QtCore import QCoreApplication, QTimer
+
+from audio_io import SAMPLE_RATE, CHANNELS
+from audio_sink import NullAudioOutput
+from pcm_cache import PcmCache
+from player_core import PlayerCore
+
+RESULTS_FILE = "benchmark_results.json"
+
+# 合成音轨的格式：(采样率, 位宽字节数)；44.1kHz 16位直接内存映射，其余要解码进缓存
+FORMATS = {
+    'wav44k16': (44100, 2),
+    'wav48k16': (48000, 2),
+    'wav44k24': (44100, 3),
+}
+LENGTHS = (30, 180)
+QUICK_LENGTHS = (10,)
+SEEK_COUNT = 20
+
+# 对齐标记：伴奏只在左声道、人声只在右声道，每秒一个短脉冲
+MARK_FRAMES = 32
+MARK_LEVEL = 0.9
+MARK_THRESHOLD = 0.5
+
+# 对比基线时允许的波动：相对值，以及各单位的绝对下限（差得很少时不算退化）
+DEFAULT_TOLERANCE = 0.25
+ABSOLUTE_SLACK = {'_ms': 5.0, '_mb': 20.0, '_ms_per_audio_s': 2.0}
+
+
+def synth_stem(seconds, channel, sample_rate, freq):
+    """单侧声道的合成音轨：一个安静的正弦音加上每秒一个对齐标记"""
+    frames = int(seconds * sample_rate)
+    t = np.arange(frames) / sample_rate
+    samples = np.zeros((frames, 2), dtype=np.float32)
+    samples[:, channel] = 0.1 * np.sin(2 * np.pi * freq * t)
+    for start in range(0, frames, sample_rate):
+        samples[start:start + MARK_FRAMES, channel] = MARK_LEVEL
+    return samples
+
+
+def write_wav(path, samples, sample_rate, sample_width):
+    """写入16位或24位PCM WAV"""
+    data = np.clip(samples, -1.0, 1.0)
+    if sample_width == 2:
+        raw = (data * 32767).astype('<i2').tobytes()
+    else:
+        ints = (data * 8388607).astype('<i4').reshape(-1, 1).view(np.uint8)
+        raw = np.ascontiguousarray(ints[:, :3]).tobytes()
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(samples.shape[1])
+        wf.setsampwidth(sample_width)
+        wf.setframerate(sample_rate)
+        wf.writeframes(raw)
+
+
+def make_pair(folder, name, seconds, fmt):
+    """生成一对伴奏/人声文件，返回路径列表"""
+    sample_rate, sample_width = FORMATS[fmt]
+    files = []
+    for channel, (role, freq) in enumerate((("other", 220.0), ("vocals", 440.0))):
+        path = os.path.join(folder, f"{name}_{role}.wav")
+        write_wav(path, synth_stem(seconds, channel, sample_rate, freq), sample_rate, sample_width)
+        files.append(path)
+    return files
+
+
+class MarkerOutput(NullAudioOutput):
+    """静音输出，顺带记录左右声道里对齐标记出现的帧位置"""
+
+    def __init__(self, parent=None, realtime=False):
+        super().__init__(parent, realtime=realtime)
+        self.marks = ([], [])
+        self._last = [-SAMPLE_RATE, -SAMPLE_RATE]
+
+    def consume(self, data):
+        block = np.frombuffer(data, dtype='<i2').reshape(-1, CHANNELS)
+        for channel in range(2):
+            for index in np.flatnonzero(np.abs(block[:, channel]) > MARK_THRESHOLD * 32767):
+                frame = self.frames_played + int(index)
+                # 同一个标记只记开头
+                if frame - self._last[channel] > SAMPLE_RATE // 2:
+                    self.marks[channel].append(frame)
+                self._last[channel] = frame
+
+    def offsets_ms(self):
+        """按时间顺序，每个左声道标记到最近的右声道标记的偏差（毫秒，带符号）
+
+        变调会让个别标记低于检测门限，所以按最近的配对而不是按序号配对
+        """
+        left, right = (np.array(marks) for marks in self.marks)
+        if not len(left) or not len(right):
+            return np.zeros(0)
+        after = np.clip(np.searchsorted(right, left), 0, len(right) - 1)
+        before = np.clip(after - 1, 0, len(right) - 1)
+        nearest = np.where(np.abs(right[after] - left) < np.abs(right[before] - left),
+                           right[after], right[before])
+        offsets = nearest - left
+        # 相差半秒以上的是没配上的标记
+        offsets = offsets[np.abs(offsets) < SAMPLE_RATE // 2]
+        return offsets * 1000.0 / SAMPLE_RATE
+
+    def drift_ms(self, last=10):
+        """播放到最后时两个音轨的偏差：最后几个标记偏差的平均值（变调的颗粒抖动会互相抵消）"""
+        offsets = self.offsets_ms()
+        return float(abs(offsets[-last:].mean())) if len(offsets) else None
+
+
+def new_core(folder, output):
+    """在临时目录里建一个播放核心，配置和解码缓存都不碰用户的文件"""
+    core = PlayerCore(output=output, config_file=os.path.join(folder, "config.json"))
+    core.engine.cache = PcmCache(os.path.join(folder, "pcm_cache"))
+    return core
+
+
+def wait_until(app, condition, timeout=30.0):
+    deadline = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < deadline:
+        app.processEvents()
+    return condition()
+
+
+def time_to_first_audio(app, folder, files):
+    """从加载两个音轨到第一块数据被输出取走的时间（毫秒）"""
+    output = NullAudioOutput(realtime=False)
+    core = new_core(folder, output)
+    started = time.perf_counter()
+    for index, path in enumerate(files):
+        core.load(index, path)
+    core.engine.play()
+    ok = wait_until(app, lambda: output.frames_played > 0)
+    elapsed = (time.perf_counter() - started) * 1000
+    core.engine.stop()
+    core.close()
+    return elapsed if ok else None
+
+
+def seek_latencies(app, folder, files, count=SEEK_COUNT):
+    """播放中随机跳转，每次跳转到新位置数据被取走的时间（毫秒）"""
+    output = NullAudioOutput(realtime=False)
+    core = new_core(folder, output)
+    for index, path in enumerate(files):
+        core.load(index, path)
+    engine = core.engine
+    engine.play()
+    # 后台的响度分析会和跳转抢GIL，等它结束再测
+    wait_until(app, lambda: output.frames_played > 0 and not core.analyzing())
+    rng = random.Random(1)
+    latencies = []
+    for _ in range(count):
+        engine.seek_ratio(rng.random() * 0.9)
+        played = output.frames_played
+        wait_until(app, lambda: output.frames_played > played)
+        latencies.append(engine.seek_latency_ms())
+    engine.stop()
+    core.close()
+    return latencies
+
+
+def run_playback(app, folder, files, tempo=1.0, semitones=(0, 0)):
+    """不等待地把整首播完，返回 (结尾处的偏差ms, 最大偏差ms, 每秒音频的CPU毫秒)"""
+    output = MarkerOutput()
+    core = new_core(folder, output)
+    for index, path in enumerate(files):
+        core.load(index, path)
+    core.engine.set_tempo(tempo)
+    for index, value in enumerate(semitones):
+        core.engine.set_pitch(index, value)
+    core.engine.finished.connect(app.quit)
+    audio_seconds = core.engine.duration() / 1000.0 / tempo
+    QTimer.singleShot(int(audio_seconds * 1000) + 60000, app.quit)
+
+    cpu_started = time.process_time()
+    core.engine.play()
+    app.exec_()
+    cpu = time.process_time() - cpu_started
+    core.engine.stop()
+    core.close()
+    played_seconds = output.frames_played / SAMPLE_RATE
+    offsets = output.offsets_ms()
+    jitter = float(np.abs(offsets).max()) if len(offsets) else None
+    return output.drift_ms(), jitter, cpu * 1000.0 / max(played_seconds, 1e-6)
+
+
+def peak_rss_mb():
+    """进程的峰值内存（MB），Windows上没有resource模块时为None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位是KB，macOS是字节
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_benchmarks(lengths=LENGTHS, formats=tuple(FORMATS), drift_minutes=5.0, progress=print):
+    """跑全部场景，返回结果字典"""
+    app = QCoreApplication.instance() or QCoreApplication([])
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in formats:
+            for seconds in lengths:
+                name = f"{fmt}_{seconds}s"
+                progress(f"{name}...")
+                folder = os.path.join(tmp, name)
+                os.makedirs(folder)
+                files = make_pair(folder, name, seconds, fmt)
+                cold = time_to_first_audio(app, folder, files)
+                warm = time_to_first_audio(app, folder, files)
+                seeks = seek_latencies(app, folder, files)
+                results[name] = {
+                    'first_audio_cold_ms': cold,
+                    'first_audio_warm_ms': warm,
+                    'seek_median_ms': float(np.median(seeks)),
+                    'seek_max_ms': float(np.max(seeks)),
+                }
+
+        # 长时间播放：原速，以及慢速加人声变调（实时处理的路径）
+        folder = os.path.join(tmp, "drift")
+        os.makedirs(folder)
+        files = make_pair(folder, "drift", int(drift_minutes * 60), 'wav44k16')
+        for name, tempo, semitones in (("drift", 1.0, (0, 0)),
+                                       ("drift_tempo080_pitch", 0.8, (0, -2))):
+            progress(f"{name} ({drift_minutes:g}分钟)...")
+            drift, offset, cpu = run_playback(app, folder, files, tempo, semitones)
+            results[name] = {'drift_ms': drift, 'offset_max_ms': offset,
+                             'cpu_ms_per_audio_s': cpu}
+
+    results['process'] = {'peak_rss_mb': peak_rss_mb()}
+    return results
+
+
+def metadata():
+    return {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """和基线对比，所有指标都是越小越好；返回 [(场景, 指标, 基线值, 当前值)]"""
+    regressions = []
+    for scenario, metrics in baseline.items():
+        for metric, base in metrics.items():
+            current = results.get(scenario, {}).get(metric)
+            if base is None or current is None:
+                continue
+            slack = next((v for suffix, v in ABSOLUTE_SLACK.items() if metric.endswith(suffix)), 0.0)
+            if current > base * (1 + tolerance) + slack:
+                regressions.append((scenario, metric, base, current))
+    return regressions
+
+
+def print_results(results):
+    for scenario, metrics in results.items():
+        values = "  ".join(f"{metric}={'-' if value is None else f'{value:.2f}'}"
+                           for metric, value in metrics.items())
+        print(f"{scenario:24s} {values}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="播放性能基准测试")
+    parser.add_argument("--quick", action="store_true", help="只跑短音轨（约半分钟）")
+    parser.add_argument("--minutes", type=float, default=None,
+                        help="长时间播放测试的时长（分钟，默认5，--quick时为0.5）")
+    parser.add_argument("-o", "--output", default=RESULTS_FILE, help="结果文件")
+    parser.add_argument("--baseline", help="对比的基线文件，有指标变慢时返回1")
+    parser.add_argument("--save-baseline", help="把这次结果另存为基线")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="允许的相对波动（默认0.25）")
+    args = parser.parse_args(argv)
+
+    minutes = args.minutes if args.minutes is not None else (0.5 if args.quick else 5.0)
+    results = run_benchmarks(QUICK_LENGTHS if args.quick else LENGTHS, drift_minutes=minutes)
+    report = {'meta': metadata(), 'results': results}
+    print_results(results)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"已写入 {path}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for scenario, metric, base, current in regressions:
+            print(f"✗ {scenario}.{metric}: 基线 {base:.2f} → {current:.2f}")
+        if regressions:
+            return 1
+        print("✓ 没有超过基线的退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
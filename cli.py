@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+命令行播放/混音工具
+和图形界面共用播放核心，但不导入QtWidgets，启动快，适合批处理和练歌房的自助终端
+
+用法:
+    python cli.py play 伴奏.wav 人声.wav [--balance 50] [--start 秒] [--tempo 1.0] [--pitch 0]
+    python cli.py mix 伴奏.wav 人声.wav -o 输出.wav|输出.flac [--balance 50] [--tempo 1.0] [--pitch 0]
+    python cli.py batch 音轨文件夹 -o 输出文件夹 [--format flac] [--jobs 4] [--balance 30]
+    python cli.py probe 文件...
+不指定音轨时使用 player_config.json 里上次的文件
+"""
+
+import os
+import sys
+import signal
+import argparse
+
+from PyQt5.QtCore import QCoreApplication, QTimer
+
+from audio_io import DecodeError, frames_to_ms
+from player_core import (PlayerCore, PAN_LAWS, config_files, load_config_file,
+                         probe_duration)
+from export import ExportError, mixdown, batch_mixdown
+from library import find_pairs
+
+
+def format_time(milliseconds):
+    seconds = milliseconds // 1000
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+def pitch_pair(args):
+    """--pitch 作用于伴奏，--vocal-pitch 作用于人声"""
+    return args.pitch, args.vocal_pitch
+
+
+def resolve_files(args):
+    """命令行没给文件时沿用配置里上次的文件"""
+    if args.accompaniment or args.vocals:
+        return [args.accompaniment or "", args.vocals or ""]
+    return config_files(load_config_file())
+
+
+def cmd_play(args):
+    app = QCoreApplication(sys.argv[:1])
+    output = None
+    if args.null:
+        from audio_sink import NullAudioOutput
+        output = NullAudioOutput()
+    core = PlayerCore(output=output)
+    files = resolve_files(args)
+    if not any(files):
+        print("没有可播放的文件")
+        return 1
+    # 不套用图形界面里记下的设置，尤其是A-B循环，否则播放永远不会结束
+    for index, path in enumerate(files):
+        core.load(index, path, restore=False)
+    core.pan_law = args.pan
+    core.set_normalize(args.normalize)
+    core.set_balance(args.balance)
+    core.engine.set_tempo(args.tempo)
+    for index, semitones in enumerate(pitch_pair(args)):
+        core.engine.set_pitch(index, semitones)
+    if args.start:
+        core.seek_ms(int(args.start * 1000))
+
+    print(f"播放: {' + '.join(f for f in files if f)}  时长 {format_time(core.engine.duration())}")
+    core.engine.finished.connect(app.quit)
+    core.engine.play()
+
+    # Ctrl+C 退出；Qt事件循环里Python收不到信号，用定时器让解释器定期运行
+    signal.signal(signal.SIGINT, lambda *a: app.quit())
+    wakeup = QTimer()
+    wakeup.timeout.connect(lambda: None)
+    wakeup.start(200)
+    app.exec_()
+    core.engine.stop()
+    core.close()
+    return 0
+
+
+def cmd_mix(args):
+    files = resolve_files(args)
+    if not any(files):
+        print("没有可混音的文件")
+        return 1
+
+    def progress(done, total):
+        if total:
+            print(f"\r混音 {done * 100 // total}%", end="", flush=True)
+
+    try:
+        frames = mixdown(files, args.output, args.balance, args.tempo, pitch_pair(args),
+                         progress=None if args.quiet else progress, pan_law=args.pan,
+                         normalize=args.normalize)
+    except (ExportError, DecodeError, OSError) as e:
+        print(f"导出失败: {e}")
+        return 1
+    if not args.quiet:
+        print()
+    print(f"已写入 {args.output}  时长 {format_time(frames_to_ms(frames))}")
+    return 0
+
+
+def cmd_batch(args):
+    """按文件名配对整个文件夹的歌曲，多进程并行导出"""
+    pairs = find_pairs(args.folder)
+    if not pairs:
+        print("文件夹里没有配对的音轨")
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+    jobs = [(files, os.path.join(args.output, f"{title}_mix{args.balance}.{args.format}"))
+            for title, files in pairs]
+
+    def progress(done, total, output_path):
+        if not args.quiet:
+            print(f"[{done}/{total}] {os.path.basename(output_path)}")
+
+    results = batch_mixdown(jobs, args.balance, args.tempo, pitch_pair(args),
+                            max_workers=args.jobs, progress=progress, pan_law=args.pan,
+                            normalize=args.normalize)
+    failed = {path: error for path, error in results.items() if isinstance(error, str)}
+    for path, error in failed.items():
+        print(f"导出失败 {path}: {error}")
+    print(f"完成 {len(results) - len(failed)} 首，失败 {len(failed)} 首")
+    return 1 if failed else 0
+
+
+def cmd_probe(args):
+    status = 0
+    for path in args.files:
+        try:
+            frames = probe_duration(path)
+        except (DecodeError, OSError) as e:
+            print(f"{path}\t无法读取: {e}")
+            status = 1
+            continue
+        print(f"{path}\t{format_time(frames_to_ms(frames))}\t{frames_to_ms(frames)}ms\t{frames}帧")
+    return status
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="伴奏人声分离播放器命令行工具")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_stem_options(sub):
+        sub.add_argument("accompaniment", nargs="?", help="伴奏文件")
+        sub.add_argument("vocals", nargs="?", help="人声文件")
+        sub.add_argument("--balance", type=int, default=50,
+                         help="音量平衡 0~100，0只有伴奏，100只有人声（默认50）")
+        sub.add_argument("--pan", choices=PAN_LAWS, default=PAN_LAWS[0],
+                         help="平衡曲线：linear 中间两边都是原音量，equal_power 总响度不变")
+        sub.add_argument("--normalize", action="store_true",
+                         help="先把两个音轨归一化到同一响度（EBU R128）再按平衡混音")
+        sub.add_argument("--tempo", type=float, default=1.0, help="速度，1.0为原速")
+        sub.add_argument("--pitch", type=int, default=0, help="伴奏变调（半音）")
+        sub.add_argument("--vocal-pitch", type=int, default=0, help="人声变调（半音）")
+
+    play = commands.add_parser("play", help="播放")
+    add_stem_options(play)
+    play.add_argument("--start", type=float, default=0.0, help="从第几秒开始")
+    play.add_argument("--null", action="store_true", help="不出声（没有声卡时测试用）")
+    play.set_defaults(func=cmd_play)
+
+    mix = commands.add_parser("mix", help="混音并导出WAV")
+    add_stem_options(mix)
+    mix.add_argument("-o", "--output", required=True, help="输出文件")
+    mix.add_argument("-q", "--quiet", action="store_true", help="不显示进度")
+    mix.set_defaults(func=cmd_mix)
+
+    batch = commands.add_parser("batch", help="批量导出文件夹里所有配对的歌曲")
+    batch.add_argument("folder", help="音轨文件夹（按 _other/_vocals 等后缀配对）")
+    batch.add_argument("-o", "--output", required=True, help="输出文件夹")
+    batch.add_argument("--format", choices=["wav", "flac"], default="wav")
+    batch.add_argument("-j", "--jobs", type=int, default=None, help="并行进程数（默认CPU核数）")
+    batch.add_argument("--balance", type=int, default=50, help="音量平衡 0~100（默认50）")
+    batch.add_argument("--pan", choices=PAN_LAWS, default=PAN_LAWS[0], help="平衡曲线")
+    batch.add_argument("--normalize", action="store_true", help="先把两个音轨归一化到同一响度")
+    batch.add_argument("--tempo", type=float, default=1.0, help="速度，1.0为原速")
+    batch.add_argument("--pitch", type=int, default=0, help="伴奏变调（半音）")
+    batch.add_argument("--vocal-pitch", type=int, default=0, help="人声变调（半音）")
+    batch.add_argument("-q", "--quiet", action="store_true", help="不显示进度")
+    batch.set_defaults(func=cmd_batch)
+
+    probe = commands.add_parser("probe", help="查询时长")
+    probe.add_argument("files", nargs="+")
+    probe.set_defaults(func=cmd_probe)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
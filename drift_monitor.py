@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+音轨漂移监测
+记录伴奏和人声两个播放器之间的位置差，超过阈值时给出校正动作，
+并把每次校正写进日志，方便统计哪些格式/文件漂移最严重
+"""
+
+import time
+from collections import deque
+
+from storage import append_log
+
+# 校正动作
+ACTION_NONE = "none"
+ACTION_RATE = "rate"    # 微调落后播放器的速率
+ACTION_SEEK = "seek"    # 直接把落后的播放器拉到领先的位置
+
+DEFAULT_THRESHOLD_MS = 40
+DRIFT_LOG_FILE = "drift_log.csv"
+
+
+class DriftMonitor:
+    """记录两个音轨的位置差并判断是否需要校正"""
+
+    def __init__(self, threshold_ms=DEFAULT_THRESHOLD_MS, history_seconds=600,
+                 cooldown_seconds=2.0, log_file=DRIFT_LOG_FILE):
+        self.threshold_ms = threshold_ms
+        self.rate_trim = 0.01
+        self.cooldown_seconds = cooldown_seconds
+        self.log_file = log_file
+
+        # 每次采样为 (时间戳, 偏差ms)，偏差 = 人声位置 - 伴奏位置
+        self.history = deque(maxlen=int(history_seconds * 10))
+        self.corrections = {ACTION_RATE: 0, ACTION_SEEK: 0}
+        self.trimming = False
+        self._last_correction = 0.0
+        self._files = ("", "")
+
+    @property
+    def seek_threshold_ms(self):
+        """偏差超过阈值的3倍时速率微调来不及，直接跳转"""
+        return self.threshold_ms * 3
+
+    def reset(self, files=("", "")):
+        """换文件时清空记录"""
+        self.history.clear()
+        self.corrections = {ACTION_RATE: 0, ACTION_SEEK: 0}
+        self.trimming = False
+        self._last_correction = 0.0
+        self._files = tuple(files)
+
+    def sample(self, accompaniment_pos, vocal_pos, now=None):
+        """记录一次位置采样，返回 (动作, 偏差ms)"""
+        now = time.monotonic() if now is None else now
+        offset = vocal_pos - accompaniment_pos
+        self.history.append((now, offset))
+
+        # 速率微调中：偏差回到阈值一半以内就恢复正常速率
+        if self.trimming:
+            if abs(offset) <= self.threshold_ms / 2:
+                self.trimming = False
+                return ACTION_NONE, offset
+            if abs(offset) < self.seek_threshold_ms:
+                return ACTION_RATE, offset
+
+        if abs(offset) < self.threshold_ms:
+            return ACTION_NONE, offset
+        if now - self._last_correction < self.cooldown_seconds:
+            return ACTION_NONE, offset
+
+        action = ACTION_SEEK if abs(offset) >= self.seek_threshold_ms else ACTION_RATE
+        self.trimming = action == ACTION_RATE
+        self._last_correction = now
+        self.corrections[action] += 1
+        self._log(action, offset)
+        return action, offset
+
+    def metrics(self):
+        """漂移统计：当前偏差、最大偏差、平均偏差和校正次数"""
+        offsets = [abs(o) for _, o in self.history]
+        return {
+            'current_ms': self.history[-1][1] if self.history else 0,
+            'max_ms': max(offsets, default=0),
+            'mean_ms': sum(offsets) / len(offsets) if offsets else 0,
+            'rate_corrections': self.corrections[ACTION_RATE],
+            'seek_corrections': self.corrections[ACTION_SEEK],
+        }
+
+    def _log(self, action, offset):
+        """追加一条校正记录"""
+        append_log(self.log_file, ['time', 'action', 'offset_ms', 'accompaniment', 'vocals'],
+                   [time.strftime('%Y-%m-%d %H:%M:%S'), action, offset,
+                    self._files[0], self._files[1]], "漂移日志")
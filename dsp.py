@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+流式音频处理
+WSOLA变速不变调：按固定帧长分块处理，每块在容差范围内找和上一块最吻合的位置再叠加，
+只缓存一帧多一点的输入，延迟固定
+"""
+
+import numpy as np
+
+# 帧长约23ms，50%重叠；容差约6ms
+FRAME_LENGTH = 1024
+TOLERANCE = 256
+# 粗搜索时的抽取倍数，找到大致位置后再在原始采样率下细搜
+SEARCH_DECIMATION = 4
+
+MIN_TEMPO = 0.5
+MAX_TEMPO = 2.0
+
+
+def _best_offset(region, target):
+    """在region里找和target互相关最大的起点"""
+    step = SEARCH_DECIMATION
+    coarse = np.correlate(region[::step], target[::step], 'valid')
+    center = int(np.argmax(coarse)) * step
+    lo = max(0, center - step)
+    hi = min(len(region) - len(target), center + step)
+    fine = np.correlate(region[lo:hi + len(target)], target, 'valid')
+    return lo + int(np.argmax(fine))
+
+
+class TimeStretcher:
+    """WSOLA变速器：tempo > 1 加快，< 1 放慢，音高不变
+
+    推模式使用：feed() 送入输入，step() 每次产出 hop 帧，take() 取出结果。
+    输出第 j 帧大致对应输入的第 j * tempo 帧，clock 记录下一帧输出对应的输入位置。
+    """
+
+    def __init__(self, channels=2, frame_length=FRAME_LENGTH, tolerance=TOLERANCE):
+        self.channels = channels
+        self.frame_length = frame_length
+        self.hop = frame_length // 2
+        self.tolerance = tolerance
+        # 周期汉宁窗在50%重叠时叠加恰好为1
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame_length) / frame_length)
+                       ).astype(np.float32)[:, None]
+        self.tempo = 1.0
+        self.reset()
+
+    def reset(self, start=0):
+        """跳转后清空所有状态，start为下一帧输入的绝对位置"""
+        self._input = np.zeros((0, self.channels), dtype=np.float32)
+        self._base = start          # _input[0] 对应的输入绝对位置
+        self._fed = start           # 已送入的输入绝对位置
+        self._analysis = float(start)   # 下一块的名义分析位置
+        self._prev = None           # 上一块实际选中的位置
+        self._acc = np.zeros((self.frame_length, self.channels), dtype=np.float32)
+        self._ready = []
+        self._ready_frames = 0
+        self.clock = float(start)
+
+    def set_tempo(self, tempo):
+        self.tempo = max(MIN_TEMPO, min(MAX_TEMPO, float(tempo)))
+
+    def latency(self):
+        """处理延迟（帧）：需要预读的输入长度"""
+        return self.frame_length + self.tolerance
+
+    def input_needed(self):
+        """产出下一块之前还需要送入的输入帧数"""
+        nominal = int(round(self._analysis))
+        need = nominal + self.tolerance + self.frame_length
+        if self._prev is not None:
+            need = max(need, self._prev + self.hop + self.frame_length)
+        return max(0, need - self._fed)
+
+    def available(self):
+        return self._ready_frames
+
+    def feed(self, samples):
+        self._input = np.concatenate([self._input, samples.astype(np.float32, copy=False)])
+        self._fed += len(samples)
+
+    def step(self):
+        """产出hop帧输出，输入不够时返回False"""
+        if self.input_needed() > 0:
+            return False
+
+        n = self.frame_length
+        nominal = int(round(self._analysis))
+        if self._prev is None:
+            pos = nominal
+        else:
+            # 在名义位置附近找和“上一块自然延续”最像的一段
+            natural = self._prev + self.hop - self._base
+            lo = max(self._base, nominal - self.tolerance)
+            hi = nominal + self.tolerance
+            target = self._input[natural:natural + n].sum(axis=1)
+            region = self._input[lo - self._base:hi - self._base + n].sum(axis=1)
+            pos = lo + _best_offset(region, target)
+
+        start = pos - self._base
+        self._acc += self._input[start:start + n] * self.window
+        self._ready.append(self._acc[:self.hop].copy())
+        self._ready_frames += self.hop
+        self._acc[:-self.hop] = self._acc[self.hop:]
+        self._acc[-self.hop:] = 0.0
+
+        self._prev = pos
+        self._analysis += self.hop * self.tempo
+
+        # 丢掉以后不会再用到的输入
+        keep_from = min(self._prev + self.hop, int(self._analysis) - self.tolerance)
+        drop = keep_from - self._base
+        if drop > 0:
+            self._input = self._input[drop:]
+            self._base += drop
+        return True
+
+    def take(self, frames):
+        """取出最多frames帧输出"""
+        if not self._ready:
+            return np.zeros((0, self.channels), dtype=np.float32)
+        ready = np.concatenate(self._ready) if len(self._ready) > 1 else self._ready[0]
+        out, rest = ready[:frames], ready[frames:]
+        self._ready = [rest] if len(rest) else []
+        self._ready_frames = len(rest)
+        self.clock += len(out) * self.tempo
+        return out
+
+    def process(self, pull, frames):
+        """拉模式：按需调用pull(n)取输入，返回frames帧输出"""
+        while self._ready_frames < frames:
+            need = self.input_needed()
+            if need > 0:
+                block = pull(need)
+                if len(block) < need:
+                    # 输入结束，补静音把最后几块冲出来
+                    block = np.concatenate([block, np.zeros((need - len(block), self.channels),
+                                                            dtype=np.float32)])
+                self.feed(block)
+            self.step()
+        return self.take(frames)
+
+
+def semitones_to_ratio(semitones):
+    """半音数换算成频率比"""
+    return 2.0 ** (semitones / 12.0)
+
+
+class PitchShifter:
+    """流式变调：先用WSOLA把时长拉长ratio倍，再按ratio重采样回原长度
+
+    process() 输入多少帧就输出多少帧，延迟固定为 latency() 帧，
+    调用方提前 latency() 帧送入数据即可和其他音轨对齐；
+    半音数可以随时修改，不需要清空状态
+    """
+
+    def __init__(self, channels=2, frame_length=FRAME_LENGTH, tolerance=TOLERANCE):
+        self.channels = channels
+        self.stretcher = TimeStretcher(channels, frame_length, tolerance)
+        self.semitones = 0
+        self.ratio = 1.0
+        self.reset()
+
+    def latency(self):
+        """输出延迟（帧）：WSOLA预读加上一块合成帧，音高升到最高时也够用"""
+        return self.stretcher.latency() + self.stretcher.frame_length
+
+    def reset(self):
+        self.stretcher.reset()
+        self._stretched = np.zeros((0, self.channels), dtype=np.float32)
+        self._phase = 0.0
+        # 输出队列预先填入固定长度的静音，之后每次进出相同帧数，延迟保持不变
+        self._queue = [np.zeros((self.latency(), self.channels), dtype=np.float32)]
+        self._queued = self.latency()
+
+    def set_semitones(self, semitones):
+        self.semitones = semitones
+        self.ratio = semitones_to_ratio(semitones)
+        self.stretcher.set_tempo(1.0 / self.ratio)
+
+    def _resample(self):
+        """线性插值重采样：在拉长后的信号上每隔ratio取一帧"""
+        # 插值要用到下一帧，取样位置必须小于最后一帧
+        available = len(self._stretched) - 1 - self._phase
+        count = int(np.ceil(available / self.ratio)) if available > 0 else 0
+        if count <= 0:
+            return
+        positions = self._phase + np.arange(count) * self.ratio
+        index = positions.astype(np.int64)
+        frac = (positions - index).astype(np.float32)[:, None]
+        out = self._stretched[index] * (1.0 - frac) + self._stretched[index + 1] * frac
+        self._queue.append(out)
+        self._queued += count
+
+        consumed = self._phase + count * self.ratio
+        drop = int(consumed)
+        self._stretched = self._stretched[drop:]
+        self._phase = consumed - drop
+
+    def process(self, block):
+        """处理一块音频，返回同样长度的结果"""
+        frames = len(block)
+        self.stretcher.feed(block)
+        while self.stretcher.step():
+            pass
+        stretched = self.stretcher.take(self.stretcher.available())
+        if len(stretched):
+            self._stretched = np.concatenate([self._stretched, stretched])
+            self._resample()
+
+        queued = np.concatenate(self._queue) if len(self._queue) > 1 else self._queue[0]
+        out = queued[:frames]
+        if len(out) < frames:
+            # 理论上不会发生：预填的静音足够覆盖处理延迟
+            out = np.concatenate([out, np.zeros((frames - len(out), self.channels), np.float32)])
+        rest = queued[frames:]
+        self._queue = [rest]
+        self._queued = len(rest)
+        return out
+
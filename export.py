@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+离线导出
+按界面上同样的音量平衡曲线把伴奏和人声混成一个文件，逐块读取、逐块写入，
+不会把整首歌读进内存；批量导出时每首歌一个进程，多核并行
+"""
+
+import os
+import wave
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from audio_io import SAMPLE_RATE, CHANNELS, SAMPLE_WIDTH, decode_audio
+from mixer import StemMixer
+from pcm_cache import PcmCache, map_wav, source_descriptor
+from player_core import PAN_LINEAR, balance_gains
+from loudness import integrated_loudness, normalization_gain
+
+EXPORT_FORMATS = ('.wav', '.flac')
+MIXDOWN_BLOCK_FRAMES = 16384
+
+
+class ExportError(Exception):
+    """无法导出（格式不支持或缺少编码器）"""
+
+
+class StreamWriter:
+    """逐块写入16位立体声WAV或FLAC"""
+
+    def __init__(self, path):
+        self.path = path
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in EXPORT_FORMATS:
+            raise ExportError(f"不支持的导出格式: {ext}")
+        self.tmp_path = path + ".part"
+        if ext == '.flac':
+            try:
+                import soundfile
+            except ImportError:
+                raise ExportError("导出FLAC需要安装 soundfile（pip install soundfile）")
+            self._file = soundfile.SoundFile(self.tmp_path, 'w', SAMPLE_RATE, CHANNELS,
+                                             'PCM_16', format='FLAC')
+            self._write = self._file.write
+        else:
+            self._file = wave.open(self.tmp_path, 'wb')
+            self._file.setnchannels(CHANNELS)
+            self._file.setsampwidth(SAMPLE_WIDTH)
+            self._file.setframerate(SAMPLE_RATE)
+            self._write = lambda block: self._file.writeframes(block.tobytes())
+
+    def write(self, block):
+        """写入一块float数据（-1.0 ~ 1.0）"""
+        np.clip(block, -1.0, 1.0, out=block)
+        self._write((block * 32767.0).astype('<i2'))
+
+    def close(self, keep=True):
+        """写完后才替换目标文件，中途出错（包括收尾时编码器出错）不会留下半个文件"""
+        try:
+            self._file.close()
+            if keep:
+                os.replace(self.tmp_path, self.path)
+        except BaseException:
+            keep = False
+            raise
+        finally:
+            if not keep and os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+
+def render_mix(stems, output_path, balance=50, tempo=1.0, semitones=(0, 0), progress=None,
+               pan_law=PAN_LINEAR, stem_gains=(1.0, 1.0)):
+    """把两个音轨混音写入文件，返回写入的帧数；stem_gains为平衡之前的响度归一化增益"""
+    mixer = StemMixer()
+    for index, stem in enumerate(stems):
+        mixer.set_stem(index, stem)
+    for index, gain in enumerate(balance_gains(balance, pan_law)):
+        mixer.set_gain(index, stem_gains[index] * gain)
+        mixer.set_pitch(index, semitones[index])
+    mixer.set_tempo(tempo)
+    mixer.seek(0, measure=False)
+
+    total = mixer.total_frames()
+    # 变速器按整块输出，最后一块截到应有的长度
+    limit = int(round(total / mixer.tempo))
+    written = 0
+    writer = StreamWriter(output_path)
+    try:
+        while written < limit:
+            block = mixer.read_block(MIXDOWN_BLOCK_FRAMES)[:limit - written]
+            if not len(block):
+                break
+            writer.write(block)
+            written += len(block)
+            if progress:
+                progress(mixer.frame_pos, total)
+    except BaseException:
+        writer.close(keep=False)
+        raise
+    writer.close()
+    return written
+
+
+def stem_normalization(stems):
+    """分析音轨响度，返回各自的归一化增益"""
+    return [normalization_gain(*integrated_loudness(stem)) if stem is not None else 1.0
+            for stem in stems]
+
+
+def mixdown(files, output_path, balance=50, tempo=1.0, semitones=(0, 0), cache=None,
+            progress=None, pan_law=PAN_LINEAR, normalize=False):
+    """按文件路径导出混音，音轨通过解码缓存内存映射读取"""
+    cache = cache or PcmCache()
+    stems = [cache.load(path) if path else None for path in files]
+    stem_gains = stem_normalization(stems) if normalize else (1.0, 1.0)
+    return render_mix(stems, output_path, balance, tempo, semitones, progress, pan_law,
+                      stem_gains)
+
+
+_worker_app = None
+
+
+def _load_in_worker(path, source, cache_path):
+    """子进程里取音轨：能映射就映射，否则解码并写进主进程指定的缓存文件"""
+    if source is not None:
+        filename, offset, frames = source
+        return np.memmap(filename, dtype='<i2', mode='r', offset=offset,
+                         shape=(frames, CHANNELS)), None
+
+    global _worker_app
+    from PyQt5.QtCore import QCoreApplication
+    if QCoreApplication.instance() is None:
+        # QAudioDecoder需要事件循环
+        _worker_app = QCoreApplication([])
+    samples = decode_audio(path)
+    tmp_path = cache_path + ".tmp"
+    np.ascontiguousarray(samples, dtype='<i2').tofile(tmp_path)
+    os.replace(tmp_path, cache_path)
+    return samples, len(samples)
+
+
+def _batch_job(files, sources, cache_paths, output_path, balance, tempo, semitones, pan_law,
+               normalize):
+    """子进程入口：导出一首歌，返回 (写入帧数, 新解码的音轨帧数)"""
+    stems = []
+    decoded = []
+    for path, source, cache_path in zip(files, sources, cache_paths):
+        if not path:
+            stems.append(None)
+            decoded.append(None)
+            continue
+        stem, frames = _load_in_worker(path, source, cache_path)
+        stems.append(stem)
+        decoded.append(frames)
+    stem_gains = stem_normalization(stems) if normalize else (1.0, 1.0)
+    return render_mix(stems, output_path, balance, tempo, semitones, pan_law=pan_law,
+                      stem_gains=stem_gains), decoded
+
+
+def batch_mixdown(jobs, balance=50, tempo=1.0, semitones=(0, 0), cache=None,
+                  max_workers=None, progress=None, pan_law=PAN_LINEAR, normalize=False):
+    """批量导出：jobs为 [(文件路径列表, 输出路径)]，每首歌在一个子进程里处理
+
+    缓存索引只在主进程里修改；返回 {输出路径: 帧数或错误信息}
+    """
+    cache = cache or PcmCache()
+    max_workers = max_workers or os.cpu_count() or 1
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for files, output_path in jobs:
+            sources = []
+            cache_paths = []
+            for path in files:
+                stem = None
+                if path:
+                    stem = map_wav(path)
+                    if stem is None:
+                        stem = cache.get(path)
+                sources.append(source_descriptor(stem) if stem is not None else None)
+                cache_paths.append(cache.reserve(path) if path and stem is None else None)
+            future = pool.submit(_batch_job, files, sources, cache_paths, output_path,
+                                 balance, tempo, semitones, pan_law, normalize)
+            futures[future] = (files, output_path)
+
+        for done, future in enumerate(as_completed(futures), 1):
+            files, output_path = futures[future]
+            try:
+                frames, decoded = future.result()
+                results[output_path] = frames
+                for path, count in zip(files, decoded):
+                    if count is not None:
+                        cache.register(path, count)
+            except Exception as e:
+                # 一首出错（包括子进程崩溃）只记为这一首失败，已经完成的结果保留
+                results[output_path] = str(e) or type(e).__name__
+            if progress:
+                progress(done, len(futures), output_path)
+    return results
+
+
+class MixdownThread(QThread):
+    """界面里导出当前歌曲，在后台线程里写文件"""
+
+    progress = pyqtSignal(int)        # 百分比
+    done = pyqtSignal(str, str)       # 输出路径, 错误信息（成功时为空）
+
+    def __init__(self, stems, output_path, balance, tempo, semitones, pan_law=PAN_LINEAR,
+                 stem_gains=(1.0, 1.0), parent=None):
+        super().__init__(parent)
+        self.stems = stems
+        self.output_path = output_path
+        self.balance = balance
+        self.pan_law = pan_law
+        self.stem_gains = stem_gains
+        self.tempo = tempo
+        self.semitones = semitones
+        self._percent = -1
+        self._cancelled = False
+
+    def cancel(self):
+        """停止导出，已经写了的部分删掉"""
+        self._cancelled = True
+
+    def _report(self, done, total):
+        if self._cancelled:
+            raise ExportError("导出已取消")
+        percent = done * 100 // max(1, total)
+        if percent != self._percent:
+            self._percent = percent
+            self.progress.emit(percent)
+
+    def run(self):
+        try:
+            render_mix(self.stems, self.output_path, self.balance, self.tempo,
+                       self.semitones, self._report, self.pan_law, self.stem_gains)
+        except Exception as e:
+            # 不管什么错误都要通知界面，否则导出按钮一直是禁用的
+            self.done.emit(self.output_path, str(e) or type(e).__name__)
+            return
+        self.done.emit(self.output_path, "")
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+练习曲库
+扫描分离好的音轨文件夹，按文件名后缀自动配对伴奏和人声，索引存在SQLite里；
+重新扫描时只比较修改时间和大小，只有变化的文件才会重新读取
+"""
+
+import os
+import sqlite3
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from audio_io import SAMPLE_RATE, frames_to_ms
+from storage import connect_db
+
+LIBRARY_DB = "library.db"
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.m4a', '.ogg')
+SCAN_WORKERS = 8
+
+# 音轨序号和播放器一致：0 伴奏，1 人声
+ROLE_ACCOMPANIMENT = 0
+ROLE_VOCALS = 1
+
+# 分离工具常见的命名，较长的后缀优先匹配（_no_vocals 不能被当成 _vocals）
+STEM_SUFFIXES = sorted([
+    ('_other', ROLE_ACCOMPANIMENT),
+    ('_accompaniment', ROLE_ACCOMPANIMENT),
+    ('_instrumental', ROLE_ACCOMPANIMENT),
+    ('_no_vocals', ROLE_ACCOMPANIMENT),
+    ('_伴奏', ROLE_ACCOMPANIMENT),
+    ('_vocals', ROLE_VOCALS),
+    ('_vocal', ROLE_VOCALS),
+    ('_人声', ROLE_VOCALS),
+], key=lambda item: -len(item[0]))
+
+# 曲库里保存的缩略波形列数
+OVERVIEW_COLUMNS = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (
+    path TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    title TEXT NOT NULL,
+    role INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sample_rate INTEGER,
+    frames INTEGER,
+    duration_ms INTEGER,
+    peaks BLOB
+);
+CREATE INDEX IF NOT EXISTS files_pair ON files (folder, title);
+"""
+
+
+def split_stem_name(filename):
+    """从文件名拆出 (歌名, 音轨类型)，不符合命名规则时返回 (None, None)"""
+    base, ext = os.path.splitext(os.path.basename(filename))
+    if ext.lower() not in AUDIO_EXTENSIONS:
+        return None, None
+    lowered = base.lower()
+    for suffix, role in STEM_SUFFIXES:
+        if lowered.endswith(suffix):
+            title = base[:-len(suffix)].strip()
+            return (title, role) if title else (None, None)
+    return None, None
+
+
+def probe_file(path):
+    """读取文件头里的采样率和时长，只有WAV能不解码就读到，其他格式留到打开时补上"""
+    if not path.lower().endswith('.wav'):
+        return None, None, None
+    try:
+        with wave.open(path, 'rb') as w:
+            sample_rate, frames = w.getframerate(), w.getnframes()
+    except (wave.Error, EOFError, OSError):
+        return None, None, None
+    return sample_rate, frames, int(frames * 1000 / sample_rate) if sample_rate else None
+
+
+def overview_peaks(pyramid):
+    """把峰值金字塔压成固定列数的缩略波形，按int8存储"""
+    mins, maxs = pyramid.columns(OVERVIEW_COLUMNS)
+    packed = np.round(np.stack([mins, maxs]) * 127).clip(-127, 127).astype(np.int8)
+    return packed.tobytes()
+
+
+def connect(db_path=LIBRARY_DB):
+    """打开曲库数据库；扫描线程写入时界面线程照样可以读"""
+    return connect_db(db_path, SCHEMA)
+
+
+def _list_audio(root):
+    """递归列出root下符合命名规则的音频文件
+
+    返回 ([(路径, 修改时间, 大小)], 读不了的文件夹列表)
+    """
+    found = []
+    unreadable = []
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            # 休眠或拔掉的移动硬盘、没有权限的文件夹：不能当成空文件夹
+            unreadable.append(folder)
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif split_stem_name(entry.name)[0] is not None:
+                    stat = entry.stat()
+                    found.append((os.path.normpath(entry.path), stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                continue
+    return found, unreadable
+
+
+def find_pairs(folder):
+    """不经过数据库直接列出文件夹里配对好的歌曲 [(歌名, [伴奏, 人声])]"""
+    songs = {}
+    for path, _, _ in _list_audio(os.path.normpath(folder))[0]:
+        title, role = split_stem_name(path)
+        files = songs.setdefault((os.path.dirname(path), title), ["", ""])
+        if not files[role]:
+            files[role] = path
+    return [(title, files) for (_, title), files in sorted(songs.items())]
+
+
+def _under(path, roots):
+    return any(path == root or path.startswith(root.rstrip(os.sep) + os.sep) for root in roots)
+
+
+def scan_library(db_path, roots, progress=None, max_workers=SCAN_WORKERS):
+    """增量扫描：没变的文件只比较一次stat，变了的文件在线程池里读取文件头
+
+    读不了的目录（比如没接上的移动硬盘）里原有的记录保留，不当作已删除；
+    返回 (文件总数, 更新数, 删除数)
+    """
+    roots = [os.path.normpath(r) for r in roots]
+    conn = connect(db_path)
+    try:
+        known = {path: (mtime, size) for path, mtime, size
+                 in conn.execute("SELECT path, mtime_ns, size FROM files")}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            listed = []
+            unreadable = []
+            for found, failed in pool.map(_list_audio, roots):
+                listed.extend(found)
+                unreadable.extend(failed)
+            changed = [item for item in listed if known.get(item[0]) != (item[1], item[2])]
+            probed = pool.map(probe_file, [item[0] for item in changed])
+
+            rows = []
+            for count, ((path, mtime, size), (sample_rate, frames, duration)) in enumerate(
+                    zip(changed, probed), 1):
+                title, role = split_stem_name(path)
+                rows.append((path, os.path.dirname(path), title, role, mtime, size,
+                             sample_rate, frames, duration))
+                if progress and count % 50 == 0:
+                    progress(count, len(changed))
+
+        seen = {item[0] for item in listed}
+        removed = [(path,) for path in known if path not in seen and _under(path, roots)
+                   and not _under(path, unreadable)]
+        with conn:
+            conn.executemany("DELETE FROM files WHERE path = ?", removed)
+            # 文件变了缩略波形也作废，打开时重新生成
+            conn.executemany(
+                "INSERT OR REPLACE INTO files (path, folder, title, role, mtime_ns, size, "
+                "sample_rate, frames, duration_ms, peaks) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)",
+                rows)
+        return len(listed), len(rows), len(removed)
+    finally:
+        conn.close()
+
+
+class Library:
+    """界面线程使用的曲库：管理扫描目录，列出配对好的歌曲"""
+
+    def __init__(self, db_path=LIBRARY_DB):
+        self.db_path = db_path
+        self.conn = connect(db_path)
+
+    def roots(self):
+        return [row[0] for row in self.conn.execute("SELECT path FROM roots ORDER BY path")]
+
+    def add_root(self, path):
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO roots (path) VALUES (?)",
+                              (os.path.normpath(path),))
+
+    def remove_root(self, path):
+        path = os.path.normpath(path)
+        with self.conn:
+            self.conn.execute("DELETE FROM roots WHERE path = ?", (path,))
+            prefix = path.rstrip(os.sep) + os.sep
+            self.conn.execute("DELETE FROM files WHERE substr(path, 1, ?) = ?",
+                              (len(prefix), prefix))
+
+    def songs(self, keyword=""):
+        """同一文件夹里同名的伴奏和人声配成一首歌，缺一个的也列出来"""
+        query = ("SELECT folder, title, role, path, duration_ms FROM files "
+                 "WHERE title LIKE ? ESCAPE '\\' ORDER BY title, folder")
+        # 文件名里常见的 _ 和 % 按字面匹配，不当通配符
+        pattern = keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        songs = {}
+        for folder, title, role, path, duration in self.conn.execute(query, (f"%{pattern}%",)):
+            song = songs.setdefault((folder, title), {
+                'title': title, 'folder': folder, 'files': [None, None], 'duration_ms': None})
+            if song['files'][role] is None:
+                song['files'][role] = path
+            if duration:
+                song['duration_ms'] = max(song['duration_ms'] or 0, duration)
+        return list(songs.values())
+
+    def record_stem(self, path, pyramid, sample_rate=None):
+        """打开音轨后补上解码得到的时长和缩略波形"""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE files SET frames = COALESCE(frames, ?), "
+                "sample_rate = COALESCE(sample_rate, ?), duration_ms = ?, peaks = ? "
+                "WHERE path = ?",
+                (pyramid.total_frames, sample_rate or SAMPLE_RATE,
+                 frames_to_ms(pyramid.total_frames), overview_peaks(pyramid),
+                 os.path.normpath(path)))
+
+    def peaks(self, path):
+        """缩略波形 (mins, maxs)，还没生成时返回None"""
+        row = self.conn.execute("SELECT peaks FROM files WHERE path = ?",
+                                (os.path.normpath(path),)).fetchone()
+        if not row or row[0] is None:
+            return None
+        packed = np.frombuffer(row[0], dtype=np.int8).reshape(2, -1) / 127.0
+        return packed[0], packed[1]
+
+    def close(self):
+        self.conn.close()
+
+
+class LibraryScanner(QThread):
+    """后台扫描曲库，完成后通知界面刷新列表"""
+
+    progress = pyqtSignal(int, int)
+    scanned = pyqtSignal(int, int, int)
+
+    def __init__(self, db_path, roots, parent=None):
+        super().__init__(parent)
+        self.db_path = db_path
+        self.roots = roots
+
+    def run(self):
+        try:
+            result = scan_library(self.db_path, self.roots, self.progress.emit)
+        except (OSError, sqlite3.Error) as e:
+            print(f"扫描曲库出错: {e}")
+            return
+        self.scanned.emit(*result)
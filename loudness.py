@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+响度分析（ITU-R BS.1770 / EBU R128 积分响度）
+不同分离工具输出的音轨电平差别很大，先把每个音轨归一化到同一响度，
+平衡滑块的中间位置才对每首歌都意味着同样的听感
+
+K加权滤波在频域里按每100ms一段计算能量（整段FFT乘以滤波器的幅频响应），
+全部向量化，不需要逐采样的IIR滤波
+"""
+
+import math
+
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from audio_io import SAMPLE_RATE
+
+# 归一化的目标响度和单个音轨最大的提升量
+TARGET_LUFS = -18.0
+MAX_BOOST_DB = 12.0
+
+# 门限：400ms一块，每100ms一步；绝对门限-70 LUFS，相对门限比平均值低10 LU
+SUBBLOCK_SECONDS = 0.1
+BLOCK_SUBBLOCKS = 4
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+# 每次读取的段数，约10秒
+READ_SUBBLOCKS = 100
+
+
+def _biquad_response(b, a, freqs, sample_rate):
+    """二阶滤波器在各频率上的功率响应 |H|^2"""
+    z = np.exp(-2j * np.pi * freqs / sample_rate)
+    numerator = b[0] + b[1] * z + b[2] * z * z
+    denominator = 1.0 + a[0] * z + a[1] * z * z
+    return np.abs(numerator / denominator) ** 2
+
+
+def k_weighting(freqs, sample_rate=SAMPLE_RATE):
+    """K加权（高频搁架 + 高通）的功率响应，系数按BS.1770的模拟原型换算到当前采样率"""
+    # 第一级：高频搁架，约+4dB
+    gain_db, q, fc = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+    k = math.tan(math.pi * fc / sample_rate)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = _biquad_response(
+        ((vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0),
+        (2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0), freqs, sample_rate)
+
+    # 第二级：38Hz高通
+    q, fc = 0.5003270373238773, 38.13547087602444
+    k = math.tan(math.pi * fc / sample_rate)
+    a0 = 1 + k / q + k * k
+    highpass = _biquad_response((1.0, -2.0, 1.0),
+                                (2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0),
+                                freqs, sample_rate)
+    return shelf * highpass
+
+
+def subblock_energies(samples, sample_rate=SAMPLE_RATE):
+    """每100ms一段的K加权均方值（各声道相加），同时返回采样峰值
+
+    samples为 (帧数, 声道) 的int16数组（可以是内存映射），分块读取
+    """
+    size = int(round(sample_rate * SUBBLOCK_SECONDS))
+    weights = k_weighting(np.fft.rfftfreq(size, 1.0 / sample_rate), sample_rate)
+    # 帕塞瓦尔定理：实数FFT里除了直流和奈奎斯特频率，每个频点代表正负两个频率
+    weights[1:] *= 2
+    if size % 2 == 0:
+        weights[-1] /= 2
+    weights /= size * size * 32768.0 ** 2
+
+    count = len(samples) // size
+    energies = np.zeros(count)
+    peak = 0
+    for start in range(0, count, READ_SUBBLOCKS):
+        end = min(count, start + READ_SUBBLOCKS)
+        chunk = np.asarray(samples[start * size:end * size])
+        peak = max(peak, int(chunk.max(initial=0)), -int(chunk.min(initial=0)))
+        segments = chunk.reshape(end - start, size, -1).astype(np.float32)
+        spectrum = np.fft.rfft(segments, axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        energies[start:end] = np.einsum('nfc,f->n', power, weights)
+    return energies, peak / 32768.0
+
+
+def gated_loudness(energies):
+    """按BS.1770的两级门限把每段能量合成积分响度（LUFS），全是静音时返回None"""
+    if len(energies) < BLOCK_SUBBLOCKS:
+        return None
+    # 相邻4段的平均就是一个400ms的门限块
+    total = np.concatenate([[0.0], np.cumsum(energies)])
+    blocks = (total[BLOCK_SUBBLOCKS:] - total[:-BLOCK_SUBBLOCKS]) / BLOCK_SUBBLOCKS
+    with np.errstate(divide='ignore'):
+        levels = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[levels > ABSOLUTE_GATE]
+    if not len(gated):
+        return None
+    threshold = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE
+    gated = blocks[(levels > ABSOLUTE_GATE) & (levels > threshold)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def integrated_loudness(samples, sample_rate=SAMPLE_RATE):
+    """音轨的积分响度（LUFS）和采样峰值（满刻度为1.0）"""
+    energies, peak = subblock_energies(samples, sample_rate)
+    return gated_loudness(energies), peak
+
+
+def normalization_gain(lufs, peak=0.0, target=TARGET_LUFS):
+    """把音轨调到目标响度的线性增益；提升时不超过MAX_BOOST_DB，也不让峰值超过满刻度"""
+    if lufs is None:
+        return 1.0
+    gain = 10 ** (min(target - lufs, MAX_BOOST_DB) / 20)
+    if gain > 1.0 and peak > 0:
+        gain = max(1.0, min(gain, 1.0 / peak))
+    return gain
+
+
+class LoudnessAnalyzer(QThread):
+    """后台分析一个音轨的响度"""
+
+    analyzed = pyqtSignal(int, object, float)   # 音轨序号, 积分响度（静音为None）, 峰值
+
+    def __init__(self, index, samples, parent=None):
+        super().__init__(parent)
+        self.index = index
+        self.samples = samples
+
+    def run(self):
+        lufs, peak = integrated_loudness(self.samples)
+        self.analyzed.emit(self.index, lufs, peak)
@@ -1,13 +1,71 @@
+import time
+
+# 启动计时从进程导入本模块开始
+STARTUP_STARTED = time.perf_counter()
+
 import sys
 import os
-import json
+import math
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, 
                              QWidget, QPushButton, QSlider, QLabel, QFileDialog, 
-                             QProgressBar, QGroupBox, QGridLayout, QFrame)
-from PyQt5.QtCore import QTimer, Qt, QThread, pyqtSignal
-from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
-from PyQt5.QtCore import QUrl
-import time
+                             QGroupBox, QSpinBox, QComboBox, QStyle, QListWidget,
+                             QListWidgetItem, QLineEdit, QCheckBox, QAbstractSlider)
+from PyQt5.QtCore import QTimer, Qt, QLineF, QEvent
+from PyQt5.QtGui import QPainter, QPixmap, QColor, QPen
+
+from player_core import PlayerCore, PAN_LAWS, config_files, balance_volumes
+from audio_engine import MODE_MIX, PLAYING
+from audio_io import frames_to_ms
+from waveform import PeakBuilder
+from library import Library, LibraryScanner
+from stall_monitor import (StallWatchdog, timed, stall_threshold_ms,
+                           start_profiling, stop_profiling)
+# 预渲染（进程池）和导出用到时才导入，不拖慢启动
+
+# 进度条的值就是播放位置（毫秒），范围随时长变化；键盘方向键和翻页键的步长（毫秒）
+PROGRESS_SINGLE_STEP_MS = 1000
+PROGRESS_PAGE_STEP_MS = 10000
+# 电平表显示范围（dBFS）和峰值指示每帧回落的分贝数
+METER_FLOOR_DB = -60.0
+METER_PEAK_FALL_DB = 1.5
+
+
+def level_db(level):
+    """线性电平换算成dBFS，静音时返回显示下限"""
+    return max(METER_FLOOR_DB, 20 * math.log10(level)) if level > 0 else METER_FLOOR_DB
+
+
+class LevelMeter(QWidget):
+    """水平电平表：条长是RMS，竖线是峰值（缓慢回落）"""
+    
+    def __init__(self, color, parent=None):
+        super().__init__(parent)
+        self._color = QColor(color)
+        self._rms_db = METER_FLOOR_DB
+        self._peak_db = METER_FLOOR_DB
+        self.setMinimumHeight(10)
+        self.setMaximumHeight(10)
+        
+    def set_level(self, rms, peak):
+        rms_db = level_db(rms)
+        peak_db = max(level_db(peak), self._peak_db - METER_PEAK_FALL_DB)
+        if (rms_db, peak_db) != (self._rms_db, self._peak_db):
+            self._rms_db, self._peak_db = rms_db, peak_db
+            self.update()
+            
+    def _x(self, db):
+        return int((db - METER_FLOOR_DB) / -METER_FLOOR_DB * self.width())
+        
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(40, 40, 40))
+        painter.fillRect(0, 0, self._x(self._rms_db), self.height(), self._color)
+        if self._peak_db > METER_FLOOR_DB:
+            x = min(self._x(self._peak_db), self.width() - 2)
+            painter.fillRect(x, 0, 2, self.height(),
+                             QColor(255, 82, 82) if self._peak_db >= -1.0 else QColor(255, 235, 59))
+        painter.end()
+
 
 class ClickJumpSlider(QSlider):
     """支持精确点击跳转的进度条 - 安全简化版本"""
@@ -17,10 +75,73 @@ class ClickJumpSlider(QSlider):
         self._parent_player = None
         self._slider_type = slider_type  # "progress" 或 "volume"
         
+        # 进度条背后的波形：伴奏、人声的峰值金字塔，画好后缓存成图片
+        self._waveforms = [None, None]
+        self._waveform_pixmap = None
+        
+        # A-B循环区间（占总长的比例），None表示没有循环
+        self._loop_region = None
+        
     def set_parent_player(self, parent_player):
         """设置父播放器引用，用于回调"""
         self._parent_player = parent_player
         
+    def set_waveform(self, index, pyramid):
+        """设置音轨波形，None表示清除"""
+        self._waveforms[index] = pyramid
+        self._waveform_pixmap = None
+        self.update()
+        
+    def set_loop_region(self, region):
+        """设置要高亮的循环区间 (起点比例, 终点比例)"""
+        self._loop_region = region
+        self.update()
+        
+    def resizeEvent(self, event):
+        # 尺寸变化后按新宽度重新取峰值
+        self._waveform_pixmap = None
+        super().resizeEvent(event)
+        
+    def paintEvent(self, event):
+        if self._slider_type == "progress" and (any(self._waveforms) or self._loop_region):
+            painter = QPainter(self)
+            if self._loop_region:
+                start, end = self._loop_region
+                painter.fillRect(int(start * self.width()), 0,
+                                 max(1, int((end - start) * self.width())), self.height(),
+                                 QColor(255, 193, 7, 70))
+            if any(self._waveforms):
+                if self._waveform_pixmap is None:
+                    self._waveform_pixmap = self._render_waveforms()
+                painter.drawPixmap(0, 0, self._waveform_pixmap)
+            painter.end()
+        super().paintEvent(event)
+        
+    def _render_waveforms(self):
+        """把两个音轨的波形叠加画到一张图上，每个像素列只画一条竖线"""
+        width, height = self.width(), self.height()
+        pixmap = QPixmap(width, height)
+        pixmap.fill(Qt.transparent)
+        
+        total = max(w.total_frames for w in self._waveforms if w is not None)
+        if total <= 0:
+            return pixmap
+        
+        painter = QPainter(pixmap)
+        center = height / 2.0
+        colors = [QColor(78, 205, 196, 150), QColor(255, 107, 107, 150)]  # 伴奏、人声
+        for pyramid, color in zip(self._waveforms, colors):
+            if pyramid is None:
+                continue
+            # 较短的音轨只画到它自己的结尾
+            columns = int(width * pyramid.total_frames / total)
+            mins, maxs = pyramid.columns(columns)
+            painter.setPen(QPen(color, 1))
+            painter.drawLines([QLineF(x + 0.5, center - hi * center, x + 0.5, center - lo * center)
+                               for x, (lo, hi) in enumerate(zip(mins, maxs))])
+        painter.end()
+        return pixmap
+        
     def mousePressEvent(self, event):
         """安全的点击跳转实现"""
         if event.button() == Qt.LeftButton and self.orientation() == Qt.Horizontal:
@@ -53,11 +174,27 @@ class MusicPlayer(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("伴奏人声分离播放器")
-        self.setGeometry(100, 100, 800, 600)
-        
-        # 初始化两个媒体播放器
-        self.player1 = QMediaPlayer()
-        self.player2 = QMediaPlayer()
+        self.setGeometry(100, 100, 800, 800)
+        
+        # 初始化播放核心：伴奏和人声在同一个输出流里混音
+        self.core = PlayerCore(self)
+        self.engine = self.core.engine
+        self.engine.finished.connect(self.on_playback_finished)
+        self.engine.stateChanged.connect(self.update_stall_watchdog)
+        self.engine.positionChanged.connect(self.on_position_changed)
+        self.engine.durationChanged.connect(self.on_duration_changed)
+        self.engine.trackChanged.connect(self.on_track_changed)
+        self.engine.levelsChanged.connect(self.on_levels_changed)
+        self.engine.pairLoaded.connect(self.on_stems_loaded)
+        
+        # 正在后台打开的音轨（打开前为None），以及打开后是否自动播放
+        self.loading_files = None
+        self.pending_play = False
+        
+        # 变速/变调预渲染任务，第一次预渲染时才创建进程池
+        self.prerender = None
+        # 正在后台写文件的导出任务
+        self.export_worker = None
         
         # 播放器状态
         self.player1_playing = False
@@ -71,22 +208,35 @@ class MusicPlayer(QMainWindow):
         
 
         
-        # 配置文件路径
-        self.config_file = "player_config.json"
+        # A-B循环点（帧）
+        self.loop_a = None
+        self.loop_b = None
+        
+        # 后台计算波形的线程
+        self.peak_builders = [None, None]
         
-        # 暂停状态下的更新计数器
-        self.pause_update_counter = 0
+        # 练习曲库：扫描文件夹自动配对伴奏和人声；数据库等窗口显示之后再打开
+        self.library = None
+        self.library_scanner = None
         
-        # 进度条更新定时器
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_progress)
-        self.timer.start(100)  # 每100ms更新一次
+        # 播放列表：当前这首播放时在后台准备好下一首
+        self.playlist = []
+        
+        # 进度显示由引擎的位置通知驱动，只在显示内容变化时重绘
+        self.duration = 0
+        self.progress_pixel = -1
+        # 点击进度条时已经跳转过的刻度，松开时不用再跳一次
+        self.clicked_progress = None
+        
+        # 启动计时（毫秒）：窗口显示、上次的音轨可以播放
+        self.startup_times = {}
+        
+        # 界面线程卡顿监测，启动完成后开始
+        self.stall_watchdog = StallWatchdog(stall_threshold_ms(), self)
         
         self.init_ui()
         self.setup_connections()
-        
-        # 在UI初始化后加载配置
-        self.load_config()
+        # 上次的音轨和曲库都等窗口显示之后再加载，见 showEvent
         
     def init_ui(self):
         central_widget = QWidget()
@@ -106,16 +256,18 @@ class MusicPlayer(QMainWindow):
         
         # 进度条
         self.progress_bar = ClickJumpSlider(Qt.Horizontal)
-        self.progress_bar.setMinimum(0)
-        self.progress_bar.setMaximum(100)
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setSingleStep(PROGRESS_SINGLE_STEP_MS)
+        self.progress_bar.setPageStep(PROGRESS_PAGE_STEP_MS)
         self.progress_bar.setValue(0)
+        self.progress_bar.setMinimumHeight(48)
         
 
         self.progress_bar.setStyleSheet("""
             QSlider::groove:horizontal {
                 border: 1px solid #999999;
                 height: 8px;
-                background: #f0f0f0;
+                background: rgba(240, 240, 240, 160);
                 border-radius: 4px;
             }
             QSlider::handle:horizontal {
@@ -135,8 +287,22 @@ class MusicPlayer(QMainWindow):
         self.time_label = QLabel("00:00 / 00:00")
         self.time_label.setAlignment(Qt.AlignCenter)
         
+        # A-B循环控制
+        loop_layout = QHBoxLayout()
+        self.loop_a_btn = QPushButton("设为A点")
+        self.loop_b_btn = QPushButton("设为B点")
+        self.loop_clear_btn = QPushButton("取消循环")
+        self.loop_label = QLabel("循环: 未设置")
+        self.loop_label.setStyleSheet("color: #666666;")
+        loop_layout.addWidget(self.loop_a_btn)
+        loop_layout.addWidget(self.loop_b_btn)
+        loop_layout.addWidget(self.loop_clear_btn)
+        loop_layout.addWidget(self.loop_label)
+        loop_layout.addStretch()
+        
         progress_layout.addWidget(self.progress_bar)
         progress_layout.addWidget(self.time_label)
+        progress_layout.addLayout(loop_layout)
         main_layout.addWidget(progress_group)
         
         # 音量平衡控制区域
@@ -175,10 +341,77 @@ class MusicPlayer(QMainWindow):
         self.volume_balance_label = QLabel("平衡: 人声 50% | 伴奏 50%")
         self.volume_balance_label.setAlignment(Qt.AlignCenter)
         
+        # 平衡曲线：线性（中间两边都是原音量）或等功率（拉动时总响度不变）
+        self.pan_law_combo = QComboBox()
+        self.pan_law_combo.addItems(["线性", "等功率"])
+        self.pan_law_combo.setToolTip("等功率：拖动平衡时总响度保持不变，中间位置两边各约71%")
+        # 响度归一化：先把两个音轨调到同一响度，平衡的中间位置对每首歌都一样
+        self.normalize_checkbox = QCheckBox("响度归一化")
+        self.normalize_checkbox.setToolTip("按EBU R128积分响度把伴奏和人声调到同一响度后再按平衡分配音量")
+        balance_label_layout = QHBoxLayout()
+        balance_label_layout.addWidget(self.volume_balance_label, 1)
+        balance_label_layout.addWidget(self.normalize_checkbox)
+        balance_label_layout.addWidget(self.pan_law_combo)
+        
+        # 实际听到的电平：由正在播放的混音数据算出
+        meter_layout = QHBoxLayout()
+        self.level_meters = [LevelMeter("#4ecdc4"), LevelMeter("#ff6b6b")]  # 伴奏、人声
+        for name, meter in zip(("伴奏", "人声"), self.level_meters):
+            meter_layout.addWidget(QLabel(name))
+            meter_layout.addWidget(meter, 1)
+        self.level_label = QLabel("")
+        self.loudness_label = QLabel("")
+        self.loudness_label.setAlignment(Qt.AlignCenter)
+        self.loudness_label.setStyleSheet("color: #666666;")
+        self.level_label.setAlignment(Qt.AlignCenter)
+        self.level_label.setStyleSheet("color: #666666;")
+        
         volume_layout.addWidget(self.volume_balance_slider)
-        volume_layout.addWidget(self.volume_balance_label)
+        volume_layout.addLayout(balance_label_layout)
+        volume_layout.addLayout(meter_layout)
+        volume_layout.addWidget(self.level_label)
+        volume_layout.addWidget(self.loudness_label)
         main_layout.addWidget(volume_group)
         
+        # 速度和变调区域：慢速练习变速不变调，伴奏可以升降调
+        speed_group = QGroupBox("速度与变调")
+        speed_layout = QHBoxLayout(speed_group)
+        
+        self.tempo_slider = QSlider(Qt.Horizontal)
+        self.tempo_slider.setMinimum(50)
+        self.tempo_slider.setMaximum(150)
+        self.tempo_slider.setSingleStep(5)
+        self.tempo_slider.setPageStep(10)
+        self.tempo_slider.setValue(100)
+        
+        self.tempo_label = QLabel("速度: 100%")
+        self.tempo_reset_btn = QPushButton("原速")
+        
+        speed_layout.addWidget(self.tempo_slider)
+        speed_layout.addWidget(self.tempo_label)
+        speed_layout.addWidget(self.tempo_reset_btn)
+        
+        self.pitch_spinbox = QSpinBox()
+        self.pitch_spinbox.setRange(-12, 12)
+        self.pitch_spinbox.setValue(0)
+        self.pitch_spinbox.setPrefix("变调 ")
+        self.pitch_spinbox.setSuffix(" 半音")
+        
+        self.pitch_target_combo = QComboBox()
+        self.pitch_target_combo.addItems(["伴奏", "人声", "伴奏和人声"])
+        
+        self.pitch_label = QLabel("")
+        self.pitch_label.setStyleSheet("color: #666666;")
+        
+        speed_layout.addWidget(self.pitch_spinbox)
+        speed_layout.addWidget(self.pitch_target_combo)
+        speed_layout.addWidget(self.pitch_label)
+        
+        self.prerender_btn = QPushButton("预渲染")
+        self.prerender_btn.setToolTip("把当前速度和变调渲染成缓存文件，之后播放不再实时处理")
+        speed_layout.addWidget(self.prerender_btn)
+        main_layout.addWidget(speed_group)
+        
         # 播放器控制区域
         players_layout = QHBoxLayout()
         
@@ -192,6 +425,47 @@ class MusicPlayer(QMainWindow):
         
         main_layout.addLayout(players_layout)
         
+        # 曲库
+        library_group = QGroupBox("曲库")
+        library_layout = QVBoxLayout(library_group)
+        
+        library_controls = QHBoxLayout()
+        self.library_search = QLineEdit()
+        self.library_search.setPlaceholderText("搜索歌名")
+        self.library_add_btn = QPushButton("添加文件夹")
+        self.library_scan_btn = QPushButton("重新扫描")
+        library_controls.addWidget(self.library_search)
+        library_controls.addWidget(self.library_add_btn)
+        library_controls.addWidget(self.library_scan_btn)
+        library_layout.addLayout(library_controls)
+        
+        lists_layout = QHBoxLayout()
+        self.library_list = QListWidget()
+        self.library_list.setMinimumHeight(120)
+        self.library_list.setSelectionMode(QListWidget.ExtendedSelection)
+        lists_layout.addWidget(self.library_list, 3)
+        
+        queue_layout = QVBoxLayout()
+        self.queue_list = QListWidget()
+        queue_layout.addWidget(QLabel("播放列表"))
+        queue_layout.addWidget(self.queue_list)
+        queue_buttons = QHBoxLayout()
+        self.queue_add_btn = QPushButton("加入列表")
+        self.queue_next_btn = QPushButton("下一首")
+        self.queue_clear_btn = QPushButton("清空")
+        queue_buttons.addWidget(self.queue_add_btn)
+        queue_buttons.addWidget(self.queue_next_btn)
+        queue_buttons.addWidget(self.queue_clear_btn)
+        queue_layout.addLayout(queue_buttons)
+        lists_layout.addLayout(queue_layout, 2)
+        library_layout.addLayout(lists_layout)
+        
+        self.library_status_label = QLabel("")
+        self.library_status_label.setStyleSheet("color: #666666;")
+        library_layout.addWidget(self.library_status_label)
+        
+        main_layout.addWidget(library_group)
+        
         # 全局控制按钮
         global_controls = QHBoxLayout()
         
@@ -219,6 +493,10 @@ class MusicPlayer(QMainWindow):
         global_controls.addWidget(self.play_pause_btn)
         global_controls.addWidget(self.stop_all_btn)
         
+        self.export_btn = QPushButton("导出混音")
+        self.export_btn.setToolTip("按当前音量平衡、速度和变调导出WAV/FLAC文件")
+        global_controls.addWidget(self.export_btn)
+        
         main_layout.addLayout(global_controls)
         
         # 设置样式
@@ -263,6 +541,12 @@ class MusicPlayer(QMainWindow):
             }
         """)
         
+        # 回退模式下两个播放器各有时钟，在状态栏显示偏差和校正次数
+        self.drift_label = QLabel("")
+        self.drift_label.setStyleSheet("color: #666666;")
+        self.drift_label.hide()
+        self.statusBar().addPermanentWidget(self.drift_label)
+        
     def create_player_group(self, title, player_num):
         group = QGroupBox(title)
         layout = QVBoxLayout(group)
@@ -305,14 +589,43 @@ class MusicPlayer(QMainWindow):
         # 全局控制连接
         self.play_pause_btn.clicked.connect(self.toggle_play_pause)
         self.stop_all_btn.clicked.connect(self.stop_all)
+        self.export_btn.clicked.connect(self.export_mix)
         
         # 进度条连接
-        self.progress_bar.sliderPressed.connect(self.progress_pressed)
         self.progress_bar.sliderReleased.connect(self.progress_released)
         self.progress_bar.sliderMoved.connect(self.progress_moved)
+        self.progress_bar.actionTriggered.connect(self.progress_action)
+        
+        # A-B循环连接
+        self.loop_a_btn.clicked.connect(lambda: self.set_loop_point('a'))
+        self.loop_b_btn.clicked.connect(lambda: self.set_loop_point('b'))
+        self.loop_clear_btn.clicked.connect(self.clear_loop)
+        
+        # 速度连接
+        self.tempo_slider.valueChanged.connect(self.update_tempo)
+        self.tempo_reset_btn.clicked.connect(lambda: self.tempo_slider.setValue(100))
+        
+        # 变调连接
+        self.pitch_spinbox.valueChanged.connect(self.update_pitch)
+        self.pitch_target_combo.currentIndexChanged.connect(self.update_pitch)
+        self.prerender_btn.clicked.connect(self.prerender_current)
+        
+        # 曲库连接
+        self.library_add_btn.clicked.connect(self.add_library_folder)
+        self.library_scan_btn.clicked.connect(self.rescan_library)
+        self.library_search.textChanged.connect(self.refresh_library)
+        self.library_list.itemDoubleClicked.connect(self.load_song)
+        
+        # 播放列表连接
+        self.queue_add_btn.clicked.connect(self.add_to_playlist)
+        self.queue_next_btn.clicked.connect(self.play_next_song)
+        self.queue_clear_btn.clicked.connect(self.clear_playlist)
         
         # 音量平衡连接
         self.volume_balance_slider.valueChanged.connect(self.update_volume_balance)
+        self.pan_law_combo.currentIndexChanged.connect(self.update_pan_law)
+        self.normalize_checkbox.toggled.connect(self.update_normalize)
+        self.core.loudnessChanged.connect(self.show_loudness)
         
         # 设置进度条点击回调
         self.progress_bar.set_parent_player(self)
@@ -329,50 +642,339 @@ class MusicPlayer(QMainWindow):
         )
         
         if file_path:
-            if player_num == 1:
-                self.player1_file = file_path
-                self.player1_file_label.setText(os.path.basename(file_path))
-                self.player1_status_label.setText("文件已加载")
-                self.player1.setMedia(QMediaContent(QUrl.fromLocalFile(file_path)))
-            else:
-                self.player2_file = file_path
-                self.player2_file_label.setText(os.path.basename(file_path))
-                self.player2_status_label.setText("文件已加载")
-                self.player2.setMedia(QMediaContent(QUrl.fromLocalFile(file_path)))
+            self.load_file(player_num, file_path)
+            
+    def load_file(self, player_num, file_path):
+        """加载一个音轨，file_path为空表示清空；另一个音轨不变"""
+        files = list(self.loading_files or self.engine.files)
+        files[player_num - 1] = file_path
+        self.load_files(files)
+        
+    def load_files(self, files, play=False):
+        """在后台检查并打开伴奏和人声，期间界面显示加载中，打开后见 on_stems_loaded"""
+        self.stop_all()
+        self.loading_files = list(files)
+        self.pending_play = play
+        for index, path in enumerate(files):
+            self.show_file(index + 1, path)
+            if path:
+                self.status_label(index).setText("正在加载...")
+        self.engine.load_pair_async(files)
+        
+    def show_file(self, player_num, file_path):
+        """更新音轨的文件名和状态显示"""
+        name = os.path.basename(file_path) if file_path else "未选择文件"
+        status = "文件已加载" if file_path else "就绪"
+        if player_num == 1:
+            self.player1_file = file_path
+            self.player1_file_label.setText(name)
+            self.player1_status_label.setText(status)
+        else:
+            self.player2_file = file_path
+            self.player2_file_label.setText(name)
+            self.player2_status_label.setText(status)
+        
+    def add_library_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "选择音轨文件夹")
+        if folder:
+            self.library.add_root(folder)
+            self.rescan_library()
+            
+    def rescan_library(self):
+        """后台增量扫描曲库，只重新读取变化过的文件"""
+        roots = self.library.roots()
+        if not roots or (self.library_scanner and self.library_scanner.isRunning()):
+            return
+        self.library_status_label.setText("正在扫描...")
+        scanner = LibraryScanner(self.library.db_path, roots, self)
+        scanner.progress.connect(
+            lambda done, total: self.library_status_label.setText(f"正在扫描 {done}/{total}"))
+        scanner.scanned.connect(self.on_library_scanned)
+        scanner.finished.connect(self.on_scanner_finished)
+        self.library_scanner = scanner
+        scanner.start()
+        
+    def on_scanner_finished(self):
+        # 先清掉引用再删除，之后不会再访问已经删除的扫描线程
+        scanner = self.sender()
+        if scanner is self.library_scanner:
+            self.library_scanner = None
+        scanner.deleteLater()
+        
+    def on_library_scanned(self, total, changed, removed):
+        self.library_status_label.setText(f"共 {total} 个音轨，更新 {changed} 个，移除 {removed} 个")
+        self.refresh_library()
+        
+    def refresh_library(self, *args):
+        """按搜索关键字刷新歌曲列表"""
+        self.library_list.clear()
+        for song in self.library.songs(self.library_search.text().strip()):
+            text = song['title']
+            if song['duration_ms']:
+                text += f"  [{self.format_time(song['duration_ms'])}]"
+            if None in song['files']:
+                text += "  （只有伴奏）" if song['files'][0] else "  （只有人声）"
+            item = QListWidgetItem(text)
+            item.setData(Qt.UserRole, song['files'])
+            item.setToolTip(song['folder'])
+            self.library_list.addItem(item)
             
-            # 保存配置
-            self.save_config()
+    def load_song(self, item):
+        """双击曲库里的歌曲，同时加载伴奏和人声"""
+        self.load_files([path or "" for path in item.data(Qt.UserRole)])
+        
+    def add_to_playlist(self):
+        """把曲库里选中的歌曲加到播放列表末尾"""
+        for item in self.library_list.selectedItems():
+            self.playlist.append({'title': item.text(), 'files': item.data(Qt.UserRole)})
+        self.refresh_playlist()
+        
+    def clear_playlist(self):
+        self.playlist = []
+        self.refresh_playlist()
+        
+    def refresh_playlist(self):
+        """刷新播放列表显示，并在后台准备第一首"""
+        self.queue_list.clear()
+        for song in self.playlist:
+            self.queue_list.addItem(song['title'])
+        
+        files = self.playlist[0]['files'] if self.playlist else None
+        if files != self.engine.next_files():
+            if files:
+                self.engine.preload_next(files)
+            else:
+                self.engine.cancel_next()
+        
+    def play_next_song(self):
+        """切到播放列表的下一首；已经预加载好时几乎没有停顿"""
+        if not self.playlist:
+            return
+        if self.engine.skip_to_next():
+            return
+        # 还没准备好，只能直接加载，打开后接着播放
+        song = self.playlist.pop(0)
+        self.load_files([path or "" for path in song['files']], play=self.is_playing)
+        self.refresh_playlist()
+        
+    def on_track_changed(self):
+        """引擎已经切到下一首，同步界面"""
+        if self.playlist:
+            self.playlist.pop(0)
+        for index, path in enumerate(self.engine.files):
+            self.show_file(index + 1, path)
+            self.build_waveform(index)
+        self.show_song_settings()
+        if self.is_playing:
+            self.player1_status_label.setText("播放中" if self.player1_file else "就绪")
+            self.player2_status_label.setText("播放中" if self.player2_file else "就绪")
+        self.library_status_label.setText(f"切歌停顿 {self.engine.switch_stall_ms():.1f}ms")
+        self.save_config()
+        self.refresh_playlist()
                 
+    def build_waveform(self, index):
+        """后台计算音轨波形，完成后画在进度条里"""
+        self.progress_bar.set_waveform(index, None)
+        samples = self.engine.sources[index]
+        if samples is None:
+            return
+        
+        peaks_path = self.engine.peaks_path(index)
+        builder = PeakBuilder(index, samples, peaks_path, self)
+        builder.peaksReady.connect(self.on_peaks_ready)
+        builder.finished.connect(builder.deleteLater)
+        self.peak_builders[index] = builder
+        builder.start()
+        
+    def on_peaks_ready(self, index, pyramid):
+        # 计算期间又换了文件的话，旧结果直接丢掉
+        if self.sender() is self.peak_builders[index]:
+            self.progress_bar.set_waveform(index, pyramid)
+            # 曲库里补上时长和缩略波形（不在曲库里的文件不受影响）
+            self.library.record_stem(self.engine.files[index], pyramid)
+            
+    @timed
     def update_volume_balance(self, value):
         """更新音量平衡"""
         self.volume_balance = value
+        accompaniment_volume, vocal_volume = self.core.set_balance(value)
+        self.core.remember_song()
         
-        # 计算人声和伴奏的音量
-        if value <= 50:
-            # 左半部分：减少人声音量
-            vocal_volume = int((value / 50.0) * 100)
-            accompaniment_volume = 100
-        else:
-            # 右半部分：减少伴奏音量
-            vocal_volume = 100
-            accompaniment_volume = int(((100 - value) / 50.0) * 100)
+        # 更新标签
+        self.volume_balance_label.setText(f"平衡: 人声 {vocal_volume}% | 伴奏 {accompaniment_volume}%")
         
-        # 设置音量
-        self.player1.setVolume(accompaniment_volume)
-        self.player2.setVolume(vocal_volume)
+    def on_levels_changed(self, levels):
+        """显示实际听到的伴奏和人声电平，以及两者的响度差"""
+        for meter, (rms, peak) in zip(self.level_meters, levels):
+            meter.set_level(rms, peak)
+        (accompaniment, _), (vocals, _) = levels
+        parts = [f"{name} {level_db(rms):.1f} dB"
+                 for name, rms in (("伴奏", accompaniment), ("人声", vocals)) if rms > 0]
+        if accompaniment > 0 and vocals > 0:
+            parts.append(f"人声比伴奏 {level_db(vocals) - level_db(accompaniment):+.1f} dB")
+        self.level_label.setText("实际: " + " | ".join(parts) if parts else "")
+            
+    def update_pan_law(self, index):
+        """切换平衡曲线"""
+        accompaniment_volume, vocal_volume = self.core.set_pan_law(PAN_LAWS[index])
+        self.volume_balance_label.setText(f"平衡: 人声 {vocal_volume}% | 伴奏 {accompaniment_volume}%")
+        self.save_config()
         
-        # 更新标签
+    def update_normalize(self, enabled):
+        """开关响度归一化"""
+        self.core.set_normalize(enabled)
+        self.show_loudness()
+        self.save_config()
+        
+    def show_loudness(self):
+        """显示两个音轨的积分响度和归一化增益"""
+        parts = []
+        gains = self.core.normalization_gains()
+        for name, info, gain in zip(("伴奏", "人声"), self.core.loudness, gains):
+            if info and info['lufs'] is not None:
+                text = f"{name} {info['lufs']:.1f} LUFS"
+                if self.core.normalize:
+                    text += f" ({level_db(gain):+.1f} dB)"
+                parts.append(text)
+        if self.core.analyzing():
+            parts.append("正在分析响度...")
+        self.loudness_label.setText("响度: " + " | ".join(parts) if parts else "")
+        
+    def update_tempo(self, value):
+        """更新播放速度（百分比）"""
+        self.engine.set_tempo(value / 100.0)
+        self.core.remember_song()
+        self.tempo_label.setText(f"速度: {value}%")
+        
+    def update_pitch(self, *args):
+        """按选择的音轨应用变调"""
+        semitones = self.pitch_spinbox.value()
+        target = self.pitch_target_combo.currentIndex()  # 0: 伴奏, 1: 人声, 2: 全部
+        supported = True
+        for index in range(2):
+            applies = target == 2 or target == index
+            supported &= self.engine.set_pitch(index, semitones if applies else 0)
+        self.core.remember_song()
+        self.show_pitch_status(supported)
+        
+    def show_pitch_status(self, supported=True):
+        if not supported:
+            self.pitch_label.setText("当前文件格式不支持变调")
+        elif self.engine.pitch(0) or self.engine.pitch(1):
+            self.pitch_label.setText(f"处理延迟 {self.engine.pitch_latency_ms()}ms")
+        else:
+            self.pitch_label.setText("")
+            
+    def show_song_settings(self):
+        """把这首歌记住的平衡、速度、变调和循环显示到界面上，控件不再重复应用"""
+        self.volume_balance = self.core.volume_balance
+        tempo = int(round(self.engine.tempo() * 100))
+        semitones = [self.engine.pitch(0), self.engine.pitch(1)]
+        widgets = (self.volume_balance_slider, self.tempo_slider,
+                   self.pitch_spinbox, self.pitch_target_combo)
+        for widget in widgets:
+            widget.blockSignals(True)
+        self.volume_balance_slider.setValue(self.volume_balance)
+        self.tempo_slider.setValue(tempo)
+        if semitones[0] and semitones[1]:
+            self.pitch_target_combo.setCurrentIndex(2)
+        elif semitones[0] or semitones[1]:
+            self.pitch_target_combo.setCurrentIndex(0 if semitones[0] else 1)
+        self.pitch_spinbox.setValue(semitones[0] or semitones[1])
+        for widget in widgets:
+            widget.blockSignals(False)
+        
+        accompaniment_volume, vocal_volume = balance_volumes(self.volume_balance, self.core.pan_law)
         self.volume_balance_label.setText(f"平衡: 人声 {vocal_volume}% | 伴奏 {accompaniment_volume}%")
+        self.tempo_label.setText(f"速度: {tempo}%")
+        self.show_pitch_status(not any(semitones) or self.engine.mode == MODE_MIX)
+        
+        loop = self.engine.loop()
+        self.loop_a, self.loop_b = loop if loop else (None, None)
+        self.update_loop_display()
+        
+    def export_mix(self):
+        """按当前设置把伴奏和人声混成一个文件，在后台写入"""
+        sources = self.engine.sources
+        if not self.engine.has_media():
+            return
+        if any(path and stem is None for path, stem in zip(self.engine.files, sources)):
+            self.statusBar().showMessage("当前文件格式无法导出混音")
+            return
+        
+        title = os.path.splitext(os.path.basename(self.player1_file or self.player2_file))[0]
+        output_path, _ = QFileDialog.getSaveFileName(
+            self, "导出混音", f"{title}_mix{self.volume_balance}.wav",
+            "WAV 文件 (*.wav);;FLAC 文件 (*.flac)")
+        if not output_path:
+            return
+        
+        from export import MixdownThread
+        worker = MixdownThread(list(sources), output_path, self.volume_balance,
+                               self.engine.tempo(), (self.engine.pitch(0), self.engine.pitch(1)),
+                               self.core.pan_law, self.core.normalization_gains(), self)
+        worker.progress.connect(lambda percent: self.statusBar().showMessage(f"导出中 {percent}%"))
+        worker.done.connect(self.on_export_done)
+        worker.finished.connect(worker.deleteLater)
+        self.export_btn.setEnabled(False)
+        self.export_worker = worker
+        worker.start()
+        
+    def on_export_done(self, output_path, error):
+        self.export_worker = None
+        self.export_btn.setEnabled(True)
+        if error:
+            self.statusBar().showMessage(f"导出失败: {error}")
+        else:
+            self.statusBar().showMessage(f"已导出 {os.path.basename(output_path)}")
+        
+    def status_label(self, index):
+        return self.player1_status_label if index == 0 else self.player2_status_label
+        
+    def ensure_prerender(self):
+        """创建预渲染任务（进程池本身也是提交任务时才启动）"""
+        if self.prerender is None:
+            from prerender import PrerenderJobs
+            self.prerender = PrerenderJobs(self)
+            self.prerender.progress.connect(self.on_prerender_progress)
+            self.prerender.finished.connect(self.on_prerender_finished)
+            self.prerender.failed.connect(self.on_prerender_failed)
+        return self.prerender
+        
+    def prerender_current(self):
+        """在后台渲染当前速度和变调下的音轨，完成后自动改用渲染好的版本"""
+        for index in range(2):
+            job = self.engine.prerender_job(index)
+            if job:
+                self.ensure_prerender().submit(index, **job)
+        
+    def on_prerender_progress(self, index, percent):
+        self.status_label(index).setText(f"预渲染 {percent}%")
+        
+    def on_prerender_finished(self, index, path, variant, frames):
+        """渲染结果登记到缓存，设置没变的话立即切换过去"""
+        self.engine.cache.register(path, frames, variant, self.engine.source_stamp(path))
+        if path == self.engine.files[index]:
+            self.status_label(index).setText("预渲染完成")
+        self.engine.apply_processing()
+        
+    def on_prerender_failed(self, index, message):
+        print(f"预渲染出错: {message}")
+        self.status_label(index).setText("预渲染失败")
         
     def play_all(self):
         """播放所有音乐"""
+        if self.engine.loading():
+            # 音轨还在后台打开，打开后自动开始播放
+            self.pending_play = True
+            return
+        self.engine.play()
+        
         if self.player1_file:
-            self.player1.play()
             self.player1_playing = True
             self.player1_status_label.setText("播放中")
             
         if self.player2_file:
-            self.player2.play()
             self.player2_playing = True
             self.player2_status_label.setText("播放中")
         
@@ -383,13 +985,14 @@ class MusicPlayer(QMainWindow):
         
     def pause_all(self):
         """暂停所有音乐"""
+        self.pending_play = False
+        self.engine.pause()
+        
         if self.player1_file:
-            self.player1.pause()
             self.player1_playing = False
             self.player1_status_label.setText("已暂停")
             
         if self.player2_file:
-            self.player2.pause()
             self.player2_playing = False
             self.player2_status_label.setText("已暂停")
         
@@ -399,13 +1002,14 @@ class MusicPlayer(QMainWindow):
         
     def stop_all(self):
         """停止所有音乐"""
+        self.pending_play = False
+        self.engine.stop()
+        
         if self.player1_file:
-            self.player1.stop()
             self.player1_playing = False
             self.player1_status_label.setText("已停止")
             
         if self.player2_file:
-            self.player2.stop()
             self.player2_playing = False
             self.player2_status_label.setText("已停止")
         
@@ -413,118 +1017,160 @@ class MusicPlayer(QMainWindow):
         self.is_playing = False
         self.update_play_pause_button()
         
-    def progress_pressed(self):
-        # 暂停进度条更新
-        self.timer.stop()
+    def on_playback_finished(self):
+        """播放到结尾，播放列表里还有歌就接着放"""
+        if self.playlist and self.engine.skip_to_next():
+            self.play_all()
+            return
+        self.stop_all()
+        self.progress_bar.setValue(0)
         
+    @timed
     def progress_moved(self, position):
         # 拖动过程中实时更新时间显示
         self.update_time_display_from_position(position)
         
+    @timed
     def progress_released(self):
-        # 恢复进度条更新
-        self.timer.start(100)
-        
         # 获取进度条位置
         position = self.progress_bar.value()
+        clicked, self.clicked_progress = self.clicked_progress, None
+        if position == clicked:
+            # 只是点击没有拖动，按下时已经跳过了
+            return
+        
+        # 两个音轨按同一帧跳转（无论是否正在播放）
+        self.engine.set_position(position)
+        
+    @timed
+    def progress_action(self, action):
+        """方向键、PageUp/PageDown、Home/End 按步长跳转；拖动由松开时处理"""
+        if action in (QAbstractSlider.SliderNoAction, QAbstractSlider.SliderMove):
+            return
+        # 信号发出时滑块位置已经是新位置，值还没更新
+        position = self.progress_bar.sliderPosition()
+        self.engine.set_position(position)
+        self.update_time_display_from_position(position)
         
-        # 计算实际时间位置并设置到播放器（无论是否正在播放）
-        if self.player1_file:
-            duration = self.player1.duration()
-            if duration > 0:
-                new_position = int((position / 100.0) * duration)
-                self.player1.setPosition(new_position)
-                
-        if self.player2_file:
-            duration = self.player2.duration()
-            if duration > 0:
-                new_position = int((position / 100.0) * duration)
-                self.player2.setPosition(new_position)
-        
+    @timed
     def on_progress_clicked(self, value):
         """处理进度条点击跳转"""
-        # 计算新的播放位置
-        if self.player1_file:
-            duration = self.player1.duration()
-            if duration > 0:
-                new_position = int((value / 100.0) * duration)
-                self.player1.setPosition(new_position)
-                
-        if self.player2_file:
-            duration = self.player2.duration()
-            if duration > 0:
-                new_position = int((value / 100.0) * duration)
-                self.player2.setPosition(new_position)
+        # 计算新的播放位置，两个音轨一起跳转
+        self.clicked_progress = value
+        self.engine.set_position(value)
                 
         # 立即更新时间显示
         self.update_time_display_from_position(value)
         
+    @timed
     def on_volume_clicked(self, value):
         """处理音量平衡滑块点击"""
-        # 直接调用音量平衡更新方法
-        self.update_volume_balance(value)
+        # 值变了的话 valueChanged 已经更新过了
+        if value != self.volume_balance:
+            self.update_volume_balance(value)
 
-    def update_progress(self):
-        # 判断是否有任何播放器在播放
-        is_any_playing = self.player1_playing or self.player2_playing
-        
-        if is_any_playing:
-            # 播放状态：正常获取位置信息
-            player1_pos = self.player1.position() if self.player1_playing else 0
-            player2_pos = self.player2.position() if self.player2_playing else 0
-            self.pause_update_counter = 0  # 重置暂停计数器
+    def set_loop_point(self, point):
+        """用当前播放位置设置循环的A点或B点"""
+        frame = self.engine.position_frames()
+        if point == 'a':
+            self.loop_a = frame
+            if self.loop_b is not None and self.loop_b <= frame:
+                self.loop_b = None
         else:
-            # 暂停状态：减少position()调用频率
-            self.pause_update_counter += 1
-            if self.pause_update_counter >= 10:  # 每1秒更新一次（100ms * 10）
-                player1_pos = self.player1.position() if self.player1_file else 0
-                player2_pos = self.player2.position() if self.player2_file else 0
-                self.pause_update_counter = 0
-            else:
-                # 跳过这次更新，保持当前显示
-                return
-        
-        # 获取时长信息（这个调用开销较小）
-        player1_duration = self.player1.duration() if self.player1_file else 0
-        player2_duration = self.player2.duration() if self.player2_file else 0
-        
-        # 计算平均进度
-        if player1_duration > 0 or player2_duration > 0:
-            if player1_duration > 0 and player2_duration > 0:
-                # 两个播放器都有内容，计算平均进度
-                progress1 = (player1_pos / player1_duration) * 100 if player1_duration > 0 else 0
-                progress2 = (player2_pos / player2_duration) * 100 if player2_duration > 0 else 0
-                avg_progress = (progress1 + progress2) / 2
-            elif player1_duration > 0:
-                avg_progress = (player1_pos / player1_duration) * 100
-            else:
-                avg_progress = (player2_pos / player2_duration) * 100
-                
-            self.progress_bar.setValue(int(avg_progress))
+            self.loop_b = frame
+            if self.loop_a is not None and self.loop_a >= frame:
+                self.loop_a = None
+        
+        if self.loop_a is not None and self.loop_b is not None:
+            self.engine.set_loop(self.loop_a, self.loop_b)
+            self.core.remember_song()
+        self.update_loop_display()
+        
+    def clear_loop(self):
+        """取消A-B循环"""
+        self.loop_a = None
+        self.loop_b = None
+        self.engine.clear_loop()
+        self.core.remember_song()
+        self.update_loop_display()
+        
+    def update_loop_display(self):
+        """更新循环标签和进度条上的高亮区间"""
+        if self.loop_a is None and self.loop_b is None:
+            self.loop_label.setText("循环: 未设置")
+        else:
+            a_text = self.format_time(frames_to_ms(self.loop_a)) if self.loop_a is not None else "--:--"
+            b_text = self.format_time(frames_to_ms(self.loop_b)) if self.loop_b is not None else "--:--"
+            self.loop_label.setText(f"循环: A {a_text} | B {b_text}")
+        
+        duration = self.duration
+        if self.engine.loop() and duration > 0:
+            a, b = self.engine.loop()
+            self.progress_bar.set_loop_region((frames_to_ms(a) / duration, frames_to_ms(b) / duration))
+        else:
+            self.progress_bar.set_loop_region(None)
             
-            # 更新时间标签
-            max_duration = max(player1_duration, player2_duration)
-            current_pos = max(player1_pos, player2_pos)
+    def on_duration_changed(self, duration):
+        """时长只在这里更新，之后的位置换算都用记下的值"""
+        self.duration = max(0, duration)
+        self.progress_bar.setRange(0, self.duration)
+        self.progress_pixel = -1
+        self.on_position_changed(self.engine.position())
+        
+    @timed
+    def on_position_changed(self, position):
+        """引擎位置变化：拖动进度条或窗口最小化时不更新"""
+        if self.progress_bar.isSliderDown() or self.isMinimized():
+            return
+        if self.duration <= 0:
+            self.set_time_text(0, 0)
+            return
+        
+        position = min(position, self.duration)
+        # 进度条只在滑块实际移动了至少一个像素时才重绘
+        pixel = QStyle.sliderPositionFromValue(0, self.duration, position, self.progress_bar.width())
+        if pixel != self.progress_pixel:
+            self.progress_pixel = pixel
+            self.progress_bar.setValue(position)
+        self.set_time_text(position, self.duration)
+        
+    def set_time_text(self, position, duration):
+        """时间标签只在显示的秒数变化时更新"""
+        text = f"{self.format_time(position)} / {self.format_time(duration)}"
+        if text != self.time_label.text():
+            self.time_label.setText(text)
+            self.show_drift()
             
-            if max_duration > 0:
-                current_time = self.format_time(current_pos)
-                total_time = self.format_time(max_duration)
-                self.time_label.setText(f"{current_time} / {total_time}")
-    
+    def show_drift(self):
+        """漂移统计跟着时间标签每秒刷新一次；混音模式只有一个时钟，不显示"""
+        if self.engine.mode == MODE_MIX or not all(self.engine.files):
+            self.drift_label.hide()
+            return
+        metrics = self.engine.drift.metrics()
+        self.drift_label.setText(
+            f"音轨偏差 {metrics['current_ms']:.0f}ms（最大 {metrics['max_ms']:.0f}ms，"
+            f"校正 {metrics['rate_corrections'] + metrics['seek_corrections']} 次）")
+        self.drift_label.show()
+        
+    def changeEvent(self, event):
+        # 从最小化恢复时补一次刷新
+        if event.type() == QEvent.WindowStateChange and not self.isMinimized():
+            self.progress_pixel = -1
+            self.on_position_changed(self.engine.position())
+        if event.type() in (QEvent.WindowStateChange, QEvent.ActivationChange):
+            self.update_stall_watchdog()
+        super().changeEvent(event)
+
+    def update_stall_watchdog(self, *args):
+        """卡顿监测只在播放中或窗口在前台时运行，暂停后切到别的窗口就不再定时唤醒"""
+        foreground = self.isActiveWindow() and not self.isMinimized()
+        self.stall_watchdog.set_active(self.engine.state() == PLAYING or foreground)
 
     def update_time_display_from_position(self, position):
-        """根据进度条位置更新时间显示"""
-        # 获取最长的音频文件时长
-        player1_duration = self.player1.duration() if self.player1_file else 0
-        player2_duration = self.player2.duration() if self.player2_file else 0
-        max_duration = max(player1_duration, player2_duration)
-        
-        if max_duration > 0:
-            # 根据进度条位置计算当前时间
-            current_pos = int((position / 100.0) * max_duration)
-            current_time = self.format_time(current_pos)
-            total_time = self.format_time(max_duration)
-            self.time_label.setText(f"{current_time} / {total_time}")
+        """根据进度条位置（毫秒）更新时间显示"""
+        # 时长用 durationChanged 时记下的值，拖动时不再逐次查询
+        if self.duration > 0:
+            self.set_time_text(position, self.duration)
                 
     def format_time(self, milliseconds):
         seconds = int(milliseconds / 1000)
@@ -532,54 +1178,98 @@ class MusicPlayer(QMainWindow):
         seconds = seconds % 60
         return f"{minutes:02d}:{seconds:02d}"
     
+    def showEvent(self, event):
+        super().showEvent(event)
+        if 'window' not in self.startup_times:
+            # 排在首次绘制之后执行
+            QTimer.singleShot(0, self.finish_startup)
+            
+    def finish_startup(self):
+        """窗口已经显示，开始恢复上次的音轨，并在后台检查曲库"""
+        self.startup_times['window'] = (time.perf_counter() - STARTUP_STARTED) * 1000
+        # 声卡和曲库数据库都在首次绘制之后才打开
+        self.engine.open_output()
+        self.library = Library()
+        self.load_config()
+        # 先显示上次的索引，再在后台检查文件变化
+        self.refresh_library()
+        self.rescan_library()
+        self.stall_watchdog.start()
+        self.update_stall_watchdog()
+        
     def load_config(self):
-        """加载配置文件"""
-        try:
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    
-                # 加载上次的文件路径
-                if 'player1_file' in config and config['player1_file']:
-                    if os.path.exists(config['player1_file']):
-                        self.player1_file = config['player1_file']
-                        self.player1_file_label.setText(os.path.basename(self.player1_file))
-                        self.player1_status_label.setText("文件已加载")
-                        self.player1.setMedia(QMediaContent(QUrl.fromLocalFile(self.player1_file)))
-                        
-                if 'player2_file' in config and config['player2_file']:
-                    if os.path.exists(config['player2_file']):
-                        self.player2_file = config['player2_file']
-                        self.player2_file_label.setText(os.path.basename(self.player2_file))
-                        self.player2_status_label.setText("文件已加载")
-                        self.player2.setMedia(QMediaContent(QUrl.fromLocalFile(self.player2_file)))
-                        
-                # 加载音量平衡设置
-                if 'volume_balance' in config:
-                    self.volume_balance = config['volume_balance']
-                    self.volume_balance_slider.setValue(self.volume_balance)
-                    self.update_volume_balance(self.volume_balance)
-                    
-        except Exception as e:
-            print(f"加载配置文件出错: {e}")
+        """加载配置文件，上次的音轨在后台打开，不阻塞界面"""
+        config = self.core.read_config()
+        
+        # 平衡曲线和响度归一化只同步控件，已经在播放核心里生效
+        self.pan_law_combo.blockSignals(True)
+        self.pan_law_combo.setCurrentIndex(PAN_LAWS.index(self.core.pan_law))
+        self.pan_law_combo.blockSignals(False)
+        self.normalize_checkbox.blockSignals(True)
+        self.normalize_checkbox.setChecked(self.core.normalize)
+        self.normalize_checkbox.blockSignals(False)
+        
+        # 加载音量平衡设置
+        if 'volume_balance' in config:
+            self.volume_balance = config['volume_balance']
+            self.volume_balance_slider.setValue(self.volume_balance)
+            self.update_volume_balance(self.volume_balance)
+            
+        # 上次的文件路径：文件是否还在也由后台线程检查
+        files = config_files(config, check_exists=False)
+        if not any(files):
+            self.report_startup()
+            return
+        self.load_files(files)
+        
+    def on_stems_loaded(self):
+        """音轨已在后台打开（启动时恢复的上次音轨，或者新选的文件）"""
+        self.loading_files = None
+        for index, path in enumerate(self.engine.files):
+            self.show_file(index + 1, path)
+            self.build_waveform(index)
+        self.show_song_settings()
+        self.report_startup()
+        self.save_config()
+        if self.pending_play:
+            self.pending_play = False
+            self.play_all()
+        
+    def report_startup(self):
+        """启动计时：窗口显示用时和可以开始播放的用时"""
+        if 'playable' in self.startup_times:
+            return
+        self.startup_times['playable'] = (time.perf_counter() - STARTUP_STARTED) * 1000
+        message = (f"启动用时：窗口 {self.startup_times['window']:.0f}ms，"
+                   f"可播放 {self.startup_times['playable']:.0f}ms")
+        print(message)
+        self.statusBar().showMessage(message, 5000)
     
-
     def save_config(self):
         """保存配置文件"""
-        try:
-            config = {
-                'player1_file': self.player1_file,
-                'player2_file': self.player2_file,
-                'volume_balance': self.volume_balance
-            }
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存配置文件出错: {e}")
+        self.core.write_config()
     
     def closeEvent(self, event):
         """程序关闭时保存配置"""
+        self.stall_watchdog.stop()
         self.save_config()
+        self.core.close()
+        # 还在算的波形不要了，结果到达时直接丢掉
+        self.peak_builders = [None, None]
+        for builder in self.findChildren(PeakBuilder):
+            builder.wait()
+        if self.export_worker is not None:
+            # 没写完的导出不要了，线程结束前会删掉写了一半的文件
+            self.export_worker.done.disconnect()
+            self.export_worker.cancel()
+            self.export_worker.wait()
+            self.export_worker = None
+        if self.prerender:
+            self.prerender.shutdown()
+        if self.library_scanner and self.library_scanner.isRunning():
+            self.library_scanner.wait()
+        if self.library is not None:
+            self.library.close()
         event.accept()
     
     def toggle_play_pause(self):
@@ -629,10 +1319,14 @@ class MusicPlayer(QMainWindow):
             """)
 
 def main():
+    # 设置了 PLAYER_PROFILE 环境变量时记录整个运行过程
+    profiler = start_profiling()
     app = QApplication(sys.argv)
     player = MusicPlayer()
     player.show()
-    sys.exit(app.exec_())
+    status = app.exec_()
+    stop_profiling(profiler)
+    sys.exit(status)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+音轨混音器
+两个音轨共用一个帧计数器，在同一个输出流里逐采样混音
+"""
+
+import time
+import functools
+import threading
+from collections import deque
+
+import numpy as np
+from PyQt5.QtCore import QIODevice, pyqtSignal
+
+from audio_io import CHANNELS, BYTES_PER_FRAME
+from dsp import TimeStretcher, PitchShifter
+
+# 循环接缝处的交叉淡化长度（约1.5ms），避免B点跳回A点时出现爆音
+LOOP_CROSSFADE_FRAMES = 64
+
+
+def locked(method):
+    """输出设备可能在音频线程里取数据，修改混音状态和取数据互斥"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class StemMixer(QIODevice):
+    """拉模式音频设备：QAudioOutput要数据时现场混出一块"""
+
+    trackChanged = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # 混音状态的锁，界面线程一次改多项设置时也可以拿着它（可重入）
+        self.lock = threading.RLock()
+        self.stems = [None, None]   # 0: 伴奏, 1: 人声，int16 (帧数, 2)
+        # 增益：gains是界面设定的目标值，混音时每块从上一块的增益线性过渡过去，
+        # 拖动滑块不会有阶梯噪声，一块之内的多次修改也只生效最后一次
+        self.gains = [1.0, 1.0]
+        self.applied_gains = [1.0, 1.0]
+        self.frame_pos = 0
+
+        # 电平表：每个音轨实际混进去的信号（已乘增益）累计的 [平方和, 峰值, 帧数]，
+        # 界面定期取走
+        self._levels = [[0.0, 0.0, 0], [0.0, 0.0, 0]]
+
+        # A-B循环：区间 [a, b) 帧，两个音轨的循环段预先拷贝到内存
+        self.loop = None
+        self.loop_stems = [None, None]
+        self.loop_count = 0
+
+        # 变速：整个混音结果一起变速，两个音轨天然对齐
+        self.tempo = 1.0
+        self.stretcher = TimeStretcher(CHANNELS)
+        self._stretching = False
+
+        # 变调：每个音轨可以单独变调，变调器提前读取数据抵消处理延迟
+        self.semitones = [0, 0]
+        self.shifters = [None, None]
+
+        # 位置映射：混音流的第几帧来自音轨的哪一帧（循环会让两者不一致），
+        # 以及输出的第几帧来自混音流的哪一帧（变速会让两者不一致）
+        self.stream_pos = 0
+        self.output_pos = 0
+        self._segments = deque(maxlen=64)      # (流起点, 音轨起点, 帧数)
+        self._checkpoints = deque(maxlen=64)   # (输出起点, 流起点, 速度)
+
+        # 无缝切歌：当前音轨放完后在同一个输出流里直接接上下一首
+        self.next_stems = None
+        self.track_changes = 0
+        self.last_switch_time = 0.0
+
+        # 跳转延迟：从seek()到新位置的第一块数据被取走
+        self._seek_started = None
+        self.last_seek_latency = 0.0
+        # 跳转之后声卡还没取过数据
+        self.seek_pending = False
+
+    @locked
+    def seek(self, frame, measure=True):
+        """跳到指定帧，两个音轨共用这个位置"""
+        self.frame_pos = max(0, min(int(frame), self.total_frames()))
+        self._seek_started = time.perf_counter() if measure else None
+        self.seek_pending = True
+        self._reset_stream()
+
+    def _reset_stream(self):
+        """跳转后输出从头计数，变速器也要清空"""
+        self.stream_pos = 0
+        self.output_pos = 0
+        self._segments.clear()
+        self._checkpoints.clear()
+        self.stretcher.reset()
+        self._stretching = self.tempo != 1.0
+        for index in range(2):
+            if self.semitones[index] == 0:
+                self.shifters[index] = None
+            elif self.shifters[index] is not None:
+                self._prime_shifter(index)
+
+    @locked
+    def set_pitch(self, index, semitones):
+        """设置音轨变调（半音），播放中修改不会断音"""
+        self.semitones[index] = semitones
+        shifter = self.shifters[index]
+        if shifter is None:
+            if semitones == 0:
+                return
+            shifter = self.shifters[index] = PitchShifter(CHANNELS)
+            shifter.set_semitones(semitones)
+            self._prime_shifter(index)
+        else:
+            # 已经在变调的音轨改回0也继续经过变调器，直到下次跳转，避免跳变
+            shifter.set_semitones(semitones)
+
+    def pitch_latency(self):
+        """变调处理延迟（帧），没有变调时为0"""
+        return max((s.latency() for s in self.shifters if s is not None), default=0)
+
+    def _prime_shifter(self, index):
+        """清空变调器并预先送入当前位置之后的数据，之后它的输出正好对齐当前位置"""
+        shifter = self.shifters[index]
+        shifter.reset()
+        stem = self.stems[index]
+        if stem is not None:
+            shifter.process(self._read_ahead(stem, self.frame_pos, shifter.latency()))
+
+    def _read_ahead(self, stem, offset, frames, wrap=False):
+        """读取float数据，不足补零；循环段内按循环绕回"""
+        if wrap:
+            index = (offset + np.arange(frames)) % len(stem)
+            return stem[index] * np.float32(1.0 / 32768.0)
+        out = np.zeros((frames, CHANNELS), dtype=np.float32)
+        part = stem[max(0, offset):max(0, offset + frames)]
+        out[:len(part)] = part * np.float32(1.0 / 32768.0)
+        return out
+
+    def _splice_next(self, block, index, offset):
+        """预读超过当前这首结尾时接上下一首的开头，切歌后变调器的输出也是连续的"""
+        total = self.total_frames()
+        stem = self.next_stems[index]
+        if stem is None or offset + len(block) <= total:
+            return
+        start = max(0, total - offset)
+        part = stem[max(0, offset - total):max(0, offset - total) + len(block) - start]
+        block[start:start + len(part)] = part * np.float32(1.0 / 32768.0)
+
+    @locked
+    def set_tempo(self, tempo):
+        """设置播放速度，1.0为原速"""
+        self.stretcher.set_tempo(tempo)
+        self.tempo = self.stretcher.tempo
+        # 从原速切到变速时变速器从当前位置接上；切回原速后仍走变速器直到下次跳转，避免跳变
+        if self.tempo != 1.0 and not self._stretching:
+            self.stretcher.reset(self.stream_pos)
+            self._stretching = True
+
+    def track_position(self, stream_index):
+        """混音流里的位置换算成音轨位置（帧）"""
+        for start, track_start, count in reversed(self._segments):
+            if stream_index >= start:
+                return track_start + min(stream_index - start, count)
+        if self._segments:
+            return self._segments[0][1]
+        return self.frame_pos
+
+    @locked
+    def heard_position(self, buffered_frames=0):
+        """正在播放出来的音轨位置：扣掉声卡缓冲，再经过变速和循环的换算"""
+        out_index = self.output_pos - buffered_frames
+        for out_start, stream_start, tempo in reversed(self._checkpoints):
+            if out_index >= out_start:
+                return self.track_position(stream_start + (out_index - out_start) * tempo)
+        return self.track_position(0)
+
+    @locked
+    def set_stem(self, index, samples):
+        """设置音轨数据，None表示清空"""
+        self.stems[index] = samples
+        if self.shifters[index] is not None:
+            self._prime_shifter(index)
+
+    def set_gain(self, index, gain):
+        """设置目标增益，下一块混音时平滑过渡"""
+        self.gains[index] = gain
+
+    def _gain_ramp(self, index, frames):
+        """本块的增益：不变时返回一个数，变化时返回逐帧插值的 (帧数, 1) 数组"""
+        start, end = self.applied_gains[index], self.gains[index]
+        self.applied_gains[index] = end
+        # 开始播放或跳转后的第一块前面没有声音可衔接，增益直接到位
+        if start == end or frames <= 0 or self.stream_pos == 0:
+            return np.float32(end)
+        return np.linspace(start, end, frames + 1, dtype=np.float32)[1:, None]
+
+    def _measure(self, index, block):
+        """累计一块的电平：一次点积加一次最大最小值，不额外分配内存"""
+        if not len(block):
+            return
+        flat = block.reshape(-1)
+        level = self._levels[index]
+        level[0] += float(np.dot(flat, flat))
+        level[1] = max(level[1], float(flat.max()), -float(flat.min()))
+        level[2] += len(block)
+
+    @locked
+    def take_levels(self):
+        """取走上次以来各音轨的 (RMS, 峰值)，满刻度为1.0；没有声音时为0"""
+        levels, self._levels = self._levels, [[0.0, 0.0, 0], [0.0, 0.0, 0]]
+        return [(float(np.sqrt(sumsq / (frames * CHANNELS))) if frames else 0.0, peak)
+                for sumsq, peak, frames in levels]
+
+    def total_frames(self):
+        """总帧数取较长的音轨"""
+        return max((len(s) for s in self.stems if s is not None), default=0)
+
+    def at_end(self):
+        if self.loop:
+            # 循环中不会放完：B点之后的位置也会绕回循环段
+            return False
+        if self.next_stems is not None:
+            return False
+        return self.frame_pos >= self.total_frames()
+
+    @locked
+    def queue_next(self, stems):
+        """准备好下一首的两个音轨，None表示取消"""
+        self.next_stems = list(stems) if stems is not None else None
+
+    @locked
+    def advance(self):
+        """切到已准备好的下一首，变速和变调器的状态保持连续"""
+        started = time.perf_counter()
+        self.stems = self.next_stems
+        self.next_stems = None
+        self.frame_pos = 0
+        self.clear_loop()
+        self.track_changes += 1
+        self.last_switch_time = time.perf_counter() - started
+        self.trackChanged.emit()
+
+    @locked
+    def set_loop(self, a, b):
+        """设置A-B循环区间（帧），循环段拷贝到内存并在接缝处做交叉淡化"""
+        total = self.total_frames()
+        a = max(0, min(int(a), total))
+        b = max(0, min(int(b), total))
+        if b <= a:
+            self.clear_loop()
+            return
+
+        fade = min(LOOP_CROSSFADE_FRAMES, a, b - a)
+        ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)[:, None]
+        loop_stems = []
+        for stem in self.stems:
+            if stem is None:
+                loop_stems.append(None)
+                continue
+            region = np.zeros((b - a, CHANNELS), dtype=np.int16)
+            part = np.asarray(stem[a:b])
+            region[:len(part)] = part
+            if fade > 0:
+                # 结尾淡出的同时淡入A点前面的音频，跳回A点后波形是连续的
+                tail = region[-fade:].astype(np.float32)
+                lead = np.zeros((fade, CHANNELS), dtype=np.float32)
+                before = np.asarray(stem[a - fade:a])
+                lead[:len(before)] = before
+                region[-fade:] = np.round(tail * (1.0 - ramp) + lead * ramp).astype(np.int16)
+            loop_stems.append(region)
+
+        self.loop_stems = loop_stems
+        self.loop = (a, b)
+        self.loop_count = 0
+        # 播放中按听到的位置设B点时，混音位置已经领先输出缓冲和变速预读，
+        # 超过B点的部分按同样的距离从A点接着放
+        self.frame_pos = self._wrap_loop(self.frame_pos)
+
+    def _wrap_loop(self, pos):
+        """B点及之后的位置绕回循环段内"""
+        a, b = self.loop
+        if pos < b:
+            return pos
+        return a + (pos - b) % (b - a)
+
+    @locked
+    def clear_loop(self):
+        self.loop = None
+        self.loop_stems = [None, None]
+
+    def _mix_from(self, stems, offset, frames, looping=False):
+        """从stems的offset处混出frames帧，较短的音轨不足部分补零"""
+        out = np.zeros((frames, CHANNELS), dtype=np.float32)
+        for index, (stem, shifter) in enumerate(zip(stems, self.shifters)):
+            if stem is None:
+                continue
+            gain = self._gain_ramp(index, frames)
+            if shifter is not None:
+                # 变调器即使静音也要持续处理，保持状态连续
+                ahead = self._read_ahead(stem, offset + shifter.latency(), frames, wrap=looping)
+                if not looping and self.next_stems is not None:
+                    self._splice_next(ahead, index, offset + shifter.latency())
+                shifted = shifter.process(ahead) * gain
+                out += shifted
+                self._measure(index, shifted)
+                continue
+            if np.ndim(gain):
+                part = stem[offset:offset + frames]
+                scaled = part * (gain[:len(part)] * np.float32(1 / 32768.0))
+            elif gain > 0:
+                part = stem[offset:offset + frames]
+                scaled = part * np.float32(gain / 32768.0)
+            else:
+                continue
+            out[:len(part)] += scaled
+            self._measure(index, scaled)
+        return out
+
+    def mix(self, frames):
+        """从当前位置混出最多frames帧，返回float32数组并推进帧计数器"""
+        total = self.total_frames()
+        blocks = []
+        remaining = frames
+        while remaining > 0:
+            pos = self.frame_pos
+            if self.loop and pos >= self.loop[1]:
+                # 在循环段之后（比如跳转过去），同样绕回
+                pos = self.frame_pos = self._wrap_loop(pos)
+                self.loop_count += 1
+            if self.loop and self.loop[0] <= pos < self.loop[1]:
+                # 循环段内：从内存里的循环段取数据，到B点直接回到A点
+                a, b = self.loop
+                count = min(remaining, b - pos)
+                blocks.append(self._mix_from(self.loop_stems, pos - a, count, looping=True))
+                pos += count
+                if pos >= b:
+                    pos = a
+                    self.loop_count += 1
+            else:
+                # 循环段之前只混到A点，之后交给上面的分支
+                limit = self.loop[0] if self.loop and pos < self.loop[0] else total
+                count = min(remaining, limit - pos)
+                if count <= 0:
+                    if self.next_stems is None:
+                        break
+                    # 这一块剩下的部分直接从下一首的开头混
+                    self.advance()
+                    total = self.total_frames()
+                    continue
+                blocks.append(self._mix_from(self.stems, pos, count))
+                pos += count
+            self._segments.append((self.stream_pos, self.frame_pos, count))
+            self.stream_pos += count
+            self.frame_pos = pos
+            remaining -= count
+
+        if len(blocks) == 1:
+            return blocks[0]
+        if not blocks:
+            return np.zeros((0, CHANNELS), dtype=np.float32)
+        return np.concatenate(blocks)
+
+    @locked
+    def read_block(self, frames):
+        """输出一块混音结果（经过变速），同时记录输出和音轨位置的对应关系"""
+        if self._stretching:
+            # 变速器还有没放完的尾巴时，音轨结束后继续输出直到追上
+            if self.at_end() and self.stretcher.clock >= self.stream_pos:
+                return np.zeros((0, CHANNELS), dtype=np.float32)
+            self._checkpoints.append((self.output_pos, self.stretcher.clock, self.tempo))
+            block = self.stretcher.process(self.mix, frames)
+        else:
+            self._checkpoints.append((self.output_pos, self.stream_pos, 1.0))
+            block = self.mix(frames)
+        self.output_pos += len(block)
+        return block
+
+    def readData(self, maxlen):
+        with self.lock:
+            block = self.read_block(maxlen // BYTES_PER_FRAME)
+            self.seek_pending = False
+            if self._seek_started is not None:
+                self.last_seek_latency = time.perf_counter() - self._seek_started
+                self._seek_started = None
+        np.clip(block, -1.0, 1.0, out=block)
+        return (block * 32767.0).astype('<i2').tobytes()
+
+    def writeData(self, data):
+        return -1
+
+    def isSequential(self):
+        return True
+
+    def bytesAvailable(self):
+        remaining = max(0, self.total_frames() - self.frame_pos)
+        return remaining * BYTES_PER_FRAME + super().bytesAvailable()
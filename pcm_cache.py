@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+解码缓存
+把解码后的PCM存成原始文件，下次打开同一个音轨时直接内存映射，不用重新解码；
+按 路径+大小+修改时间 判断缓存是否有效，超出容量时淘汰最久没用的条目
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+import numpy as np
+
+from audio_io import (SAMPLE_RATE, CHANNELS, SAMPLE_WIDTH, DecodeError,
+                      decode_audio)
+
+CACHE_DIR = "pcm_cache"
+INDEX_FILE = "index.json"
+DEFAULT_BUDGET_MB = 2048
+
+# WAV格式码
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def variant_key(semitones, tempo):
+    """缓存里区分不同渲染版本的标记，原样播放时为空字符串"""
+    if semitones == 0 and tempo == 1.0:
+        return ""
+    return f"pitch={semitones:+d},tempo={tempo:.2f}"
+
+
+def source_descriptor(samples):
+    """内存映射的音轨可以只把文件位置交给子进程，不用复制数据"""
+    if isinstance(samples, np.memmap) and samples.filename:
+        return samples.filename, samples.offset, len(samples)
+    return None
+
+
+def map_wav(path):
+    """WAV本身就是输出格式时，直接映射它的data块，连缓存都不用写"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(12)
+            if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+                return None
+            fmt = None
+            while True:
+                chunk = f.read(8)
+                if len(chunk) < 8:
+                    return None
+                chunk_id, size = chunk[:4], int.from_bytes(chunk[4:], 'little')
+                if chunk_id == b'fmt ':
+                    fmt = f.read(size)
+                    f.seek(size % 2, 1)
+                elif chunk_id == b'data':
+                    data_offset = f.tell()
+                    break
+                else:
+                    f.seek(size + size % 2, 1)
+    except OSError:
+        return None
+
+    if fmt is None or len(fmt) < 16:
+        return None
+    format_tag = int.from_bytes(fmt[0:2], 'little')
+    channels = int.from_bytes(fmt[2:4], 'little')
+    sample_rate = int.from_bytes(fmt[4:8], 'little')
+    bits = int.from_bytes(fmt[14:16], 'little')
+    if (format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_EXTENSIBLE)
+            or channels != CHANNELS or sample_rate != SAMPLE_RATE
+            or bits != SAMPLE_WIDTH * 8):
+        return None
+
+    # data块大小可能写错（边录边写的文件），以实际文件长度为准
+    frame_bytes = CHANNELS * SAMPLE_WIDTH
+    available = os.path.getsize(path) - data_offset
+    frames = min(size, available) // frame_bytes
+    if frames <= 0:
+        return None
+    return np.memmap(path, dtype='<i2', mode='r', offset=data_offset, shape=(frames, CHANNELS))
+
+
+class PcmCache:
+    """解码结果的磁盘缓存，条目为原始int16立体声文件"""
+
+    def __init__(self, cache_dir=CACHE_DIR, budget_mb=DEFAULT_BUDGET_MB):
+        self.cache_dir = cache_dir
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.index_path = os.path.join(cache_dir, INDEX_FILE)
+        self.entries = self._load_index()
+        # 后台预加载线程也会读写索引
+        self._lock = threading.RLock()
+        # 命中时只在内存里更新最近使用时间，登记新条目或flush()时才写盘
+        self._dirty = False
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        with self._lock:
+            self._write_index()
+            self._dirty = False
+
+    def flush(self):
+        """把命中时更新的最近使用时间写盘（退出前调用）"""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def _write_index(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"保存解码缓存索引出错: {e}")
+
+    def stamp(self, path):
+        """源文件的 路径|大小|修改时间，要读文件信息；打开音轨时算一次，之后查缓存直接传入"""
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+    def key_for(self, path, variant="", stamp=None):
+        """缓存键：路径、大小、修改时间，文件一改就失效；给了stamp时不访问源文件"""
+        raw = f"{stamp or self.stamp(path)}|{variant}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def data_path(self, key):
+        return os.path.join(self.cache_dir, key + ".pcm")
+
+    def peaks_path(self, path, stamp=None):
+        """波形峰值文件和解码缓存放在一起"""
+        try:
+            return os.path.join(self.cache_dir, self.key_for(path, stamp=stamp) + ".peaks.npz")
+        except OSError:
+            return None
+
+    def get(self, path, variant="", stamp=None):
+        """命中时返回只读内存映射，未命中返回None"""
+        try:
+            key = self.key_for(path, variant, stamp)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self.entries.get(key)
+            data_path = self.data_path(key)
+            if entry is None or not os.path.exists(data_path):
+                return None
+            # 调速度、变调时每次都会查缓存，这里不写盘
+            entry['last_used'] = time.time()
+            self._dirty = True
+        if entry['frames'] == 0:
+            return np.zeros((0, CHANNELS), dtype=np.int16)
+        return np.memmap(data_path, dtype='<i2', mode='r', shape=(entry['frames'], CHANNELS))
+
+    def put(self, path, samples, variant=""):
+        """写入缓存并返回映射后的数据"""
+        key = self.key_for(path, variant)
+        data_path = self.data_path(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = data_path + ".tmp"
+            np.ascontiguousarray(samples, dtype='<i2').tofile(tmp_path)
+            os.replace(tmp_path, data_path)
+        except OSError as e:
+            print(f"写入解码缓存出错: {e}")
+            return samples
+
+        self.register(path, len(samples), variant)
+        if len(samples) == 0:
+            return samples
+        return np.memmap(data_path, dtype='<i2', mode='r', shape=(len(samples), CHANNELS))
+
+    def reserve(self, path, variant="", stamp=None):
+        """由其他进程写入的条目：先取得数据文件路径，写完后再register()"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return self.data_path(self.key_for(path, variant, stamp))
+
+    def register(self, path, frames, variant="", stamp=None):
+        """登记已经写好的数据文件，只在主进程里修改索引"""
+        key = self.key_for(path, variant, stamp)
+        with self._lock:
+            self.entries[key] = {
+                'path': os.path.abspath(path),
+                'variant': variant,
+                'frames': frames,
+                'bytes': frames * CHANNELS * SAMPLE_WIDTH,
+                'last_used': time.time(),
+            }
+            self._evict(keep=key)
+            self._save_index()
+
+    def _evict(self, keep=None):
+        """超出容量时按最近使用时间淘汰"""
+        total = sum(e['bytes'] for e in self.entries.values())
+        for key in sorted(self.entries, key=lambda k: self.entries[k]['last_used']):
+            if total <= self.budget_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                if os.path.exists(self.data_path(key)):
+                    os.remove(self.data_path(key))
+                peaks_path = os.path.join(self.cache_dir, key + ".peaks.npz")
+                if os.path.exists(peaks_path):
+                    os.remove(peaks_path)
+            except OSError:
+                # Windows下正在映射的文件删不掉，留到下次再淘汰
+                continue
+            total -= self.entries.pop(key)['bytes']
+
+    def load(self, path):
+        """取音轨数据：能直接映射的WAV直接映射，否则查缓存，最后才解码"""
+        mapped = map_wav(path)
+        if mapped is not None:
+            return mapped
+        cached = self.get(path)
+        if cached is not None:
+            return cached
+        if not os.path.exists(path):
+            raise DecodeError(f"文件不存在: {path}")
+        return self.put(path, decode_audio(path))
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+播放器核心
+加载音轨、音量平衡、跳转和配置读写，不依赖任何界面控件；
+图形界面和命令行工具共用这一层
+"""
+
+import os
+import math
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from audio_io import SAMPLE_RATE
+from pcm_cache import PcmCache, map_wav
+from library import probe_file
+from audio_engine import MixEngine, StemPreloader
+from settings_store import CONFIG_FILE, SettingsStore, load_config_file, song_key
+from loudness import LoudnessAnalyzer, normalization_gain
+
+
+# 平衡曲线
+PAN_LINEAR = "linear"            # 中间两边都是原音量，往一侧拉时另一侧线性减小
+PAN_EQUAL_POWER = "equal_power"  # 两边功率之和不变，拉动时总响度不变（中间各约71%）
+PAN_LAWS = (PAN_LINEAR, PAN_EQUAL_POWER)
+
+
+def balance_gains(value, law=PAN_LINEAR):
+    """平衡滑块位置（0~100）换算成 (伴奏增益, 人声增益)，0.0 ~ 1.0"""
+    if law == PAN_EQUAL_POWER:
+        angle = value / 100.0 * math.pi / 2
+        return math.cos(angle), math.sin(angle)
+    if value <= 50:
+        # 左半部分：减少人声音量
+        return 1.0, value / 50.0
+    # 右半部分：减少伴奏音量
+    return (100 - value) / 50.0, 1.0
+
+
+def balance_volumes(value, law=PAN_LINEAR):
+    """平衡滑块位置换算成 (伴奏音量, 人声音量) 百分比，用于显示"""
+    return tuple(int(round(gain * 100)) for gain in balance_gains(value, law))
+
+
+def probe_duration(path, cache=None):
+    """音频时长（帧）：WAV只读文件头，其他格式要解码（结果进缓存）"""
+    mapped = map_wav(path)
+    if mapped is not None:
+        return len(mapped)
+    sample_rate, frames, _ = probe_file(path)
+    if sample_rate:
+        return int(round(frames * SAMPLE_RATE / sample_rate))
+    return len((cache or PcmCache()).load(path))
+
+
+def config_files(config, check_exists=True):
+    """配置里记录的两个音轨路径，不存在的文件视为未选择
+
+    check_exists为False时不检查（交给后台线程，休眠的移动硬盘不会卡住界面）
+    """
+    files = []
+    for key in ('player1_file', 'player2_file'):
+        path = config.get(key) or ""
+        files.append(path if path and (not check_exists or os.path.exists(path)) else "")
+    return files
+
+
+# 音轨响度和歌曲设置存在同一个键值表里，用前缀区分
+LOUDNESS_KEY = "loudness|"
+
+
+class PlayerCore(QObject):
+    """播放器核心：界面只负责显示，播放相关的状态都在这里"""
+
+    loudnessChanged = pyqtSignal()
+
+    def __init__(self, parent=None, output=None, config_file=CONFIG_FILE):
+        super().__init__(parent)
+        self.engine = MixEngine(self, output)
+        self.config_file = config_file
+        self.settings = SettingsStore(config_file, parent=self)
+        self.volume_balance = 50
+        self.pan_law = PAN_LINEAR
+
+        # 每首歌自己的设置，按伴奏和人声的内容指纹记录（指纹由引擎的加载线程算好）
+        self.song_key = None
+        self.engine.trackChanged.connect(self.restore_song)
+        self.engine.pairLoaded.connect(self.restore_song)
+
+        # 响度归一化：每个音轨先乘归一化增益，再按平衡曲线分配音量；
+        # loudness[i] 为 {'lufs': 积分响度, 'peak': 峰值}，还没分析出来时为None
+        self.normalize = False
+        self.loudness = [None, None]
+        self._loudness_keys = [None, None]
+        self._analyzers = [None, None]
+
+    @property
+    def files(self):
+        return self.engine.files
+
+    def load(self, index, path, restore=True):
+        """加载音轨，index 0 为伴奏，1 为人声，path为空表示清空；
+        restore为False时不套用这首歌上次的设置（命令行完全按参数播放）"""
+        self.engine.set_stem(index, path)
+        if restore:
+            self.restore_song()
+        else:
+            self.song_key = None
+            self.analyze_loudness()
+
+    def set_balance(self, value):
+        """设置音量平衡，返回 (伴奏音量, 人声音量) 百分比"""
+        self.volume_balance = value
+        # 增益在混音时逐块平滑过渡
+        gains = zip(self.normalization_gains(), balance_gains(value, self.pan_law))
+        for index, (normalization, gain) in enumerate(gains):
+            self.engine.set_stem_gain(index, normalization * gain)
+        return balance_volumes(value, self.pan_law)
+
+    def set_pan_law(self, law):
+        """切换平衡曲线（PAN_LINEAR 或 PAN_EQUAL_POWER），返回新的音量百分比"""
+        self.pan_law = law if law in PAN_LAWS else PAN_LINEAR
+        return self.set_balance(self.volume_balance)
+
+    def set_normalize(self, enabled):
+        """开关响度归一化，返回新的音量百分比；打开时补上还没分析过的音轨"""
+        turned_on = bool(enabled) and not self.normalize
+        self.normalize = bool(enabled)
+        if turned_on:
+            self.analyze_loudness()
+        return self.set_balance(self.volume_balance)
+
+    def normalization_gains(self):
+        """两个音轨的归一化增益，关闭或还没分析出响度时为1.0"""
+        if not self.normalize:
+            return [1.0, 1.0]
+        return [normalization_gain(info['lufs'], info['peak']) if info else 1.0
+                for info in self.loudness]
+
+    def analyze_loudness(self):
+        """读取缓存的音轨响度，没有的在后台分析（只在打开归一化时）；
+        结果按内容指纹保存，每个音轨只分析一次"""
+        for index, path in enumerate(self.files):
+            fingerprint = self.engine.fingerprint(index) if path else None
+            key = LOUDNESS_KEY + fingerprint if fingerprint else None
+            if key is not None and key == self._loudness_keys[index] and self._analyzers[index]:
+                # 同一个音轨已经在分析了（先后加载伴奏和人声时会走到这里）
+                continue
+            self.loudness[index] = None
+            self._analyzers[index] = None
+            self._loudness_keys[index] = key
+            if key is None:
+                continue
+            cached = self.settings.song(self._loudness_keys[index])
+            if 'lufs' in cached:
+                self.loudness[index] = cached
+            elif self.normalize and self.engine.sources[index] is not None:
+                # 直接读解码缓存的内存映射，不再解码
+                analyzer = LoudnessAnalyzer(index, self.engine.sources[index], self)
+                analyzer.analyzed.connect(self._on_loudness_analyzed)
+                analyzer.finished.connect(analyzer.deleteLater)
+                self._analyzers[index] = analyzer
+                analyzer.start()
+        self.loudnessChanged.emit()
+
+    def _on_loudness_analyzed(self, index, lufs, peak):
+        # 分析期间换了音轨的话，旧结果直接丢掉
+        if self.sender() is not self._analyzers[index]:
+            return
+        self._analyzers[index] = None
+        self.loudness[index] = {'lufs': lufs, 'peak': peak}
+        self.settings.set_song(self._loudness_keys[index], self.loudness[index])
+        if self.normalize:
+            self.set_balance(self.volume_balance)
+        self.loudnessChanged.emit()
+
+    def analyzing(self):
+        return any(analyzer is not None for analyzer in self._analyzers)
+
+    def restore_song(self):
+        """找回当前这首歌上次的平衡、速度、变调和循环，没有记录的用默认值（平衡沿用当前值）"""
+        self.song_key = None
+        settings = {}
+        if any(self.files):
+            self.song_key = song_key(self.engine.fingerprint(index) if path else None
+                                     for index, path in enumerate(self.files))
+            settings = self.settings.song(self.song_key)
+        self.analyze_loudness()
+        self.set_balance(settings.get('balance', self.volume_balance))
+        self.engine.set_tempo(settings.get('tempo', 1.0))
+        for index, semitones in enumerate(settings.get('pitch', (0, 0))):
+            self.engine.set_pitch(index, semitones)
+        loop = settings.get('loop')
+        if loop and loop[1] <= self.engine.duration_frames():
+            self.engine.set_loop(*loop)
+        return settings
+
+    def remember_song(self):
+        """记下当前这首歌的设置（稍后统一写盘）"""
+        if self.song_key is None:
+            return
+        loop = self.engine.loop()
+        self.settings.set_song(self.song_key, {
+            'balance': self.volume_balance,
+            'tempo': self.engine.tempo(),
+            'pitch': [self.engine.pitch(0), self.engine.pitch(1)],
+            'loop': list(loop) if loop else None,
+        })
+
+    def seek_ms(self, milliseconds):
+        self.engine.set_position(milliseconds)
+
+    def read_config(self):
+        """读取配置并应用引擎相关的设置，返回配置内容；音轨由调用方决定是否加载"""
+        config = self.settings.load_config()
+
+        # 解码缓存容量（MB）
+        if 'pcm_cache_mb' in config:
+            self.engine.cache.budget_bytes = int(config['pcm_cache_mb'] * 1024 * 1024)
+        # 漂移校正阈值（毫秒）
+        if 'drift_threshold_ms' in config:
+            self.engine.drift.threshold_ms = config['drift_threshold_ms']
+        if 'normalize_loudness' in config:
+            self.normalize = bool(config['normalize_loudness'])
+        if 'pan_law' in config:
+            self.pan_law = config['pan_law'] if config['pan_law'] in PAN_LAWS else PAN_LINEAR
+        if 'volume_balance' in config:
+            self.set_balance(config['volume_balance'])
+        return config
+
+    def write_config(self):
+        """保存配置：连续多次修改只在最后一次之后写一次盘，在后台线程里写"""
+        self.settings.set_config({
+            'player1_file': self.files[0],
+            'player2_file': self.files[1],
+            'volume_balance': self.volume_balance,
+            'pan_law': self.pan_law,
+            'normalize_loudness': self.normalize,
+            'drift_threshold_ms': self.engine.drift.threshold_ms,
+            'pcm_cache_mb': self.engine.cache.budget_bytes // (1024 * 1024)
+        })
+
+    def close(self):
+        """退出前停止播放，等后台打开音轨和响度分析结束，并把还没写盘的设置写完"""
+        self.engine.close()
+        for thread in self.findChildren((StemPreloader, LoudnessAnalyzer)):
+            thread.wait()
+        self.engine.cache.flush()
+        self.settings.close()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+变速/变调预渲染
+在进程池里把音轨按选定的 (变调, 速度) 渲染好写进解码缓存，
+之后播放这个版本时不再需要实时处理，只是内存映射读取
+"""
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from audio_io import CHANNELS
+from mixer import StemMixer
+
+RENDER_BLOCK_FRAMES = 16384
+PROGRESS_STEP = 5  # 每5%报告一次进度
+
+
+def render_blocks(samples, semitones, tempo):
+    """用和实时播放相同的处理链逐块渲染，结果与实时播放一致"""
+    mixer = StemMixer()
+    mixer.set_stem(0, samples)
+    mixer.set_pitch(0, semitones)
+    mixer.set_tempo(tempo)
+    mixer.seek(0, measure=False)
+    while True:
+        block = mixer.read_block(RENDER_BLOCK_FRAMES)
+        if not len(block):
+            break
+        yield block, mixer.frame_pos
+
+
+def render_stem(task_id, source, output_path, semitones, tempo, progress_queue=None):
+    """子进程入口：渲染一个音轨并写成缓存文件，返回输出帧数"""
+    filename, offset, frames = source
+    samples = np.memmap(filename, dtype='<i2', mode='r', offset=offset, shape=(frames, CHANNELS))
+
+    # 变速器按整块输出，最后一块可能超出，按速度截到应有的长度
+    limit = int(round(frames / tempo))
+    written = 0
+    reported = 0
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        for block, frame_pos in render_blocks(samples, semitones, tempo):
+            block = block[:limit - written]
+            np.clip(block, -1.0, 1.0, out=block)
+            f.write((block * 32767.0).astype('<i2').tobytes())
+            written += len(block)
+            percent = int(frame_pos * 100 / max(1, frames))
+            if progress_queue is not None and percent >= reported + PROGRESS_STEP:
+                reported = percent
+                progress_queue.put((task_id, percent))
+    os.replace(tmp_path, output_path)
+    return written
+
+
+class PrerenderJobs(QObject):
+    """管理进程池里的渲染任务，定时收集进度并在界面线程发信号"""
+
+    progress = pyqtSignal(int, int)             # 音轨序号, 百分比
+    finished = pyqtSignal(int, str, str, int)   # 音轨序号, 文件路径, 版本标记, 帧数
+    failed = pyqtSignal(int, str)               # 音轨序号, 错误信息
+
+    def __init__(self, parent=None, max_workers=None):
+        super().__init__(parent)
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self._executor = None
+        self._manager = None
+        self._queue = None
+        self._tasks = {}
+        self._next_id = 0
+
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._poll)
+
+    def _ensure_pool(self):
+        # 进程池和进度队列第一次用到时才创建，不影响启动速度
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            self._manager = multiprocessing.Manager()
+            self._queue = self._manager.Queue()
+
+    def is_running(self, path, variant):
+        return any(t[1] == path and t[2] == variant for t in self._tasks.values())
+
+    def submit(self, index, path, source, output_path, variant, semitones, tempo):
+        """提交一个渲染任务，同一版本正在渲染时忽略"""
+        if self.is_running(path, variant):
+            return
+        self._ensure_pool()
+        task_id = self._next_id
+        self._next_id += 1
+        future = self._executor.submit(render_stem, task_id, source, output_path,
+                                       semitones, tempo, self._queue)
+        self._tasks[task_id] = (index, path, variant, future)
+        self.progress.emit(index, 0)
+        if not self._timer.isActive():
+            self._timer.start(200)
+
+    def _poll(self):
+        while not self._queue.empty():
+            task_id, percent = self._queue.get_nowait()
+            if task_id in self._tasks:
+                self.progress.emit(self._tasks[task_id][0], percent)
+
+        for task_id, (index, path, variant, future) in list(self._tasks.items()):
+            if not future.done():
+                continue
+            del self._tasks[task_id]
+            try:
+                self.finished.emit(index, path, variant, future.result())
+            except Exception as e:
+                self.failed.emit(index, str(e))
+
+        if not self._tasks:
+            self._timer.stop()
+
+    def shutdown(self):
+        self._timer.stop()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._manager.shutdown()
+            self._executor = None
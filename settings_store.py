@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+设置的保存
+全局配置仍是 player_config.json（先写临时文件再改名，写到一半崩溃也不会损坏），
+每首歌自己的设置存在SQLite里按键读取，启动时只读当前这首；
+短时间内的多次修改合并成一次，在后台线程里写盘
+"""
+
+import os
+import json
+import queue
+import sqlite3
+import hashlib
+
+from PyQt5.QtCore import QObject, QThread, QTimer
+
+from storage import connect_db
+
+CONFIG_FILE = "player_config.json"
+SETTINGS_DB = "settings.db"
+# 最后一次修改之后等多久再写盘（毫秒）
+SAVE_DELAY_MS = 500
+# 内容指纹：文件头加上均匀分布的几小块，大文件在慢速U盘上也只读一百多KB
+FINGERPRINT_HEAD = 64 * 1024
+FINGERPRINT_BLOCK = 16 * 1024
+FINGERPRINT_SAMPLES = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    key TEXT PRIMARY KEY,
+    settings TEXT NOT NULL
+);
+"""
+
+
+def load_config_file(config_file=CONFIG_FILE):
+    """读取配置文件，不存在或损坏时返回空配置"""
+    if not os.path.exists(config_file):
+        return {}
+    try:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"加载配置文件出错: {e}")
+        return {}
+
+
+def write_json_atomic(path, data):
+    """写入临时文件并落盘后再替换，目标文件要么是旧内容要么是新内容"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def file_fingerprint(path):
+    """文件内容的指纹，文件改名或移动后不变"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        digest.update(size.to_bytes(8, 'little'))
+        digest.update(f.read(FINGERPRINT_HEAD))
+        if size > FINGERPRINT_HEAD:
+            span = size - FINGERPRINT_HEAD - FINGERPRINT_BLOCK
+            for i in range(1, FINGERPRINT_SAMPLES + 1):
+                f.seek(FINGERPRINT_HEAD + max(0, span) * i // FINGERPRINT_SAMPLES)
+                digest.update(f.read(FINGERPRINT_BLOCK))
+    return digest.hexdigest()
+
+
+def song_key(fingerprints):
+    """伴奏和人声的指纹合成一首歌的键，缺的音轨记为空"""
+    return "|".join(fp or "" for fp in fingerprints)
+
+
+def connect(db_path=SETTINGS_DB):
+    """打开设置数据库；写线程写入时界面线程照样可以读"""
+    return connect_db(db_path, SCHEMA)
+
+
+class SettingsWriter(QThread):
+    """后台写盘线程，按顺序处理写入请求"""
+
+    def __init__(self, config_file, db_path, parent=None):
+        super().__init__(parent)
+        self.config_file = config_file
+        self.db_path = db_path
+        self.requests = queue.Queue()
+
+    def run(self):
+        conn = None
+        while True:
+            request = self.requests.get()
+            try:
+                if request is None:
+                    break
+                config, songs = request
+                if config is not None:
+                    write_json_atomic(self.config_file, config)
+                if songs:
+                    # SQLite连接只能在创建它的线程里用
+                    conn = conn or connect(self.db_path)
+                    with conn:
+                        conn.executemany(
+                            "INSERT OR REPLACE INTO songs (key, settings) VALUES (?, ?)",
+                            [(key, json.dumps(value, ensure_ascii=False))
+                             for key, value in songs.items()])
+            except (OSError, sqlite3.Error) as e:
+                print(f"保存设置出错: {e}")
+            finally:
+                self.requests.task_done()
+        if conn:
+            conn.close()
+
+
+class SettingsStore(QObject):
+    """全局配置和每首歌的设置；修改先记在内存里，停止修改一段时间后统一写盘"""
+
+    def __init__(self, config_file=CONFIG_FILE, db_path=None, parent=None,
+                 delay_ms=SAVE_DELAY_MS):
+        super().__init__(parent)
+        self.config_file = config_file
+        # 默认和配置文件放在同一个目录
+        self.db_path = db_path or os.path.join(os.path.dirname(config_file), SETTINGS_DB)
+        self._conn = None
+        self._writer = None
+        self._config = None
+        # 本次运行中读过或改过的歌曲设置，dirty里是还没交给写盘线程的
+        self._songs = {}
+        self._dirty = set()
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(delay_ms)
+        self._timer.timeout.connect(self._submit)
+
+    def load_config(self):
+        return load_config_file(self.config_file)
+
+    def set_config(self, config):
+        """记下新的全局配置，稍后写盘"""
+        self._config = dict(config)
+        self._timer.start()
+
+    def song(self, key):
+        """读取一首歌的设置，没有时返回空字典"""
+        if key not in self._songs:
+            settings = {}
+            if os.path.exists(self.db_path):
+                if self._conn is None:
+                    self._conn = connect(self.db_path)
+                row = self._conn.execute("SELECT settings FROM songs WHERE key = ?",
+                                         (key,)).fetchone()
+                settings = json.loads(row[0]) if row else {}
+            self._songs[key] = settings
+        return dict(self._songs[key])
+
+    def set_song(self, key, settings):
+        """记下一首歌的设置，稍后写盘"""
+        self._songs[key] = dict(settings)
+        self._dirty.add(key)
+        self._timer.start()
+
+    def pending(self):
+        return self._config is not None or bool(self._dirty)
+
+    def _submit(self):
+        """把攒下的修改交给写盘线程"""
+        self._timer.stop()
+        if not self.pending():
+            return
+        if self._writer is None:
+            self._writer = SettingsWriter(self.config_file, self.db_path, self)
+            self._writer.start()
+        songs = {key: self._songs[key] for key in self._dirty}
+        self._writer.requests.put((self._config, songs))
+        self._config = None
+        self._dirty = set()
+
+    def flush(self):
+        """立即写盘并等待写完（退出前调用）"""
+        self._submit()
+        if self._writer is not None:
+            self._writer.requests.join()
+
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.requests.put(None)
+            self._writer.wait()
+            self._writer = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
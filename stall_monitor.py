@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+界面线程卡顿监测
+界面线程上的心跳定时器定期打点，另一个线程发现心跳停了超过阈值就记下界面线程
+当时的调用栈；关键的槽函数用 timed 包一层，记录每次的用时，卡顿记录里带上正在执行的那个。
+心跳只在播放中或窗口在前台时运行，空闲时进程不会被定时唤醒。
+卡顿写进日志，用户反馈"卡"的时候可以直接看是哪个操作、卡了多久
+
+环境变量：
+    PLAYER_STALL_MS=阈值毫秒   默认150，0为关闭监测
+    PLAYER_PROFILE=文件名      用cProfile记录整个运行过程，退出时写入该文件
+"""
+
+import os
+import sys
+import time
+import cProfile
+import pstats
+import threading
+import functools
+import traceback
+from collections import deque
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from storage import append_log
+
+DEFAULT_STALL_MS = 150
+HEARTBEAT_MS = 50
+STALL_LOG_FILE = "stall_log.csv"
+STALL_ENV = "PLAYER_STALL_MS"
+PROFILE_ENV = "PLAYER_PROFILE"
+
+
+class HandlerTimings:
+    """槽函数的调用次数和用时；只在界面线程里修改"""
+
+    def __init__(self):
+        # 名称 -> [次数, 总用时ms, 最长ms]
+        self.stats = {}
+        # 正在执行的槽函数（可能嵌套），监测线程读取栈顶
+        self.active = []
+        # 上次心跳以来最慢的一次 (名称, 用时ms)
+        self.slowest = None
+
+    def current(self):
+        active = self.active
+        return active[-1] if active else None
+
+    def record(self, name, elapsed_ms):
+        stats = self.stats.setdefault(name, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed_ms
+        stats[2] = max(stats[2], elapsed_ms)
+        if self.slowest is None or elapsed_ms > self.slowest[1]:
+            self.slowest = (name, elapsed_ms)
+
+    def take_slowest(self):
+        slowest, self.slowest = self.slowest, None
+        return slowest
+
+    def report(self):
+        """{名称: {'count', 'mean_ms', 'max_ms'}}"""
+        return {name: {'count': count, 'mean_ms': total / count, 'max_ms': longest}
+                for name, (count, total, longest) in self.stats.items()}
+
+    def reset(self):
+        self.stats = {}
+        self.slowest = None
+
+
+HANDLER_TIMINGS = HandlerTimings()
+
+
+def timed(func):
+    """记录槽函数用时的装饰器"""
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        HANDLER_TIMINGS.active.append(name)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            HANDLER_TIMINGS.active.pop()
+            HANDLER_TIMINGS.record(name, (time.perf_counter() - started) * 1000)
+    return wrapper
+
+
+def stall_threshold_ms():
+    """环境变量里的卡顿阈值，没有设置或无效时用默认值"""
+    try:
+        return float(os.environ.get(STALL_ENV, DEFAULT_STALL_MS))
+    except ValueError:
+        return DEFAULT_STALL_MS
+
+
+class StallWatchdog(QObject):
+    """界面线程卡顿监测：心跳间隔超过阈值就记一次卡顿"""
+
+    stalled = pyqtSignal(object)   # 卡顿记录 {'time', 'duration_ms', 'handler', 'stack'}
+
+    def __init__(self, threshold_ms=DEFAULT_STALL_MS, parent=None,
+                 log_file=STALL_LOG_FILE, timings=HANDLER_TIMINGS):
+        super().__init__(parent)
+        self.threshold_ms = threshold_ms
+        self.log_file = log_file
+        self.timings = timings
+        self.stalls = deque(maxlen=100)
+
+        self._heartbeat = QTimer(self)
+        self._heartbeat.setInterval(HEARTBEAT_MS)
+        self._heartbeat.timeout.connect(self._beat)
+        self._last_beat = time.perf_counter()
+        # 监测线程在卡顿期间抓到的 (槽函数, 调用栈)
+        self._suspect = None
+        self._gui_thread = threading.get_ident()
+        self._stop = threading.Event()
+        # 心跳在跑的时候置位，监测线程暂停时在这上面等待
+        self._beating = threading.Event()
+        self._active = True
+        self._watcher = None
+
+    def start(self):
+        if self.threshold_ms <= 0 or self._watcher is not None:
+            return
+        self._gui_thread = threading.get_ident()
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="stall-watchdog", daemon=True)
+        self._watcher.start()
+        if self._active:
+            self._resume()
+
+    def stop(self):
+        self._pause()
+        if self._watcher is not None:
+            self._stop.set()
+            self._beating.set()
+            self._watcher.join()
+            self._watcher = None
+            self._beating.clear()
+
+    def set_active(self, active):
+        """播放中或窗口在前台时监测，否则停掉心跳和监测线程的轮询"""
+        self._active = active
+        if self._watcher is None:
+            return
+        if active:
+            self._resume()
+        else:
+            self._pause()
+
+    def _resume(self):
+        if self._heartbeat.isActive():
+            return
+        self._last_beat = time.perf_counter()
+        self._suspect = None
+        self.timings.take_slowest()
+        self._heartbeat.start()
+        self._beating.set()
+
+    def _pause(self):
+        self._heartbeat.stop()
+        self._beating.clear()
+
+    def _watch(self):
+        """监测线程：心跳停了超过阈值时，趁界面线程还卡着抓它的调用栈"""
+        while self._beating.wait() and not self._stop.wait(self.threshold_ms / 3000.0):
+            if not self._beating.is_set():
+                continue
+            blocked_ms = (time.perf_counter() - self._last_beat) * 1000 - HEARTBEAT_MS
+            if blocked_ms < self.threshold_ms or self._suspect is not None:
+                continue
+            frame = sys._current_frames().get(self._gui_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            self._suspect = (self.timings.current() or describe_handler(stack), stack)
+
+    def _beat(self):
+        now = time.perf_counter()
+        blocked_ms = (now - self._last_beat) * 1000 - HEARTBEAT_MS
+        self._last_beat = now
+        suspect, self._suspect = self._suspect, None
+        slowest = self.timings.take_slowest()
+        if blocked_ms < self.threshold_ms:
+            return
+
+        if suspect is not None:
+            handler, stack = suspect
+        else:
+            # 卡顿在监测线程醒来之前就结束了，只能按用时最长的槽函数算
+            handler, stack = (slowest[0] if slowest else "未知"), []
+        record = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'duration_ms': blocked_ms,
+            'handler': handler,
+            'stack': "".join(traceback.format_list(stack)),
+        }
+        self.stalls.append(record)
+        print(f"界面卡顿 {blocked_ms:.0f}ms: {handler}")
+        self._log(record)
+        self.stalled.emit(record)
+
+    def _log(self, record):
+        """追加一条卡顿记录"""
+        append_log(self.log_file, ['time', 'duration_ms', 'handler', 'stack'],
+                   [record['time'], f"{record['duration_ms']:.0f}",
+                    record['handler'], record['stack']], "卡顿日志")
+
+
+def describe_handler(stack):
+    """没有计时的槽函数时，用事件循环调进来的第一层Python函数代表卡住的操作"""
+    if not stack:
+        return "未知"
+    entry = stack[-1]
+    for outer, inner in zip(stack, stack[1:]):
+        if "exec_(" in (outer.line or "") or "processEvents(" in (outer.line or ""):
+            entry = inner
+    return f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+
+
+def start_profiling():
+    """设置了 PLAYER_PROFILE 时开始cProfile记录，返回记录器，否则返回None"""
+    if not os.environ.get(PROFILE_ENV):
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profiling(profiler, timings=HANDLER_TIMINGS, top=20):
+    """停止记录，写入 PLAYER_PROFILE 指定的文件，并打印最耗时的函数和槽函数用时"""
+    if profiler is None:
+        return
+    profiler.disable()
+    path = os.environ.get(PROFILE_ENV)
+    try:
+        profiler.dump_stats(path)
+        print(f"性能记录已写入 {path}（用 python -m pstats {path} 查看）")
+    except OSError as e:
+        print(f"写入性能记录出错: {e}")
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(top)
+    for name, stats in sorted(timings.report().items()):
+        print(f"{name}: {stats['count']}次 平均{stats['mean_ms']:.2f}ms 最长{stats['max_ms']:.1f}ms")
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+本地存储的公共部分
+曲库和设置共用的SQLite连接方式，漂移和卡顿共用的CSV日志追加
+"""
+
+import os
+import csv
+import sqlite3
+
+
+def connect_db(db_path, schema):
+    """打开数据库并建表；WAL模式下后台线程写入时界面线程照样可以读"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(schema)
+    return conn
+
+
+def append_log(log_file, header, row, name="日志"):
+    """往CSV日志追加一行，新文件先写表头；log_file为空时不记录"""
+    if not log_file:
+        return
+    try:
+        is_new = not os.path.exists(log_file)
+        with open(log_file, 'a', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            if is_new:
+                writer.writerow(header)
+            writer.writerow(row)
+    except OSError as e:
+        print(f"写入{name}出错: {e}")
@@ -0,0 +1,1053 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+混音引擎测试脚本
+用合成的音轨验证解码和混音逻辑，不需要声卡
+"""
+
+import sys
+import os
+import wave
+import tempfile
+
+import numpy as np
+
+from audio_io import SAMPLE_RATE, read_wav
+from mixer import StemMixer
+from pcm_cache import PcmCache, map_wav, variant_key, source_descriptor
+from dsp import TimeStretcher, PitchShifter
+from waveform import build_peaks, load_or_build_peaks
+from drift_monitor import DriftMonitor, ACTION_NONE, ACTION_RATE, ACTION_SEEK
+from prerender import render_stem
+from library import Library, scan_library, split_stem_name
+from audio_sink import NullAudioOutput, ThreadedOutput, STOPPED_STATE, SUSPENDED_STATE
+from audio_engine import MODE_MIX, PAUSED
+from player_core import PlayerCore, PAN_EQUAL_POWER, balance_gains, balance_volumes
+from settings_store import SettingsStore, load_config_file, file_fingerprint
+from export import ExportError, batch_mixdown, mixdown
+from loudness import integrated_loudness, normalization_gain, TARGET_LUFS
+import cli
+
+
+def write_test_wav(path, samples, sample_rate=SAMPLE_RATE):
+    """写一个16位PCM测试文件，samples为 (帧数, 声道) 的float数组"""
+    data = (np.clip(samples, -1, 1) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(samples.shape[1])
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(data.tobytes())
+
+
+def sine(seconds, freq=440.0, channels=2, sample_rate=SAMPLE_RATE, amplitude=0.5):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    tone = (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+    return np.repeat(tone[:, None], channels, axis=1)
+
+
+def test_read_wav():
+    """测试WAV读取和格式转换"""
+    print("测试WAV读取...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "mono_22k.wav")
+        write_test_wav(path, sine(1.0, channels=1, sample_rate=22050), sample_rate=22050)
+        data = read_wav(path)
+
+    # 单声道22.05kHz应被转换为立体声44.1kHz
+    assert data.dtype == np.int16
+    assert data.shape == (SAMPLE_RATE, 2)
+    assert np.array_equal(data[:, 0], data[:, 1])
+    print("✓ WAV读取正常")
+
+
+def test_mixer_single_clock():
+    """测试两个音轨共用一个帧计数器"""
+    print("测试混音器...")
+    mixer = StemMixer()
+    accompaniment = np.full((1000, 2), 8000, dtype=np.int16)
+    vocals = np.full((600, 2), 4000, dtype=np.int16)
+    mixer.set_stem(0, accompaniment)
+    mixer.set_stem(1, vocals)
+    mixer.set_gain(1, 0.5)
+
+    block = mixer.mix(512)
+    assert block.shape == (512, 2)
+    assert np.allclose(block, (8000 + 2000) / 32768.0)
+    assert mixer.frame_pos == 512
+
+    # 人声较短，结束后只剩伴奏
+    block = mixer.mix(512)
+    assert block.shape == (488, 2)
+    assert np.allclose(block[100:], 8000 / 32768.0)
+    assert mixer.at_end()
+
+    # 按帧跳转，两个音轨落在同一帧上
+    vocals[300:] = 0
+    mixer.seek(299)
+    block = mixer.mix(2)
+    assert np.allclose(block[0], (8000 + 2000) / 32768.0)
+    assert np.allclose(block[1], 8000 / 32768.0)
+    print("✓ 混音器正常")
+
+
+def test_mixer_loop():
+    """测试A-B循环按帧绕回"""
+    print("测试A-B循环...")
+    mixer = StemMixer()
+    ramp = np.repeat(np.arange(4000, dtype=np.int16)[:, None], 2, axis=1)
+    mixer.set_stem(0, ramp)
+    mixer.set_loop(1000, 1500)
+    mixer.seek(1400)
+
+    block = mixer.mix(300)
+    values = np.round(block[:, 0] * 32768.0).astype(int)
+    # 接缝前64帧交叉淡化，之外和原始数据逐帧一致
+    assert np.array_equal(values[:36], np.arange(1400, 1436))
+    assert np.array_equal(values[100:], np.arange(1000, 1200))
+
+    # 绕很多圈之后位置仍然精确
+    for _ in range(200):
+        mixer.mix(500)
+    assert mixer.frame_pos == 1200
+    assert mixer.loop_count == 201
+    assert not mixer.at_end()
+
+    # 混音位置已经过了B点（播放中按听到的位置设B点）：立即按同样的距离绕回
+    mixer.seek(1600)
+    mixer.set_loop(1000, 1500)
+    assert mixer.frame_pos == 1100 and not mixer.at_end()
+    # 循环期间跳到B点之后也绕回，不会一直放到结尾
+    mixer.seek(3800)
+    mixer.mix(100)
+    assert mixer.frame_pos == 1400 and mixer.loop_count == 1
+    print("✓ A-B循环正常")
+
+
+def test_gain_ramp():
+    """测试增益平滑过渡和电平计算"""
+    print("测试增益过渡...")
+    mixer = StemMixer()
+    mixer.set_stem(0, np.full((4096, 2), 16384, dtype=np.int16))
+    first = mixer.mix(512)
+    # 开始播放的第一块增益直接到位
+    assert np.allclose(first, 0.5)
+
+    for value in range(100, -1, -10):
+        mixer.set_gain(0, value / 100.0)
+    block = mixer.mix(512)[:, 0]
+    steps = np.diff(np.concatenate([[first[-1, 0]], block]))
+    # 从1.0平滑降到0.0，没有台阶
+    assert np.all(steps <= 0) and np.abs(steps).max() < 0.01
+    assert abs(block[-1]) < 1e-6
+    # 增益不再变化时保持不变
+    mixer.take_levels()
+    assert np.allclose(mixer.mix(512), 0.0)
+
+    # 电平表按实际混进去的信号计算：增益为0时没有电平
+    assert mixer.take_levels()[0] == (0.0, 0.0)
+    mixer.set_gain(0, 0.5)
+    mixer.set_stem(1, np.full((4096, 2), -8192, dtype=np.int16))
+    mixer.seek(0)
+    mixer.mix(1024)
+    (rms, peak), (vocal_rms, vocal_peak) = mixer.take_levels()
+    assert abs(rms - 0.25) < 1e-6 and abs(peak - 0.25) < 1e-6
+    assert abs(vocal_rms - 0.25) < 1e-6 and abs(vocal_peak - 0.25) < 1e-6
+    assert mixer.take_levels() == [(0.0, 0.0), (0.0, 0.0)]
+
+    # 等功率曲线：两边功率之和不变
+    for value in (0, 25, 50, 75, 100):
+        accompaniment, vocals = balance_gains(value, PAN_EQUAL_POWER)
+        assert abs(accompaniment ** 2 + vocals ** 2 - 1.0) < 1e-9
+    assert balance_volumes(50, PAN_EQUAL_POWER) == (71, 71)
+    assert balance_volumes(50) == (100, 100)
+    print("✓ 增益过渡正常")
+
+
+def test_mixer_gapless():
+    """测试无缝切歌：下一首紧接着上一首的最后一帧，变调时也没有空白"""
+    print("测试无缝切歌...")
+    first = np.repeat(np.arange(3000, dtype=np.int16)[:, None], 2, axis=1)
+    second = np.repeat(np.arange(10000, 12000, dtype=np.int16)[:, None], 2, axis=1)
+    mixer = StemMixer()
+    mixer.set_stem(0, first)
+    mixer.queue_next([second, None])
+    assert not mixer.at_end()
+
+    out = np.concatenate([mixer.read_block(700) for _ in range(8)])
+    values = np.round(out[:, 0] * 32768.0).astype(int)
+    assert np.array_equal(values[:5000], np.concatenate([np.arange(3000), np.arange(10000, 12000)]))
+    assert len(values) == 5000
+    assert mixer.track_changes == 1 and mixer.at_end()
+
+    # 变调器预读会越过上一首的结尾，接上的应是下一首的开头而不是静音
+    mixer = StemMixer()
+    mixer.set_stem(0, (sine(1.0) * 32767).astype(np.int16))
+    mixer.set_pitch(0, 2)
+    mixer.seek(0, measure=False)
+    mixer.queue_next([(sine(1.0, freq=660.0) * 32767).astype(np.int16), None])
+    out = np.concatenate([mixer.read_block(1024) for _ in range(86)])
+    envelope = np.abs(out[SAMPLE_RATE // 2:, 0])
+    envelope = envelope[:len(envelope) // 441 * 441].reshape(-1, 441).max(axis=1)
+    assert envelope.min() > 0.3
+    print("✓ 无缝切歌正常")
+
+
+def dominant_freq(samples, sample_rate=SAMPLE_RATE):
+    spectrum = np.abs(np.fft.rfft(samples * np.hanning(len(samples))))
+    return np.fft.rfftfreq(len(samples), 1.0 / sample_rate)[np.argmax(spectrum)]
+
+
+def test_time_stretch():
+    """测试变速不变调"""
+    print("测试变速...")
+    source = sine(6.0, freq=440.0)
+    pos = [0]
+
+    def pull(n):
+        block = source[pos[0]:pos[0] + n]
+        pos[0] += len(block)
+        return block
+
+    stretcher = TimeStretcher()
+    stretcher.set_tempo(0.8)
+    out = np.concatenate([stretcher.process(pull, 1024) for _ in range(200)])
+
+    # 放慢后消耗的输入约为输出的0.8倍，音高不变
+    assert abs(stretcher.clock - len(out) * 0.8) < 1
+    assert pos[0] - stretcher.clock <= stretcher.latency()
+    assert abs(dominant_freq(out[SAMPLE_RATE:SAMPLE_RATE * 2, 0]) - 440.0) < 2.0
+    print("✓ 变速正常")
+
+
+def test_pitch_shift():
+    """测试变调：输入输出等长，中途改半音数不断音"""
+    print("测试变调...")
+    source = sine(4.0, freq=440.0)
+    shifter = PitchShifter()
+    shifter.set_semitones(3)
+
+    blocks = []
+    for i, start in enumerate(range(0, len(source), 700)):
+        if i == 150:
+            shifter.set_semitones(-2)
+        block = source[start:start + 700]
+        out = shifter.process(block)
+        assert len(out) == len(block)
+        blocks.append(out)
+    out = np.concatenate(blocks)
+
+    assert abs(dominant_freq(out[SAMPLE_RATE // 2:SAMPLE_RATE * 2, 0]) - 440.0 * 2 ** (3 / 12)) < 3.0
+    assert abs(dominant_freq(out[SAMPLE_RATE * 3:, 0]) - 440.0 * 2 ** (-2 / 12)) < 3.0
+    # 切换前后都不应出现静音段
+    settled = np.abs(out[shifter.latency() + SAMPLE_RATE // 10:, 0])
+    envelope = settled[:len(settled) // 441 * 441].reshape(-1, 441).max(axis=1)
+    assert envelope.min() > 0.3
+    print("✓ 变调正常")
+
+
+def test_mixer_tempo_position():
+    """测试变速时混音器把输出位置换算回音轨位置"""
+    print("测试变速位置换算...")
+    mixer = StemMixer()
+    mixer.set_stem(0, (sine(5.0) * 32767).astype(np.int16))
+    mixer.seek(SAMPLE_RATE, measure=False)
+    mixer.set_tempo(0.75)
+    for _ in range(100):
+        mixer.read_block(1024)
+
+    heard = mixer.heard_position(4096)
+    expected = SAMPLE_RATE + (100 * 1024 - 4096) * 0.75
+    assert abs(heard - expected) < 2
+    print("✓ 变速位置换算正常")
+
+
+def test_pcm_cache():
+    """测试解码缓存的命中、映射和淘汰"""
+    print("测试解码缓存...")
+    with tempfile.TemporaryDirectory() as tmp:
+        # 44.1kHz 16位立体声WAV直接映射，不写缓存
+        direct = os.path.join(tmp, "direct.wav")
+        write_test_wav(direct, sine(0.5))
+        mapped = map_wav(direct)
+        assert isinstance(mapped, np.memmap)
+        assert np.array_equal(mapped, read_wav(direct))
+
+        # 其他格式解码一次后从缓存映射
+        converted = os.path.join(tmp, "mono.wav")
+        write_test_wav(converted, sine(0.5, channels=1))
+        assert map_wav(converted) is None
+        cache = PcmCache(os.path.join(tmp, "cache"), budget_mb=1)
+        first = cache.load(converted)
+        second = PcmCache(os.path.join(tmp, "cache"), budget_mb=1).get(converted)
+        assert isinstance(second, np.memmap)
+        assert np.array_equal(first, second)
+
+        # 命中只更新内存里的使用时间，flush()时才写索引
+        key = cache.key_for(converted)
+        used = cache.entries[key]['last_used']
+        os.utime(cache.index_path, ns=(0, 0))
+        assert cache.get(converted) is not None and cache.entries[key]['last_used'] >= used
+        assert os.stat(cache.index_path).st_mtime_ns == 0
+        cache.flush()
+        assert os.stat(cache.index_path).st_mtime_ns != 0
+
+        # 超出容量时淘汰最久没用的条目
+        for i in range(3):
+            path = os.path.join(tmp, f"long{i}.wav")
+            write_test_wav(path, sine(3.0, channels=1))
+            cache.put(path, read_wav(path))
+        assert sum(e['bytes'] for e in cache.entries.values()) <= cache.budget_bytes
+        assert cache.get(converted) is None
+    print("✓ 解码缓存正常")
+
+
+def test_prerender():
+    """测试预渲染：写入缓存后能按版本取回，时长和音高符合设置"""
+    print("测试预渲染...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stem.wav")
+        write_test_wav(path, sine(2.0, freq=440.0))
+        cache = PcmCache(os.path.join(tmp, "cache"))
+        source = source_descriptor(cache.load(path))
+        assert source is not None
+        assert variant_key(0, 1.0) == ""
+
+        variant = variant_key(12, 0.8)
+        frames = render_stem(0, source, cache.reserve(path, variant), 12, 0.8)
+        cache.register(path, frames, variant)
+        rendered = PcmCache(os.path.join(tmp, "cache")).get(path, variant)
+        assert rendered is not None and len(rendered) == frames
+        assert frames == round(2.0 * SAMPLE_RATE / 0.8)
+        middle = rendered[SAMPLE_RATE // 2:SAMPLE_RATE * 2, 0] / 32768.0
+        assert abs(dominant_freq(middle) - 880.0) < 5.0
+        assert cache.get(path, variant_key(12, 1.0)) is None
+
+        # 调速度、变调时按打开音轨时记下的文件信息查缓存，不再访问源文件
+        core = PlayerCore(output=NullAudioOutput(), config_file=os.path.join(tmp, "config.json"))
+        core.engine.cache = cache
+        core.load(0, path)
+        stat_calls = []
+        real_stat = os.stat
+
+        def counting_stat(target, *args, **kwargs):
+            if os.fspath(target) == path:
+                stat_calls.append(target)
+            return real_stat(target, *args, **kwargs)
+
+        os.stat = counting_stat
+        try:
+            core.engine.set_pitch(0, 12)
+            core.engine.set_tempo(0.8)
+        finally:
+            os.stat = real_stat
+        assert core.engine.rendered and not stat_calls, stat_calls
+        core.close()
+    print("✓ 预渲染正常")
+
+
+def test_library():
+    """测试曲库：按后缀配对，重新扫描只处理变化的文件"""
+    print("测试曲库...")
+    assert split_stem_name("李健 - 十点半的地铁_other.wav") == ("李健 - 十点半的地铁", 0)
+    assert split_stem_name("song_no_vocals.flac") == ("song", 0)
+    assert split_stem_name("song_Vocals.mp3") == ("song", 1)
+    assert split_stem_name("song.wav") == (None, None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, "stems", "album")
+        os.makedirs(folder)
+        for title in ("a", "b"):
+            write_test_wav(os.path.join(folder, f"{title}_other.wav"), sine(0.2))
+            write_test_wav(os.path.join(folder, f"{title}_vocals.wav"), sine(0.2))
+        write_test_wav(os.path.join(folder, "c_vocals.wav"), sine(0.1))
+        db_path = os.path.join(tmp, "library.db")
+        library = Library(db_path)
+        library.add_root(os.path.join(tmp, "stems"))
+
+        assert scan_library(db_path, library.roots()) == (5, 5, 0)
+        songs = {song['title']: song for song in library.songs()}
+        assert sorted(songs) == ["a", "b", "c"]
+        assert songs["a"]['files'] == [os.path.join(folder, "a_other.wav"),
+                                       os.path.join(folder, "a_vocals.wav")]
+        assert songs["a"]['duration_ms'] == 200
+        assert songs["c"]['files'][0] is None
+        # 搜索关键字里的 _ 和 % 按字面匹配
+        assert library.songs("_") == [] and library.songs("%") == []
+
+        # 没变化时不重新读取，修改或删除的文件才更新
+        assert scan_library(db_path, library.roots()) == (5, 0, 0)
+        write_test_wav(os.path.join(folder, "b_vocals.wav"), sine(0.3))
+        os.remove(os.path.join(folder, "c_vocals.wav"))
+        assert scan_library(db_path, library.roots()) == (4, 1, 1)
+        assert [song['title'] for song in library.songs("b")] == ["b"]
+        assert library.songs("b")[0]['duration_ms'] == 300
+
+        pyramid = build_peaks(read_wav(os.path.join(folder, "a_other.wav")))
+        library.record_stem(os.path.join(folder, "a_other.wav"), pyramid)
+        mins, maxs = library.peaks(os.path.join(folder, "a_other.wav"))
+        assert len(mins) == len(maxs) > 0 and maxs.max() > 0.4
+
+        # 扫描目录暂时读不了（移动硬盘没接上）时保留原有记录和波形
+        import shutil
+        shutil.move(os.path.join(tmp, "stems"), os.path.join(tmp, "unplugged"))
+        assert scan_library(db_path, library.roots()) == (0, 0, 0)
+        assert len(library.songs()) == 2
+        assert library.peaks(os.path.join(folder, "a_other.wav")) is not None
+        library.close()
+    print("✓ 曲库正常")
+
+
+def test_headless_core():
+    """测试无界面核心：命令行混音、查询时长，以及在静音输出上完整播放一遍"""
+    print("测试无界面核心...")
+    from PyQt5.QtCore import QCoreApplication, QTimer
+    app = QCoreApplication.instance() or QCoreApplication([])
+    assert balance_volumes(0) == (100, 0) and balance_volumes(100) == (0, 100)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        accompaniment = os.path.join(tmp, "song_other.wav")
+        vocals = os.path.join(tmp, "song_vocals.wav")
+        write_test_wav(accompaniment, sine(1.0, freq=440.0))
+        write_test_wav(vocals, sine(0.5, freq=660.0))
+
+        # 平衡拉到伴奏一侧时，混音结果就是伴奏本身
+        mixed = os.path.join(tmp, "mix.wav")
+        assert cli.main(["mix", accompaniment, vocals, "-o", mixed, "-q", "--balance", "0"]) == 0
+        difference = read_wav(mixed).astype(int) - read_wav(accompaniment)
+        assert np.abs(difference).max() <= 1
+        assert cli.main(["probe", accompaniment, vocals]) == 0
+
+        output = NullAudioOutput(realtime=False)
+        core = PlayerCore(output=output, config_file=os.path.join(tmp, "config.json"))
+        core.load(0, accompaniment)
+        core.load(1, vocals)
+        assert core.engine.duration() == 1000
+        positions = []
+        core.engine.positionChanged.connect(positions.append)
+        core.engine.finished.connect(app.quit)
+        QTimer.singleShot(10000, app.quit)
+        core.engine.play()
+        app.exec_()
+        assert output.frames_played == SAMPLE_RATE
+        assert core.engine.state() == 0
+        assert positions and positions == sorted(positions)
+
+        # 后台恢复两个音轨，完成前事件循环不被阻塞
+        restored = PlayerCore(output=NullAudioOutput(), config_file=core.config_file)
+        restored.engine.pairLoaded.connect(app.quit)
+        QTimer.singleShot(10000, app.quit)
+        restored.engine.load_pair_async([accompaniment, vocals])
+        assert restored.engine.duration() == 0
+        app.exec_()
+        assert restored.files == [accompaniment, vocals]
+        assert restored.engine.duration() == 1000
+        restored.close()
+
+        core.set_balance(30)
+        core.write_config()
+        core.close()
+        reopened = PlayerCore(output=NullAudioOutput(), config_file=core.config_file)
+        assert reopened.read_config()['volume_balance'] == 30
+        reopened.close()
+
+        # 没有指定输出设备时，到第一次播放才打开声卡
+        deferred = PlayerCore(config_file=core.config_file)
+        assert deferred.engine._output is None
+        deferred.close()
+        assert deferred.engine._output is None
+
+    # 整个过程不需要界面控件，也不需要声卡
+    assert 'PyQt5.QtWidgets' not in sys.modules
+    assert 'PyQt5.QtMultimedia' not in sys.modules
+    print("✓ 无界面核心正常")
+
+
+def test_background_loading():
+    """测试后台打开音轨：不存在的文件当作未选择，只换一个音轨时另一个不重新打开"""
+    print("\n测试后台加载...")
+    from PyQt5.QtCore import QCoreApplication, QTimer
+    from player_core import config_files
+    app = QCoreApplication.instance() or QCoreApplication([])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        accompaniment = os.path.join(tmp, "song_other.wav")
+        vocals = os.path.join(tmp, "song_vocals.wav")
+        missing = os.path.join(tmp, "missing", "song_vocals.wav")
+        write_test_wav(accompaniment, sine(1.0, freq=440.0))
+        write_test_wav(vocals, sine(0.5, freq=660.0))
+
+        # 界面线程不检查文件是否存在
+        config = {'player1_file': accompaniment, 'player2_file': missing}
+        assert config_files(config) == [accompaniment, ""]
+        assert config_files(config, check_exists=False) == [accompaniment, missing]
+
+        core = PlayerCore(output=NullAudioOutput(), config_file=os.path.join(tmp, "config.json"))
+        engine = core.engine
+
+        def load(files):
+            engine.pairLoaded.connect(app.quit)
+            QTimer.singleShot(10000, app.quit)
+            engine.load_pair_async(files)
+            assert engine.loading()
+            app.exec_()
+            engine.pairLoaded.disconnect(app.quit)
+            assert not engine.loading()
+
+        load([accompaniment, missing])
+        assert engine.files == [accompaniment, ""]
+        assert engine.mode == MODE_MIX and engine.duration() == 1000
+        first = engine.sources[0]
+
+        # 内容指纹在加载线程里算，界面线程恢复歌曲设置时不读文件
+        import threading
+        import audio_engine
+        readers = []
+
+        def fingerprint_in_thread(path):
+            readers.append(threading.get_ident())
+            return file_fingerprint(path)
+
+        audio_engine.file_fingerprint = fingerprint_in_thread
+        try:
+            load([accompaniment, vocals])
+        finally:
+            audio_engine.file_fingerprint = file_fingerprint
+        assert readers and threading.get_ident() not in readers
+        assert engine.files == [accompaniment, vocals]
+        assert engine.sources[0] is first, "没换的音轨不应该重新打开"
+        assert engine.fingerprint(1) == file_fingerprint(vocals)
+        assert engine.peaks_path(1) == engine.cache.peaks_path(vocals)
+        assert core.song_key == f"{file_fingerprint(accompaniment)}|{file_fingerprint(vocals)}"
+
+        # 等待期间又换了音轨，只有最后一次生效
+        engine.load_pair_async([vocals, ""])
+        load(["", accompaniment])
+        assert engine.files == ["", accompaniment]
+        core.close()
+    print("✓ 后台加载正常")
+
+
+def test_loop_while_playing():
+    """测试播放中用当前位置设B点：混音器已经读到B点之后，循环照样生效"""
+    print("\n测试播放中设置循环...")
+    from PyQt5.QtCore import QCoreApplication
+    app = QCoreApplication.instance() or QCoreApplication([])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "song_other.wav")
+        write_test_wav(path, sine(10.0))
+        output = NullAudioOutput(realtime=False)
+        core = PlayerCore(output=output, config_file=os.path.join(tmp, "config.json"))
+        engine = core.engine
+        core.load(0, path)
+        # 变速时变速器要预读，混音位置领先听到的位置
+        engine.set_tempo(0.8)
+        engine.play()
+        while engine.position() < 2000:
+            app.processEvents()
+        b = engine.position_frames()
+        engine.set_loop(b - SAMPLE_RATE, b)
+        assert engine.loop() is not None
+
+        for _ in range(10000):
+            app.processEvents()
+            if engine.mixer.loop_count >= 2:
+                break
+        assert engine.mixer.loop_count >= 2, engine.mixer.loop_count
+        a, b = engine.loop()
+        assert a <= engine.position_frames() < b + SAMPLE_RATE // 10, engine.position_frames()
+        engine.stop()
+        core.close()
+    print("✓ 播放中设置循环正常")
+
+
+def test_threaded_output():
+    """测试音频线程：界面线程卡住时声卡照样取到数据"""
+    print("\n测试音频线程...")
+    import time
+    from PyQt5.QtCore import QCoreApplication
+    app = QCoreApplication.instance() or QCoreApplication([])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "song_other.wav")
+        write_test_wav(path, sine(3.0))
+        output = ThreadedOutput(lambda parent: NullAudioOutput(parent, period_ms=10))
+        device = output.output
+        core = PlayerCore(output=output, config_file=os.path.join(tmp, "config.json"))
+        engine = core.engine
+        core.load(0, path)
+        engine.play()
+        assert output.state() != STOPPED_STATE
+        started = time.perf_counter()
+        while device.frames_played == 0 and time.perf_counter() - started < 2:
+            app.processEvents()
+
+        # 界面线程卡住300ms，期间音频线程继续取数据
+        played = device.frames_played
+        time.sleep(0.3)
+        assert device.frames_played - played >= SAMPLE_RATE // 10, device.frames_played - played
+
+        # 控制命令排队发到音频线程，位置通知回到界面线程
+        engine.pause()
+        app.processEvents()
+        assert engine.state() == PAUSED and output.state() == SUSPENDED_STATE
+        engine.seek_frame(SAMPLE_RATE)
+        assert engine.position_frames() == SAMPLE_RATE
+        core.close()
+        assert output.state() == STOPPED_STATE and output.output is None
+    print("✓ 音频线程正常")
+
+
+def test_seek_coalescing():
+    """测试跳转合并：声卡还没取走数据之前的连续跳转只重启一次输出"""
+    print("\n测试跳转合并...")
+    from PyQt5.QtCore import QCoreApplication
+    app = QCoreApplication.instance() or QCoreApplication([])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "song_other.wav")
+        write_test_wav(path, sine(10.0))
+        output = NullAudioOutput(realtime=False)
+        core = PlayerCore(output=output, config_file=os.path.join(tmp, "config.json"))
+        engine = core.engine
+        core.load(0, path)
+        engine.play()
+        app.processEvents()
+
+        # 点击进度条再松开、快速拖动：三次请求只有第一次真正重启输出
+        requests, seeks = engine.seek_requests, engine.backend_seeks
+        for ratio in (0.2, 0.5, 0.7):
+            engine.seek_ratio(ratio)
+        assert engine.seek_requests - requests == 3
+        assert engine.backend_seeks - seeks == 1, engine.backend_seeks - seeks
+        assert engine.position() == 7000, engine.position()
+        played = output.frames_played
+        while output.frames_played == played:
+            app.processEvents()
+        assert engine.position() > 7000 and not engine.mixer.seek_pending
+
+        # 新数据被取走之后再跳转，要重新丢掉输出缓冲
+        engine.seek_ratio(0.1)
+        assert engine.backend_seeks - seeks == 2
+        engine.stop()
+        core.close()
+    print("✓ 跳转合并正常")
+
+
+def test_settings_store():
+    """测试设置保存：合并连续修改、后台原子写入、按歌曲读取"""
+    print("测试设置保存...")
+    from PyQt5.QtCore import QCoreApplication, QTimer
+    app = QCoreApplication.instance() or QCoreApplication([])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_file = os.path.join(tmp, "config.json")
+        store = SettingsStore(config_file, delay_ms=50)
+        for value in range(10):
+            store.set_config({'volume_balance': value})
+        store.set_song("song-a", {'balance': 20})
+        store.set_song("song-b", {'balance': 80})
+        store.set_song("song-a", {'balance': 30})
+        # 连续修改期间不写盘
+        assert not os.path.exists(config_file) and store.pending()
+        assert store.song("song-a") == {'balance': 30}
+
+        QTimer.singleShot(200, app.quit)
+        app.exec_()
+        assert not store.pending()
+        store.flush()
+        assert load_config_file(config_file) == {'volume_balance': 9}
+        assert not os.path.exists(config_file + ".tmp")
+
+        store.set_config({'volume_balance': 40})
+        store.close()
+        assert load_config_file(config_file) == {'volume_balance': 40}
+
+        reopened = SettingsStore(config_file)
+        assert reopened.song("song-a") == {'balance': 30}
+        assert reopened.song("song-b") == {'balance': 80}
+        assert reopened.song("missing") == {}
+        reopened.close()
+    print("✓ 设置保存正常")
+
+
+def test_song_settings():
+    """测试每首歌的设置：按内容指纹记录，文件改名或移动后还能找回"""
+    print("测试歌曲设置...")
+    import shutil
+    from PyQt5.QtCore import QCoreApplication
+    app = QCoreApplication.instance() or QCoreApplication([])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        accompaniment = os.path.join(tmp, "song_other.wav")
+        vocals = os.path.join(tmp, "song_vocals.wav")
+        write_test_wav(accompaniment, sine(3.0, freq=440.0))
+        write_test_wav(vocals, sine(3.0, freq=660.0))
+        config_file = os.path.join(tmp, "config.json")
+
+        core = PlayerCore(output=NullAudioOutput(), config_file=config_file)
+        core.load(0, accompaniment)
+        core.load(1, vocals)
+        core.set_balance(20)
+        core.engine.set_tempo(0.8)
+        core.engine.set_pitch(1, -2)
+        core.engine.set_loop(SAMPLE_RATE, 2 * SAMPLE_RATE)
+        core.remember_song()
+        # 换一首没有记录的歌：速度、变调、循环回到默认，平衡沿用当前值
+        other = os.path.join(tmp, "other.wav")
+        write_test_wav(other, sine(2.0, freq=330.0))
+        core.load(0, other)
+        core.load(1, "")
+        assert core.engine.tempo() == 1.0 and core.engine.pitch(1) == 0
+        assert core.engine.loop() is None and core.volume_balance == 20
+        core.close()
+
+        # 改名、换目录之后照样找回设置
+        moved = os.path.join(tmp, "moved")
+        os.makedirs(moved)
+        renamed = [os.path.join(moved, "a.wav"), os.path.join(moved, "b.wav")]
+        shutil.move(accompaniment, renamed[0])
+        shutil.move(vocals, renamed[1])
+        core = PlayerCore(output=NullAudioOutput(), config_file=config_file)
+        core.set_balance(50)
+        core.load(0, renamed[0])
+        core.load(1, renamed[1])
+        assert core.volume_balance == 20
+        assert core.engine.tempo() == 0.8
+        assert (core.engine.pitch(0), core.engine.pitch(1)) == (0, -2)
+        assert core.engine.loop() == (SAMPLE_RATE, 2 * SAMPLE_RATE)
+        core.close()
+
+        # 命令行播放不套用记下的设置，循环不会让播放停不下来
+        core = PlayerCore(output=NullAudioOutput(), config_file=config_file)
+        core.load(0, renamed[0], restore=False)
+        core.load(1, renamed[1], restore=False)
+        assert core.engine.loop() is None and core.engine.tempo() == 1.0
+        assert core.song_key is None
+        core.close()
+
+        # 指纹包含文件末尾的采样块，尾部不同的两个版本能区分开
+        data = bytearray(open(renamed[0], 'rb').read())
+        fingerprint = file_fingerprint(renamed[0])
+        data[-1] ^= 0xFF
+        with open(renamed[0], 'wb') as f:
+            f.write(data)
+        assert file_fingerprint(renamed[0]) != fingerprint
+    print("✓ 歌曲设置正常")
+
+
+def test_loudness():
+    """测试响度分析：EBU Tech 3341 的1kHz正弦参考电平、门限、缓存和归一化"""
+    print("测试响度分析...")
+    import time
+    from PyQt5.QtCore import QCoreApplication, QTimer
+    app = QCoreApplication.instance() or QCoreApplication([])
+
+    # -23 dBFS 的1kHz立体声正弦应读作 -23 LUFS
+    reference = (sine(20.0, freq=1000.0, amplitude=10 ** (-23 / 20)) * 32767).astype(np.int16)
+    lufs, peak = integrated_loudness(reference)
+    assert abs(lufs + 23.0) < 0.1 and abs(peak - 10 ** (-23 / 20)) < 0.001
+    # 静音全部被门限挡掉
+    assert integrated_loudness(np.zeros((SAMPLE_RATE * 2, 2), np.int16))[0] is None
+    # 中间插一段静音不影响积分响度
+    gap = np.concatenate([reference, np.zeros((SAMPLE_RATE * 20, 2), np.int16)])
+    assert abs(integrated_loudness(gap)[0] - lufs) < 0.1
+
+    # 一分钟的音轨分析时间远小于实际时长
+    started = time.perf_counter()
+    integrated_loudness(np.tile(reference, (3, 1)))
+    assert time.perf_counter() - started < 3.0
+
+    # 提升不超过峰值余量，衰减不受限制
+    assert abs(normalization_gain(-12.0) - 10 ** ((TARGET_LUFS + 12.0) / 20)) < 1e-9
+    assert normalization_gain(-30.0, peak=0.9) == 1.0 / 0.9
+    assert normalization_gain(None) == 1.0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        loud = os.path.join(tmp, "loud_other.wav")
+        quiet = os.path.join(tmp, "loud_vocals.wav")
+        write_test_wav(loud, sine(3.0, amplitude=0.5))
+        write_test_wav(quiet, sine(3.0, freq=660.0, amplitude=0.05))
+        config_file = os.path.join(tmp, "config.json")
+
+        core = PlayerCore(output=NullAudioOutput(), config_file=config_file)
+        core.set_normalize(True)
+        core.loudnessChanged.connect(lambda: core.analyzing() or app.quit())
+        QTimer.singleShot(10000, app.quit)
+        core.load(0, loud)
+        core.load(1, quiet)
+        app.exec_()
+        assert not core.analyzing()
+        # 响的音轨衰减，轻的音轨在峰值余量以内提升
+        accompaniment, vocals = core.engine.mixer.gains
+        assert accompaniment < 1.0 < vocals
+        core.close()
+
+        # 结果按内容缓存，再次打开不再分析
+        core = PlayerCore(output=NullAudioOutput(), config_file=config_file)
+        core.load(0, loud)
+        assert not core.analyzing() and core.loudness[0]['lufs'] is not None
+
+        # 没打开归一化时新音轨不分析，打开时才开始
+        other = os.path.join(tmp, "other_vocals.wav")
+        write_test_wav(other, sine(1.0, freq=550.0))
+        core.load(1, other, restore=False)
+        assert not core.analyzing() and core.loudness[1] is None
+        core.set_normalize(True)
+        assert core.analyzing()
+        core.close()
+    print("✓ 响度分析正常")
+
+
+def test_export():
+    """测试导出：平衡曲线和界面一致，批量导出多进程并行"""
+    print("测试导出...")
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, "stems")
+        os.makedirs(folder)
+        for title, freq in (("a", 440.0), ("b", 550.0)):
+            write_test_wav(os.path.join(folder, f"{title}_other.wav"), sine(0.5, freq=freq))
+            write_test_wav(os.path.join(folder, f"{title}_vocals.wav"), sine(0.5, freq=freq * 2))
+        out = os.path.join(tmp, "out")
+        assert cli.main(["batch", folder, "-o", out, "-j", "2", "--balance", "100", "-q"]) == 0
+        for title in ("a", "b"):
+            mixed = read_wav(os.path.join(out, f"{title}_mix100.wav")).astype(int)
+            vocals = read_wav(os.path.join(folder, f"{title}_vocals.wav"))
+            assert np.abs(mixed - vocals).max() <= 1
+
+        # 慢速导出的长度按速度换算
+        files = [os.path.join(folder, "a_other.wav"), os.path.join(folder, "a_vocals.wav")]
+        frames = mixdown(files, os.path.join(tmp, "slow.wav"), balance=15, tempo=0.8,
+                         cache=PcmCache(os.path.join(tmp, "cache")))
+        assert frames == len(read_wav(os.path.join(tmp, "slow.wav"))) == round(0.5 * SAMPLE_RATE / 0.8)
+
+        results = batch_mixdown([(files, os.path.join(tmp, "x.ogg"))], max_workers=1,
+                                cache=PcmCache(os.path.join(tmp, "cache")))
+        assert isinstance(results[os.path.join(tmp, "x.ogg")], str)
+        assert not os.path.exists(os.path.join(tmp, "x.ogg"))
+        # 其他类型的错误也只算这一首失败，不影响别的歌
+        good, bad = os.path.join(tmp, "good.wav"), os.path.join(tmp, "bad\0.wav")
+        results = batch_mixdown([(files, good), (files, bad)], max_workers=1,
+                                cache=PcmCache(os.path.join(tmp, "cache")))
+        assert isinstance(results[bad], str) and results[good] == round(0.5 * SAMPLE_RATE)
+
+        # 界面导出遇到任何错误都要通知完成，并且不留下半个文件
+        from export import MixdownThread
+        broken = os.path.join(tmp, "broken.wav")
+        worker = MixdownThread([read_wav(files[0]), "不是音轨"], broken, 50, 1.0, (0, 0))
+        reports = []
+        worker.done.connect(lambda path, error: reports.append((path, error)))
+        worker.run()
+        assert len(reports) == 1 and reports[0][0] == broken and reports[0][1]
+        assert not os.path.exists(broken) and not os.path.exists(broken + ".part")
+
+        # 关闭窗口时取消导出，写了一半的文件删掉
+        cancelled = os.path.join(tmp, "cancelled.wav")
+        worker = MixdownThread([read_wav(files[0]), None], cancelled, 50, 1.0, (0, 0))
+        reports = []
+        worker.done.connect(lambda path, error: reports.append(error))
+        worker.cancel()
+        worker.run()
+        assert reports and reports[0]
+        assert not os.path.exists(cancelled) and not os.path.exists(cancelled + ".part")
+        try:
+            import soundfile  # noqa: F401
+        except ImportError:
+            try:
+                mixdown(files, os.path.join(tmp, "a.flac"))
+                assert False, "没有soundfile时导出FLAC应当报错"
+            except ExportError:
+                pass
+    print("✓ 导出正常")
+
+
+def test_peak_pyramid():
+    """测试峰值金字塔和按像素取列"""
+    print("测试波形峰值...")
+    rng = np.random.default_rng(0)
+    width = 300
+    samples = rng.integers(-20000, 20000, size=(width * 4096, 2)).astype(np.int16)
+    pyramid = build_peaks(samples)
+    assert len(pyramid.levels) > 2
+
+    # 每列正好4096帧，和直接在原始数据上算的结果一致
+    mins, maxs = pyramid.columns(width)
+    columns = samples.reshape(width, -1)
+    assert np.allclose(mins, columns.min(axis=1) / 32768.0)
+    assert np.allclose(maxs, columns.max(axis=1) / 32768.0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "peaks.npz")
+        saved = load_or_build_peaks(samples, path)
+        loaded = load_or_build_peaks(samples, path)
+        assert loaded.total_frames == saved.total_frames
+        assert np.array_equal(loaded.levels[-1][1], saved.levels[-1][1])
+    print("✓ 波形峰值正常")
+
+
+def test_stall_watchdog():
+    """测试界面线程卡顿监测：记下卡顿时长和正在执行的槽函数"""
+    print("\n测试卡顿监测...")
+    import time
+    from PyQt5.QtCore import QCoreApplication
+    from stall_monitor import StallWatchdog, HandlerTimings, timed, HANDLER_TIMINGS
+    app = QCoreApplication.instance() or QCoreApplication([])
+
+    def spin(seconds):
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            app.processEvents()
+            time.sleep(0.005)
+
+    @timed
+    def slow_handler(seconds):
+        time.sleep(seconds)
+        return seconds
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, "stall_log.csv")
+        watchdog = StallWatchdog(threshold_ms=80, log_file=log_file)
+        stalls = []
+        watchdog.stalled.connect(stalls.append)
+        watchdog.start()
+        spin(0.2)
+        assert not stalls, f"空闲时不应该有卡顿: {stalls}"
+
+        # 槽函数把界面线程卡住300ms
+        assert slow_handler(0.3) == 0.3
+        spin(0.2)
+
+        # 暂停且窗口不在前台时心跳停掉，不定时唤醒，也不会误报卡顿
+        watchdog.set_active(False)
+        assert not watchdog._heartbeat.isActive()
+        time.sleep(0.3)
+        spin(0.1)
+        watchdog.set_active(True)
+        assert watchdog._heartbeat.isActive()
+        spin(0.2)
+        watchdog.stop()
+        assert len(stalls) == 1, stalls
+        assert stalls[0]['handler'].endswith("slow_handler"), stalls[0]['handler']
+        assert 250 <= stalls[0]['duration_ms'] < 1000, stalls[0]['duration_ms']
+        assert "time.sleep(seconds)" in stalls[0]["stack"]
+        with open(log_file, encoding='utf-8') as f:
+            assert "slow_handler" in f.read()
+
+    # 每个槽函数的调用次数和用时
+    report = HANDLER_TIMINGS.report()
+    name = next(name for name in report if name.endswith("slow_handler"))
+    assert report[name]['count'] == 1 and report[name]['max_ms'] >= 300
+    timings = HandlerTimings()
+    timings.record("a", 2.0)
+    timings.record("a", 4.0)
+    assert timings.report() == {"a": {'count': 2, 'mean_ms': 3.0, 'max_ms': 4.0}}
+    assert timings.take_slowest() == ("a", 4.0) and timings.take_slowest() is None
+    print("✓ 卡顿监测正常")
+
+
+def test_benchmark():
+    """测试性能基准测试脚本"""
+    print("\n测试性能基准...")
+    import benchmark
+
+    results = benchmark.run_benchmarks(lengths=(2,), formats=('wav48k16',),
+                                       drift_minutes=0.1, progress=lambda message: None)
+    scenario = results['wav48k16_2s']
+    assert scenario['first_audio_cold_ms'] > 0, "没有测到首次出声时间"
+    assert scenario['seek_max_ms'] >= scenario['seek_median_ms']
+    # 同一个时钟驱动两个音轨，不应该有偏差
+    assert results['drift']['drift_ms'] is not None and results['drift']['drift_ms'] < 1.0, \
+        f"原速播放两个音轨偏差 {results['drift']['drift_ms']}ms"
+    assert results['drift_tempo080_pitch']['cpu_ms_per_audio_s'] > 0
+    assert results['process']['peak_rss_mb'] > 0
+
+    # 和基线对比：只有超出容差的指标才算退化
+    baseline = {'drift': {'cpu_ms_per_audio_s': 1.0, 'drift_ms': None}}
+    current = {'drift': {'cpu_ms_per_audio_s': 3.0, 'drift_ms': 0.0}}
+    assert benchmark.compare(current, baseline) == []
+    current['drift']['cpu_ms_per_audio_s'] = 10.0
+    assert benchmark.compare(current, baseline) == [('drift', 'cpu_ms_per_audio_s', 1.0, 10.0)]
+    print("✓ 性能基准正常")
+
+
+def test_drift_monitor():
+    """测试漂移阈值判断"""
+    print("测试漂移监测...")
+    monitor = DriftMonitor(threshold_ms=40, cooldown_seconds=1.0, log_file=None)
+
+    assert monitor.sample(1000, 1010, now=0.0)[0] == ACTION_NONE
+    assert monitor.sample(1000, 1060, now=5.0)[0] == ACTION_RATE
+    # 微调期间偏差没回到阈值一半以内，继续微调
+    assert monitor.sample(1000, 1030, now=5.1)[0] == ACTION_RATE
+    assert monitor.sample(1000, 1010, now=5.2)[0] == ACTION_NONE
+    # 偏差太大直接跳转
+    assert monitor.sample(1000, 1200, now=9.0)[0] == ACTION_SEEK
+
+    metrics = monitor.metrics()
+    assert metrics['max_ms'] == 200
+    assert metrics['rate_corrections'] == 1
+    assert metrics['seek_corrections'] == 1
+
+    # 混音模式两个音轨共用一个时钟，不记录恒为0的采样
+    from PyQt5.QtCore import QCoreApplication
+    app = QCoreApplication.instance() or QCoreApplication([])
+    with tempfile.TemporaryDirectory() as tmp:
+        files = [os.path.join(tmp, "song_other.wav"), os.path.join(tmp, "song_vocals.wav")]
+        for path in files:
+            write_test_wav(path, sine(1.0))
+        core = PlayerCore(output=NullAudioOutput(realtime=False),
+                          config_file=os.path.join(tmp, "config.json"))
+        for index, path in enumerate(files):
+            core.load(index, path)
+        core.engine.play()
+        core.engine.check_drift()
+        assert core.engine.mode == MODE_MIX and not core.engine.drift.history
+        core.engine.stop()
+        core.close()
+    print("✓ 漂移监测正常")
+
+
+def main():
+    """主测试函数"""
+    print("=" * 50)
+    print("混音引擎测试")
+    print("=" * 50)
+
+    try:
+        test_read_wav()
+        test_mixer_single_clock()
+        test_mixer_loop()
+        test_gain_ramp()
+        test_mixer_gapless()
+        test_time_stretch()
+        test_pitch_shift()
+        test_mixer_tempo_position()
+        test_pcm_cache()
+        test_prerender()
+        test_library()
+        test_headless_core()
+        test_background_loading()
+        test_loop_while_playing()
+        test_threaded_output()
+        test_seek_coalescing()
+        test_settings_store()
+        test_song_settings()
+        test_loudness()
+        test_export()
+        test_peak_pyramid()
+        test_drift_monitor()
+        test_stall_watchdog()
+        test_benchmark()
+    except AssertionError as e:
+        print(f"✗ 测试失败: {e}")
+        return False
+
+    print("\n" + "=" * 50)
+    print("所有测试通过！")
+    print("=" * 50)
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
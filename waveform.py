@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+波形峰值索引
+对每个音轨预先计算多级 min/max 峰值金字塔，绘制时按像素宽度选级别，
+重绘开销只和像素数有关，和音频长度无关
+"""
+
+import os
+
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+
+# 最细一级每256帧一个峰值，往上每级合并4个
+BASE_BLOCK = 256
+LEVEL_FACTOR = 4
+MIN_LEVEL_BLOCKS = 256
+
+# 分块读取，避免一次性把整首歌读进内存
+READ_CHUNK_FRAMES = BASE_BLOCK * 4096
+
+
+class PeakPyramid:
+    """多级峰值，levels[i] 为 (mins, maxs)，每块 BASE_BLOCK * LEVEL_FACTOR**i 帧"""
+
+    def __init__(self, levels, total_frames):
+        self.levels = levels
+        self.total_frames = total_frames
+
+    def block_size(self, level):
+        return BASE_BLOCK * LEVEL_FACTOR ** level
+
+    def columns(self, width, start=0, end=None):
+        """把 [start, end) 帧范围压成width列，返回归一化的 (mins, maxs)"""
+        end = self.total_frames if end is None else end
+        if width <= 0 or end <= start or not self.levels:
+            return np.zeros(0, np.float32), np.zeros(0, np.float32)
+
+        # 选每像素帧数以内最粗的一级，每列最多合并LEVEL_FACTOR个块
+        frames_per_px = (end - start) / width
+        level = 0
+        while (level + 1 < len(self.levels)
+               and self.block_size(level + 1) <= frames_per_px):
+            level += 1
+        mins, maxs = self.levels[level]
+        size = self.block_size(level)
+
+        first = start // size
+        last = min(len(mins), -(-end // size))
+        if last <= first:
+            return np.zeros(0, np.float32), np.zeros(0, np.float32)
+        edges = (start + np.arange(width) * frames_per_px) // size
+        edges = np.clip(edges.astype(np.int64) - first, 0, max(0, last - first - 1))
+        col_mins = np.minimum.reduceat(mins[first:last], edges)
+        col_maxs = np.maximum.reduceat(maxs[first:last], edges)
+        return col_mins / 32768.0, col_maxs / 32768.0
+
+    def save(self, path):
+        arrays = {'total_frames': np.array([self.total_frames])}
+        for i, (mins, maxs) in enumerate(self.levels):
+            arrays[f'min{i}'] = mins
+            arrays[f'max{i}'] = maxs
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            levels = []
+            while f'min{len(levels)}' in data:
+                i = len(levels)
+                levels.append((data[f'min{i}'], data[f'max{i}']))
+            return cls(levels, int(data['total_frames'][0]))
+
+
+def build_peaks(samples):
+    """从 (帧数, 声道) 的int16数组计算峰值金字塔，按块读取以兼容内存映射"""
+    total = len(samples)
+    mins_parts = []
+    maxs_parts = []
+    for start in range(0, total, READ_CHUNK_FRAMES):
+        part = np.asarray(samples[start:start + READ_CHUNK_FRAMES])
+        edges = np.arange(0, len(part), BASE_BLOCK)
+        # 多个声道合成一条波形：取各声道的最小/最大值
+        mins_parts.append(np.minimum.reduceat(part.min(axis=1), edges))
+        maxs_parts.append(np.maximum.reduceat(part.max(axis=1), edges))
+
+    if not mins_parts:
+        return PeakPyramid([], 0)
+
+    mins = np.concatenate(mins_parts).astype(np.int16)
+    maxs = np.concatenate(maxs_parts).astype(np.int16)
+    levels = [(mins, maxs)]
+    while len(mins) > MIN_LEVEL_BLOCKS:
+        edges = np.arange(0, len(mins), LEVEL_FACTOR)
+        mins = np.minimum.reduceat(mins, edges)
+        maxs = np.maximum.reduceat(maxs, edges)
+        levels.append((mins, maxs))
+    return PeakPyramid(levels, total)
+
+
+def load_or_build_peaks(samples, peaks_path=None):
+    """有保存的峰值就直接读，否则计算并保存"""
+    if peaks_path and os.path.exists(peaks_path):
+        try:
+            pyramid = PeakPyramid.load(peaks_path)
+            if pyramid.total_frames == len(samples):
+                return pyramid
+        except (OSError, ValueError, KeyError):
+            pass
+
+    pyramid = build_peaks(samples)
+    if peaks_path:
+        try:
+            os.makedirs(os.path.dirname(peaks_path) or ".", exist_ok=True)
+            pyramid.save(peaks_path)
+        except OSError as e:
+            print(f"保存波形峰值出错: {e}")
+    return pyramid
+
+
+class PeakBuilder(QThread):
+    """后台计算峰值，完成后通过信号交回界面线程"""
+
+    peaksReady = pyqtSignal(int, object)
+
+    def __init__(self, index, samples, peaks_path=None, parent=None):
+        super().__init__(parent)
+        self.index = index
+        self.samples = samples
+        self.peaks_path = peaks_path
+
+    def run(self):
+        try:
+            pyramid = load_or_build_peaks(self.samples, self.peaks_path)
+        except Exception as e:
+            print(f"计算波形峰值出错: {e}")
+            return
+        self.peaksReady.emit(self.index, pyramid)